@@ -1,111 +1,229 @@
-import pandas as pd
-
+import numpy as np
 import pandas as pd
 import threading
 import time
 
+from bar_sinks import RingBufferSink
+from bar_engine import BarState, carried_cumsum, tick_rule, aggressor_signs
+from checkpoint import load_checkpoint, save_checkpoint
+
+
+def _bar_buffer(bar_type, max_bars):
+    return RingBufferSink(max_bars, dtypes={
+        'date': object, 'time': object, 'cum_ticks': np.int64, 'open': np.float64, 'high': np.float64,
+        'low': np.float64, 'close': np.float64, f'cum_{bar_type}_value': np.int64 if bar_type == 'tick' else np.float64,
+        'cum_buy_volume': np.float64, 'cum_volume': np.float64})
+
+
 class RealTimeBars:
-    def __init__(self, threshold, bar_type, batch_size=1024):
+    def __init__(self, threshold, bar_type, batch_size=1024, on_bar=None, engine='auto', max_bars=100000):
         self.threshold = threshold
         self.bar_type = bar_type
-        self.accumulated = 0
-        self.bars = []
+        # Bar in progress, shared with the historical builders
+        self.state = BarState(bar_type)
+        # Only the last max_bars bars are kept
+        self.bars = _bar_buffer(bar_type, max_bars)
+        # Running totals since the first trade
         self.cum_buy_volume = 0
         self.cum_ticks = 0
         self.cum_vol_value = 0
-        self.open_price = self.bucket_low_price = self.bucket_high_price = 9999999999
-        self.next_bar_start = True
+        self.prev_price = None
+        self.prev_tick_rule = 0
         self.lock = threading.Lock()
         self.batch_size = batch_size
+        # Called with every new bar, e.g. to publish it
+        self.on_bar = on_bar
+        self.engine = engine
+
+    @property
+    def accumulated(self):
+        return self.state.metric_value
+
+    def __getstate__(self):
+        # The lock and the callback cannot be pickled, and the bars already emitted are not needed to resume
+        state = self.__dict__.copy()
+        del state['lock'], state['on_bar']
+        state['bars'] = self.bars.capacity
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.bars = _bar_buffer(self.bar_type, state['bars'])
+        self.lock = threading.Lock()
+        self.on_bar = None
 
-    def handle_trade(self, trade):
-        with self.lock:
-            if self.next_bar_start:
-                self.open_price = self.bucket_low_price = self.bucket_high_price = trade['Price']
-                self.next_bar_start = False
-            if trade['Price'] < self.bucket_low_price:
-                self.bucket_low_price = trade['Price']
-            if trade['Price'] > self.bucket_high_price:
-                self.bucket_high_price = trade['Price']
-
-            if self.bar_type == 'dollar':
-                self.accumulated += trade['Price'] * trade['Volume']
-            elif self.bar_type == 'volume':
-                self.accumulated += trade['Volume']
-            elif self.bar_type == 'tick':
-                self.accumulated += 1
-
-            self.cum_buy_volume += trade['Volume']
-            self.cum_ticks += 1
-            self.cum_vol_value += trade['Volume']
+    # Constructor arguments and running state saved in checkpoints. The bars already emitted are not saved.
+    CHECKPOINT_SETTINGS = ('threshold', 'bar_type', 'batch_size', 'engine')
+    CHECKPOINT_STATE = ('state', 'cum_buy_volume', 'cum_ticks', 'cum_vol_value', 'prev_price', 'prev_tick_rule')
 
-            if self.accumulated >= self.threshold:
-                high_price = self.bucket_high_price
-                low_price = self.bucket_low_price
-                close_price = trade['Price']
+    def save_checkpoint(self, path, offset=None):
+        """
+        Saves the bar in progress and the running totals, to resume after a restart with from_checkpoint. The size of
+        the checkpoint does not depend on the number of bars kept.
 
-                self.bars.append(
-                    [trade['Date'], trade['Time'], self.cum_ticks, self.open_price, high_price, low_price, close_price,
-                     self.accumulated, self.cum_buy_volume, self.cum_vol_value])
-                self.next_bar_start = True
-                self.accumulated = 0
-                print(f"{self.bar_type.capitalize()} Bar created: {self.bars[-1]}")
+        :param path: (str) Path of the checkpoint file, replaced atomically
+        :param offset: Position of the last trade handled, e.g. its trade id, to resume the input from
+        """
+        with self.lock:
+            settings = {name: getattr(self, name) for name in self.CHECKPOINT_SETTINGS}
+            settings['max_bars'] = self.bars.capacity
+            save_checkpoint(path, {'settings': settings,
+                                   'state': {name: getattr(self, name) for name in self.CHECKPOINT_STATE},
+                                   'offset': offset})
 
-    def get_bars(self):
-        columns = ['date', 'time', 'cum_ticks', 'open',
-                   'high', 'low', 'close', f'cum_{self.bar_type}_value',
-                   'cum_buy_volume', 'cum_volume']
-        return pd.DataFrame(self.bars, columns=columns)
+    @staticmethod
+    def from_checkpoint(path, on_bar=None):
+        """
+        :param path: (str) Path of a checkpoint saved by save_checkpoint
+        :param on_bar: (callable) Called with every new bar
+        :return: (tuple) Builder resumed from the checkpoint, with no bars kept yet, and the offset saved with it
+        """
+        checkpoint = load_checkpoint(path)
+        builder = RealTimeBars(on_bar=on_bar, **checkpoint['settings'])
+        for name, value in checkpoint['state'].items():
+            setattr(builder, name, value)
+        return builder, checkpoint['offset']
+
+    def _emit(self, bar):
+        self.bars.append(bar)
+        if self.on_bar is not None:
+            self.on_bar(bar)
+
+    def handle_trade(self, trade):
+        """
+        :param trade: (dict) Date, Time, Price and Volume of the trade, and optionally IsBuyerMaker
+        :return: (list) Bar closed by the trade, None if the bar in progress is still open
+        """
+        with self.lock:
+            price = trade['Price']
+            volume = trade['Volume']
+
+            # Sign the trade with the aggressor flag when the stream provides it, the tick rule otherwise
+            is_buyer_maker = trade.get('IsBuyerMaker')
+            if is_buyer_maker is not None:
+                self.prev_tick_rule = -1 if is_buyer_maker else 1
+            elif self.prev_price is not None and price != self.prev_price:
+                self.prev_tick_rule = 1 if price > self.prev_price else -1
+            self.prev_price = price
+            buy_volume = volume if self.prev_tick_rule > 0 else 0
+            self.cum_buy_volume += buy_volume
+            self.cum_ticks += 1
+            self.cum_vol_value += volume
+
+            bar = self.state.step(price, volume, buy_volume, self.threshold)
+            if bar is not None:
+                bar = [trade['Date'], trade['Time'], self.cum_ticks, *bar[:4], bar[(7, 4, 6)[self.state.metric_code]],
+                       self.cum_buy_volume, self.cum_vol_value]
+                self._emit(bar)
+            return bar
+
+    def handle_trades(self, trades):
+        """
+        Processes a batch of trades at once, e.g. the trades received over the last few milliseconds, with the same
+        threshold kernel as the historical bars. The bars are the same as calling handle_trade on every trade.
+
+        :param trades: (pd.DataFrame, dict of arrays or structured np.ndarray) Date, Time, Price and Volume of each
+                       trade, and optionally IsBuyerMaker
+        """
+        prices = np.asarray(trades['Price'], dtype=np.float64)
+        if len(prices) == 0:
+            return
+        volumes = np.asarray(trades['Volume'], dtype=np.float64)
+        with self.lock:
+            fields = trades.dtype.names if isinstance(trades, np.ndarray) else trades
+            if 'IsBuyerMaker' in fields:
+                signs = aggressor_signs(np.asarray(trades['IsBuyerMaker']))
+            else:
+                signs = tick_rule(prices, self.prev_price, self.prev_tick_rule)
+            self.prev_price, self.prev_tick_rule = float(prices[-1]), int(signs[-1])
+            buy_volumes = np.where(signs > 0, volumes, 0)
+            columns = self.state.run(self.threshold, prices, volumes, buy_volumes, self.engine)
+
+            ends = columns['end']
+            buy_volume_cs = carried_cumsum(buy_volumes, self.cum_buy_volume)
+            volume_cs = carried_cumsum(volumes, self.cum_vol_value)
+            bars = dict(zip(self.bars.column_names, (
+                np.asarray(trades['Date'])[ends], np.asarray(trades['Time'])[ends], self.cum_ticks + ends + 1,
+                columns['open'], columns['high'], columns['low'], columns['close'],
+                columns[('dollar', 'volume', 'ticks')[self.state.metric_code]], buy_volume_cs[ends],
+                volume_cs[ends])))
+            self.bars.write(bars)
+            if self.on_bar is not None:
+                for bar in zip(*(values.tolist() for values in bars.values())):
+                    self.on_bar(list(bar))
+
+            self.cum_ticks += len(prices)
+            self.cum_buy_volume, self.cum_vol_value = buy_volume_cs[-1].item(), volume_cs[-1].item()
+
+    def get_bars(self, last=None, copy=True):
+        """
+        :param last: (int) Number of most recent bars, None for all the bars kept
+        :param copy: (bool) False returns a DataFrame over views of the bar buffer, which later bars overwrite
+        :return: (pd.DataFrame) Last bars
+        """
+        with self.lock:
+            return self.bars.result(last, copy)
+
+
+def _read_threshold_bars(file_path, metric, threshold, batch_size, engine):
+    """
+    Reads the csv in chunks and samples the bars with the shared bar_engine kernel. Besides the metric that is reset
+    on every bar, these bars report running totals of ticks, volume, buy volume and dollar value since the start of
+    the file, which are sampled from sequential cumulative sums at the closing tick of each bar. Trades are signed with
+    the IsBuyerMaker column when the file has one, the tick rule otherwise.
+    """
+    state = BarState(metric)
+    n_seen = 0
+    running_volume = running_buy_volume = running_dollar = 0
+    prev_price, prev_tick_rule = None, 0
+    parts = []
+    for chunk in pd.read_csv(file_path, chunksize=batch_size):
+        if chunk.empty:
+            continue
+        prices = chunk['Price'].to_numpy()
+        volumes = chunk['Volume'].to_numpy()
+        if 'IsBuyerMaker' in chunk:
+            signs = aggressor_signs(chunk['IsBuyerMaker'].to_numpy())
+        else:
+            signs = tick_rule(prices, prev_price, prev_tick_rule)
+        prev_price, prev_tick_rule = prices[-1], int(signs[-1])
+        buy_volumes = np.where(signs > 0, volumes, 0)
+        columns = state.run(threshold, prices, volumes, buy_volumes, engine)
+        ends = columns['end']
+
+        volume_cs = carried_cumsum(volumes, running_volume)
+        buy_volume_cs = carried_cumsum(buy_volumes, running_buy_volume)
+        dollar_cs = carried_cumsum(prices * volumes, running_dollar)
+        running_volume, running_buy_volume, running_dollar = volume_cs[-1], buy_volume_cs[-1], dollar_cs[-1]
+        columns['date'] = chunk['Date'].to_numpy()[ends]
+        columns['time'] = chunk['Time'].to_numpy()[ends]
+        columns['running_ticks'] = n_seen + ends + 1
+        columns['running_volume'] = volume_cs[ends]
+        columns['running_buy_volume'] = buy_volume_cs[ends]
+        columns['running_dollar'] = dollar_cs[ends]
+        n_seen += len(chunk)
+        parts.append(columns)
+
+    if not parts:
+        return {key: np.empty(0) for key in ('date', 'time', 'open', 'high', 'low', 'close', 'volume', 'buy_volume',
+                                             'ticks', 'dollar', 'running_ticks', 'running_volume',
+                                             'running_buy_volume', 'running_dollar')}
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
 
 
 class DataStructures:
     @staticmethod
-    def get_volume_bars(file_path, threshold, batch_size=1000000, verbose=False, to_csv=False, output_path=None):
-        # Read the CSV file in chunks
-        chunk_iter = pd.read_csv(file_path, chunksize=batch_size)
-
-        # Initialize variables a a
-        volume_accumulated = 0
-        bars = []
-        cum_buy_volume = 0
-        cum_ticks = 0
-        cum_dollar_value = 0
-        open_price, bucket_low_price, bucket_high_price = 9999999999, 9999999999, 9999999999
-        next_vol_start = True
-
-        for chunk in chunk_iter:
-            for index, row in chunk.iterrows():
-                if next_vol_start is True:
-                    open_price, bucket_low_price, bucket_high_price = row['Price'], row['Price'], row['Price']
-                    next_vol_start = False
-                if row['Price'] < bucket_low_price:
-                    bucket_low_price = row['Price']
-                if row['Price'] > bucket_high_price:
-                    bucket_high_price = row['Price']
-                volume_accumulated += row['Volume']
-                cum_buy_volume += row['Volume']  # Assuming all are buy for this
-                cum_ticks += 1
-                cum_dollar_value += row['Price'] * row['Volume']
-
-                if volume_accumulated >= threshold:
-                    # open_price = chunk.loc[chunk.index[0], 'Price']
-                    high_price = bucket_high_price
-                    low_price = bucket_low_price
-                    close_price = row['Price']
-
-                    bars.append([row['Date'], row['Time'], cum_ticks, open_price, high_price, low_price, close_price,
-                                 volume_accumulated, cum_buy_volume, cum_dollar_value])
-                    # Reset
-                    next_vol_start = True
-                    volume_accumulated = 0
-                    if verbose:
-                        print(f"Bar created: {bars[-1]}")
-
-        # Create a DataFrame from the bars
-        columns = ['date', 'time', 'cum_ticks', 'open',
-                   'high', 'low', 'close', 'cum_volume',
-                   'cum_buy_volume', 'cum_dollar_value']
-        bar_df = pd.DataFrame(bars, columns=columns)
+    def get_volume_bars(file_path, threshold, batch_size=1000000, verbose=False, to_csv=False, output_path=None,
+                        engine='auto'):
+        bars = _read_threshold_bars(file_path, 'volume', threshold, batch_size, engine)
+        bar_df = pd.DataFrame({'date': bars['date'], 'time': bars['time'], 'cum_ticks': bars['running_ticks'],
+                               'open': bars['open'], 'high': bars['high'], 'low': bars['low'],
+                               'close': bars['close'], 'cum_volume': bars['volume'],
+                               'cum_buy_volume': bars['running_buy_volume'],
+                               'cum_dollar_value': bars['running_dollar']})
+        if verbose:
+            for bar in bar_df.itertuples(index=False):
+                print(f"Bar created: {list(bar)}")
 
         if to_csv:
             bar_df.to_csv(output_path, index=False)
@@ -113,103 +231,29 @@ class DataStructures:
         return bar_df
 
     @staticmethod
-    def get_tick_bars(file_path, threshold, batch_size=1000000, verbose=False, to_csv=False, output_path=None):
-        # Read the CSV file in chunks
-        chunk_iter = pd.read_csv(file_path, chunksize=batch_size)
-
-        # Initialize variables a a
-        ticks_accumulated = 0
-        bars = []
-        cum_buy_volume = 0
-        cum_vol = 0
-        cum_dollar_value = 0
-        open_price, bucket_low_price, bucket_high_price = 9999999999, 9999999999, 9999999999
-        next_tick_start = True
-
-        for chunk in chunk_iter:
-            for index, row in chunk.iterrows():
-                if next_tick_start is True:
-                    open_price, bucket_low_price, bucket_high_price = row['Price'], row['Price'], row['Price']
-                    next_tick_start = False
-                if row['Price'] < bucket_low_price:
-                    bucket_low_price = row['Price']
-                if row['Price'] > bucket_high_price:
-                    bucket_high_price = row['Price']
-                ticks_accumulated += 1
-                cum_buy_volume += row['Volume']  # Assuming all are buy for this
-                cum_vol += row['Volume']
-                cum_dollar_value += row['Price'] * row['Volume']
-
-                if ticks_accumulated >= threshold:
-                    # open_price = chunk.loc[chunk.index[0], 'Price']
-                    high_price = bucket_high_price
-                    low_price = bucket_low_price
-                    close_price = row['Price']
-
-                    bars.append([row['Date'], row['Time'], cum_vol, open_price, high_price, low_price, close_price,
-                                 ticks_accumulated, cum_buy_volume, cum_dollar_value])
-                    # Reset
-                    next_tick_start = True
-                    ticks_accumulated = 0
-                    # if verbose:
-                    #     print(f"Bar created: {bars[-1]}")
-
-        # Create a DataFrame from the bars
-        columns = ['date', 'time', 'volume', 'open',
-                   'high', 'low', 'close', 'cum_ticks',
-                   'cum_buy_volume', 'cum_dollar_value']
-        bar_df = pd.DataFrame(bars, columns=columns)
+    def get_tick_bars(file_path, threshold, batch_size=1000000, verbose=False, to_csv=False, output_path=None,
+                      engine='auto'):
+        bars = _read_threshold_bars(file_path, 'tick', threshold, batch_size, engine)
+        bar_df = pd.DataFrame({'date': bars['date'], 'time': bars['time'], 'volume': bars['running_volume'],
+                               'open': bars['open'], 'high': bars['high'], 'low': bars['low'],
+                               'close': bars['close'], 'cum_ticks': bars['ticks'],
+                               'cum_buy_volume': bars['running_buy_volume'],
+                               'cum_dollar_value': bars['running_dollar']})
 
         if to_csv:
             bar_df.to_csv(output_path, index=False)
         return bar_df
 
     @staticmethod
-    def get_dollar_bars(file_path, threshold, batch_size=1000000, verbose=False, to_csv=False, output_path=None):
-        # Read the CSV file in chunks
+    def get_dollar_bars(file_path, threshold, batch_size=1000000, verbose=False, to_csv=False, output_path=None,
+                        engine='auto'):
         start_time = time.time()
-        chunk_iter = pd.read_csv(file_path, chunksize=batch_size)
-
-        dollar_accumulated = 0
-        bars = []
-        cum_buy_volume = 0
-        cum_ticks = 0
-        cum_vol_value = 0
-        open_price, bucket_low_price, bucket_high_price = 9999999999, 9999999999, 9999999999
-        next_dollar_start = True
-
-        for chunk in chunk_iter:
-            for index, row in chunk.iterrows():
-                if next_dollar_start is True:
-                    open_price, bucket_low_price, bucket_high_price = row['Price'], row['Price'], row['Price']
-                    next_dollar_start = False
-                if row['Price'] < bucket_low_price:
-                    bucket_low_price = row['Price']
-                if row['Price'] > bucket_high_price:
-                    bucket_high_price = row['Price']
-                dollar_accumulated += row['Price'] * row['Volume']
-                cum_buy_volume += row['Volume']  # Assuming all are buy for this
-                cum_ticks += 1
-                cum_vol_value += row['Volume']
-
-                if dollar_accumulated >= threshold:
-                    high_price = bucket_high_price
-                    low_price = bucket_low_price
-                    close_price = row['Price']
-
-                    bars.append([row['Date'], row['Time'], cum_ticks, open_price, high_price, low_price, close_price,
-                                 dollar_accumulated, cum_buy_volume, cum_vol_value])
-                    # Reset
-                    next_dollar_start = True
-                    dollar_accumulated = 0
-                    # if verbose:
-                    #     print(f"Bar created: {bars[-1]}")
-
-        # Create a DataFrame from the bars
-        columns = ['date', 'time', 'cum_ticks', 'open',
-                   'high', 'low', 'close', 'cum_dollar_value',
-                   'cum_buy_volume', 'cum_volume']
-        bar_df = pd.DataFrame(bars, columns=columns)
+        bars = _read_threshold_bars(file_path, 'dollar', threshold, batch_size, engine)
+        bar_df = pd.DataFrame({'date': bars['date'], 'time': bars['time'], 'cum_ticks': bars['running_ticks'],
+                               'open': bars['open'], 'high': bars['high'], 'low': bars['low'],
+                               'close': bars['close'], 'cum_dollar_value': bars['dollar'],
+                               'cum_buy_volume': bars['running_buy_volume'],
+                               'cum_volume': bars['running_volume']})
 
         if to_csv:
 
@@ -0,0 +1,529 @@
+"""
+Array kernels for the threshold bars (dollar, volume and tick).
+
+A threshold bar is closed on the first tick at which the cumulative metric reaches the threshold, after which the
+accumulators are reset to zero. The functions in this module reproduce that logic on whole NumPy arrays instead of
+walking the ticks one row at a time. Cumulative sums are always taken with np.cumsum, which adds strictly left to right,
+so the bars are bit-identical to the ones built by the reference per-tick loop.
+
+The same sampling loop is also available as a Numba kernel, selected with engine='numba' (or 'auto', which picks it
+whenever numba is installed). Reset-on-threshold sampling is inherently sequential, and the compiled loop avoids the
+temporary arrays of the NumPy search. It falls back to the NumPy engine when numba is missing.
+
+Ticks are signed with the exchange's aggressor flag when it is available, or with the tick rule otherwise, and the
+volume of buy-initiated ticks is accumulated into the buy volume of every bar.
+
+The threshold is either a scalar or an array holding the threshold in effect at each tick, e.g. a daily threshold
+aligned to the ticks once per batch with align_thresholds.
+"""
+
+from typing import Optional, Tuple, Union
+import re
+
+import numpy as np
+import pandas as pd
+
+from jit import compiled
+
+ENGINES = ('auto', 'numba', 'numpy')
+METRIC_CODES = {'dollar': 0, 'volume': 1, 'tick': 2}
+UNIT_NANOSECONDS = {'s': 10 ** 9, 'ms': 10 ** 6, 'us': 10 ** 3, 'ns': 1}
+# Timestamps without time zone, e.g. 2023-09-01 00:00:00.037
+_ISO_DATETIME = re.compile(r'\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$')
+
+# Smallest window (in ticks) searched for the next threshold crossing.
+_MIN_WINDOW = 256
+# Initial number of bars the compiled kernel can write before its output buffers are grown.
+_MIN_BAR_CAPACITY = 1024
+
+
+def carried_cumsum(values: np.ndarray, carry) -> np.ndarray:
+    """
+    Cumulative sum of values started from carry, with the same rounding as adding the values one by one to carry.
+
+    :param values: (np.ndarray) Values to accumulate
+    :param carry: (float) Value of the accumulator before values[0]
+    :return: (np.ndarray) Running value of the accumulator after each element
+    """
+    seg = values.copy()
+    seg[0] = carry + seg[0]
+    return np.cumsum(seg)
+
+
+def _sequential_sum(values: np.ndarray, carry):
+    """
+    Sum of values added one by one to carry. np.sum uses pairwise summation and would not be bit-identical.
+
+    :param values: (np.ndarray) Values to accumulate
+    :param carry: (float) Value of the accumulator before values[0]
+    :return: (float) Final value of the accumulator
+    """
+    if len(values) == 0:
+        return carry
+    return carried_cumsum(values, carry)[-1]
+
+
+def tick_rule(prices: np.ndarray, prev_price=None, prev_tick_rule: int = 0) -> np.ndarray:
+    """
+    Advances in Financial Machine Learning, page 29.
+
+    Vectorized tick rule: b_t = sign(p_t - p_(t-1)) if the price changed, b_(t-1) otherwise. Zeros are forward filled
+    from the last price change, or from prev_tick_rule before the first change of the batch.
+
+    :param prices: (np.ndarray) Prices of the batch
+    :param prev_price: (float) Last price of the previous batch, None at the start of the data
+    :param prev_tick_rule: (int) Last signed tick of the previous batch
+    :return: (np.ndarray) Signed ticks (int8, -1, 0 or 1)
+    """
+    n_rows = len(prices)
+    diff = np.empty(n_rows, dtype=np.float64)
+    if n_rows == 0:
+        return diff.astype(np.int8)
+    diff[0] = 0 if prev_price is None else prices[0] - prev_price
+    np.subtract(prices[1:], prices[:-1], out=diff[1:])
+    signs = np.sign(diff).astype(np.int8)
+
+    last_change = np.where(signs != 0, np.arange(n_rows), -1)
+    np.maximum.accumulate(last_change, out=last_change)
+    return np.where(last_change >= 0, signs[last_change], prev_tick_rule).astype(np.int8)
+
+
+def detect_time_unit(values: np.ndarray) -> str:
+    """
+    Unit of numeric epoch timestamps, from the magnitude of the first one: after 1973 timestamps in seconds are below
+    1e11, in milliseconds below 1e14 and in microseconds below 1e17 until the year 5138.
+
+    :param values: (np.ndarray) Numeric timestamps
+    :return: (str) 's', 'ms', 'us' or 'ns'
+    """
+    magnitude = abs(float(values[0])) if len(values) else 0.0
+    for unit, bound in (('s', 1e11), ('ms', 1e14), ('us', 1e17)):
+        if magnitude < bound:
+            return unit
+    return 'ns'
+
+
+def to_epoch_ns(values, unit: Optional[str] = 'ms') -> np.ndarray:
+    """
+    Converts timestamps to integer nanoseconds since the epoch.
+
+    :param values: (array-like) datetime64 values, datetime strings or Timestamps, or numbers since the epoch
+    :param unit: (str) Unit of numeric timestamps: 's', 'ms', 'us' or 'ns'. Milliseconds by default, as in exchange
+                 data; None detects it with detect_time_unit.
+    :return: (np.ndarray) int64 nanoseconds since the epoch
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'M':
+        return values.astype('datetime64[ns]', copy=False).view(np.int64)
+    if values.dtype.kind in 'iuf':
+        unit = unit or detect_time_unit(values)
+        if values.dtype.kind != 'f':
+            return values.astype(np.int64) * UNIT_NANOSECONDS[unit]
+        times = pd.to_datetime(values, unit=unit)
+    else:
+        if len(values) and isinstance(values[0], str) and _ISO_DATETIME.match(values[0]):
+            # NumPy parses naive ISO 8601 strings several times faster than pd.to_datetime
+            try:
+                return values.astype('datetime64[ns]').view(np.int64)
+            except ValueError:
+                pass
+        times = pd.to_datetime(values)
+    return np.asarray(times, dtype='datetime64[ns]').view(np.int64)
+
+
+def align_thresholds(threshold_times: np.ndarray, threshold_values: np.ndarray, tick_times: np.ndarray) -> np.ndarray:
+    """
+    Threshold in effect at each tick: the value of the last threshold timestamp at or before the tick, found with a
+    single searchsorted over the batch. Ticks before the first timestamp use the first threshold.
+
+    :param threshold_times: (np.ndarray) Sorted int64 epoch-ns timestamps from which each threshold applies
+    :param threshold_values: (np.ndarray) Threshold values
+    :param tick_times: (np.ndarray) int64 epoch-ns timestamps of the ticks
+    :return: (np.ndarray) Threshold per tick
+    """
+    positions = np.searchsorted(threshold_times, tick_times, side='right') - 1
+    return threshold_values[np.maximum(positions, 0)]
+
+
+def aggressor_signs(is_buyer_maker: np.ndarray) -> np.ndarray:
+    """
+    Signed ticks from the exchange's aggressor flag. When the buyer is the maker, the trade was initiated by a seller.
+
+    :param is_buyer_maker: (np.ndarray) Boolean flag per trade (Binance 'isBuyerMaker')
+    :return: (np.ndarray) Signed ticks (int8, -1 or 1)
+    """
+    return np.where(np.asarray(is_buyer_maker, dtype=bool), -1, 1).astype(np.int8)
+
+
+def _threshold_loop(metric_code, thresholds, threshold_step, prices, volumes, buy_volumes, start, ends, opens, highs,
+                    lows, volume_sums, buy_volume_sums, tick_counts, dollar_sums, cum_dollar_value, cum_volume,
+                    cum_buy_volume, cum_ticks, in_bar, open_price, high_price, low_price):
+    """
+    Per-tick accumulate-and-reset loop, compiled with numba by threshold_bars. Bars are written to the output buffers
+    until they are full, and the position of the next unprocessed tick is returned so the caller can resume.
+    The threshold of tick i is thresholds[i * threshold_step], so a step of 0 uses a single threshold.
+
+    :return: (tuple) Number of bars written, next row, and the accumulators of the bar in progress
+    """
+    n_rows = prices.shape[0]
+    capacity = ends.shape[0]
+    n_bars = 0
+    i = start
+    while i < n_rows and n_bars < capacity:
+        price = prices[i]
+        volume = volumes[i]
+        cum_dollar_value += price * volume
+        cum_ticks += 1
+        cum_volume += volume
+        cum_buy_volume += buy_volumes[i]
+        if not in_bar:
+            open_price = price
+            high_price = price
+            low_price = price
+            in_bar = True
+        else:
+            if price > high_price:
+                high_price = price
+            if price < low_price:
+                low_price = price
+
+        threshold = thresholds[i * threshold_step]
+        if metric_code == 0:
+            reached = cum_dollar_value >= threshold
+        elif metric_code == 1:
+            reached = cum_volume >= threshold
+        else:
+            reached = cum_ticks >= threshold
+        if reached:
+            ends[n_bars] = i
+            opens[n_bars] = open_price
+            highs[n_bars] = high_price
+            lows[n_bars] = low_price
+            volume_sums[n_bars] = cum_volume
+            buy_volume_sums[n_bars] = cum_buy_volume
+            tick_counts[n_bars] = cum_ticks
+            dollar_sums[n_bars] = cum_dollar_value
+            n_bars += 1
+            cum_dollar_value = 0.0
+            cum_volume = 0.0
+            cum_buy_volume = 0.0
+            cum_ticks = 0
+            in_bar = False
+        i += 1
+    return (n_bars, i, cum_dollar_value, cum_volume, cum_buy_volume, cum_ticks, in_bar, open_price, high_price,
+            low_price)
+
+
+def _compiled_threshold_bars(kernel, metric: str, threshold, prices: np.ndarray, volumes: np.ndarray,
+                             buy_volumes: np.ndarray, state: tuple) -> Tuple[dict, tuple]:
+    """
+    Runs the compiled sampling loop over a batch, growing the output buffers whenever they fill up.
+    Arguments and return values are the same as threshold_bars.
+    """
+    prices = np.ascontiguousarray(prices, dtype=np.float64)
+    volumes = np.ascontiguousarray(volumes, dtype=np.float64)
+    buy_volumes = np.ascontiguousarray(buy_volumes, dtype=np.float64)
+    thresholds = np.ascontiguousarray(np.atleast_1d(threshold), dtype=np.float64)
+    threshold_step = int(np.ndim(threshold) == 1)
+    cum_dollar_value, cum_volume, cum_buy_volume, cum_ticks, open_price, high_price, low_price = state
+    in_bar = open_price is not None
+    if not in_bar:
+        open_price = high_price = low_price = 0.0
+    loop_state = (float(cum_dollar_value), float(cum_volume), float(cum_buy_volume), int(cum_ticks), in_bar,
+                  float(open_price), float(high_price), float(low_price))
+
+    parts = []
+    start = 0
+    capacity = _MIN_BAR_CAPACITY
+    while start < len(prices):
+        buffers = (np.empty(capacity, dtype=np.int64), np.empty(capacity), np.empty(capacity), np.empty(capacity),
+                   np.empty(capacity), np.empty(capacity), np.empty(capacity, dtype=np.int64), np.empty(capacity))
+        n_bars, start, *loop_state = kernel(METRIC_CODES[metric], thresholds, threshold_step, prices, volumes,
+                                            buy_volumes, start, *buffers, *loop_state)
+        parts.append([buffer[:n_bars] for buffer in buffers])
+        capacity *= 2
+
+    names = ('end', 'open', 'high', 'low', 'volume', 'buy_volume', 'ticks', 'dollar')
+    if parts:
+        columns = {name: np.concatenate([part[k] for part in parts]) for k, name in enumerate(names)}
+    else:
+        columns = {name: np.empty(0, dtype=np.int64 if name in ('end', 'ticks') else np.float64) for name in names}
+    columns['close'] = prices[columns['end']]
+
+    cum_dollar_value, cum_volume, cum_buy_volume, cum_ticks, in_bar, open_price, high_price, low_price = loop_state
+    if not in_bar:
+        open_price = high_price = low_price = None
+    return columns, (cum_dollar_value, cum_volume, cum_buy_volume, cum_ticks, open_price, high_price, low_price)
+
+
+def _tick_ends(n_rows: int, threshold, cum_ticks: int) -> np.ndarray:
+    """
+    Positions of the ticks closing a tick bar. Crossings only depend on the tick count, so they are computed directly.
+
+    :param n_rows: (int) Number of ticks in the batch
+    :param threshold: (float) Number of ticks per bar
+    :param cum_ticks: (int) Ticks already accumulated in the bar carried from the previous batch
+    :return: (np.ndarray) Positions of the closing ticks
+    """
+    first_len = max(int(np.ceil(threshold - cum_ticks)), 1)
+    bar_len = max(int(np.ceil(threshold)), 1)
+    return np.arange(first_len - 1, n_rows, bar_len, dtype=np.int64)
+
+
+def _tick_bar_sums(values: np.ndarray, ends: np.ndarray, carry) -> Tuple[np.ndarray, object]:
+    """
+    Per-bar sequential sums for tick bars. All bars but the first have the same length, so they are summed in one
+    np.cumsum over a 2-d view of the batch.
+
+    :param values: (np.ndarray) Values to accumulate (volume or dollar value)
+    :param ends: (np.ndarray) Positions of the closing ticks
+    :param carry: (float) Accumulator carried from the previous batch
+    :return: (tuple) Sum per bar and the accumulator left for the trailing, unfinished bar
+    """
+    if len(ends) == 0:
+        return values[:0], _sequential_sum(values, carry)
+
+    sums = np.empty(len(ends), dtype=np.result_type(values, type(carry)))
+    sums[0] = _sequential_sum(values[:ends[0] + 1], carry)
+    if len(ends) > 1:
+        bar_len = int(ends[1] - ends[0])
+        block = values[ends[0] + 1:ends[-1] + 1].reshape(len(ends) - 1, bar_len)
+        sums[1:] = np.cumsum(block, axis=1)[:, -1]
+    return sums, _sequential_sum(values[ends[-1] + 1:], 0)
+
+
+def _search_ends(metric_values: np.ndarray, others: list, threshold,
+                 carry_metric) -> Tuple[np.ndarray, np.ndarray, list, object]:
+    """
+    Finds the threshold crossings of the reset-on-threshold cumulative sum of metric_values. The cumulative sum is
+    evaluated over a window that grows while no crossing is found and shrinks back to the typical bar length after one.
+
+    :param metric_values: (np.ndarray) Values compared with the threshold (dollar value, volume or tick count)
+    :param others: (list) (values, carry) pairs of the arrays accumulated alongside, but not compared with the threshold
+    :param threshold: (float or np.ndarray) Threshold at which to sample, or threshold per tick
+    :param carry_metric: (float) Metric accumulator carried from the previous batch
+    :return: (tuple) Closing positions, metric sum per bar, list of (sums per bar, trailing accumulator) for the
+             other arrays, and the trailing metric accumulator
+    """
+    n_rows = len(metric_values)
+    ends, metric_sums = [], []
+    other_sums = [[] for _ in others]
+    carries = [carry for _, carry in others]
+    per_tick = np.ndim(threshold) == 1
+    pos = 0
+    window = _MIN_WINDOW
+    while pos < n_rows:
+        stop = min(n_rows, pos + window)
+        metric_cs = carried_cumsum(metric_values[pos:stop], carry_metric)
+        reached = metric_cs >= (threshold[pos:stop] if per_tick else threshold)
+        hit = int(np.argmax(reached))
+        if reached[hit]:
+            ends.append(pos + hit)
+            metric_sums.append(metric_cs[hit])
+            for k, (values, _) in enumerate(others):
+                other_sums[k].append(_sequential_sum(values[pos:pos + hit + 1], carries[k]))
+                carries[k] = 0
+            carry_metric = 0
+            window = max(_MIN_WINDOW, 2 * (hit + 1))
+            pos += hit + 1
+        else:
+            carry_metric = metric_cs[-1]
+            for k, (values, _) in enumerate(others):
+                carries[k] = _sequential_sum(values[pos:stop], carries[k])
+            window *= 2
+            pos = stop
+
+    other_results = [(np.asarray(sums, dtype=values.dtype), carry)
+                     for sums, (values, _), carry in zip(other_sums, others, carries)]
+    return (np.asarray(ends, dtype=np.int64), np.asarray(metric_sums, dtype=metric_values.dtype), other_results,
+            carry_metric)
+
+
+def threshold_bars(metric: str, threshold: Union[float, np.ndarray], prices: np.ndarray, volumes: np.ndarray,
+                   buy_volumes: np.ndarray, state: tuple, engine: str = 'numpy') -> Tuple[dict, tuple]:
+    """
+    Builds the dollar, volume or tick bars closed within one batch of ticks.
+
+    :param metric: (str) Type of bar to create: 'dollar', 'volume' or 'tick'
+    :param threshold: (float or np.ndarray) Threshold at which to sample, or threshold in effect at each tick
+    :param prices: (np.ndarray) Prices of the batch
+    :param volumes: (np.ndarray) Volumes of the batch
+    :param buy_volumes: (np.ndarray) Volumes of the buy-initiated ticks, zero for the sell-initiated ones
+    :param state: (tuple) Bar carried from the previous batch: (cum_dollar_value, cum_volume, cum_buy_volume,
+                  cum_ticks, open_price, high_price, low_price). Prices are None when no bar is in progress.
+    :param engine: (str) 'numpy', 'numba', or 'auto' to use numba when it is installed. 'numba' falls back to 'numpy'
+                   when numba is not installed.
+    :return: (tuple) Dict of bar columns (end, open, high, low, close, volume, buy_volume, ticks, dollar), where end
+             holds the positions of the closing ticks, and the state of the bar left in progress after the batch
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}. Expected one of {ENGINES}.")
+    if metric not in METRIC_CODES:
+        raise ValueError(f"Unknown metric: {metric}. Expected one of 'dollar', 'volume' or 'tick'.")
+    if engine != 'numpy':
+        kernel = compiled(_threshold_loop)
+        if kernel is not None:
+            return _compiled_threshold_bars(kernel, metric, threshold, prices, volumes, buy_volumes, state)
+
+    cum_dollar_value, cum_volume, cum_buy_volume, cum_ticks, open_price, high_price, low_price = state
+    dollars = prices * volumes
+
+    if metric == 'tick' and np.ndim(threshold) == 1:
+        ends, _, others, _ = _search_ends(
+            np.ones(len(prices), dtype=np.int64),
+            [(dollars, cum_dollar_value), (volumes, cum_volume), (buy_volumes, cum_buy_volume)], threshold, cum_ticks)
+        (dollar_sums, cum_dollar_value), (volume_sums, cum_volume), (buy_volume_sums, cum_buy_volume) = others
+    elif metric == 'tick':
+        ends = _tick_ends(len(prices), threshold, cum_ticks)
+        dollar_sums, cum_dollar_value = _tick_bar_sums(dollars, ends, cum_dollar_value)
+        volume_sums, cum_volume = _tick_bar_sums(volumes, ends, cum_volume)
+        buy_volume_sums, cum_buy_volume = _tick_bar_sums(buy_volumes, ends, cum_buy_volume)
+    elif metric == 'dollar':
+        ends, dollar_sums, others, cum_dollar_value = _search_ends(
+            dollars, [(volumes, cum_volume), (buy_volumes, cum_buy_volume)], threshold, cum_dollar_value)
+        (volume_sums, cum_volume), (buy_volume_sums, cum_buy_volume) = others
+    else:
+        ends, volume_sums, others, cum_volume = _search_ends(
+            volumes, [(dollars, cum_dollar_value), (buy_volumes, cum_buy_volume)], threshold, cum_volume)
+        (dollar_sums, cum_dollar_value), (buy_volume_sums, cum_buy_volume) = others
+
+    n_bars = len(ends)
+    tail_start = int(ends[-1]) + 1 if n_bars else 0
+    if n_bars:
+        starts = np.empty(n_bars, dtype=np.int64)
+        starts[0] = 0
+        starts[1:] = ends[:-1] + 1
+        closed = prices[:tail_start]
+        opens = prices[starts]
+        highs = np.maximum.reduceat(closed, starts)
+        lows = np.minimum.reduceat(closed, starts)
+        ticks = ends - starts + 1
+        if open_price is not None:
+            # The first bar started in a previous batch
+            opens[0] = open_price
+            highs[0] = max(high_price, highs[0])
+            lows[0] = min(low_price, lows[0])
+            ticks[0] += cum_ticks
+        open_price = high_price = low_price = None
+        cum_ticks = 0
+    else:
+        opens = highs = lows = prices[:0]
+        ticks = ends
+
+    tail = prices[tail_start:]
+    if len(tail):
+        if open_price is None:
+            open_price, high_price, low_price = tail[0], tail.max(), tail.min()
+        else:
+            high_price, low_price = max(high_price, tail.max()), min(low_price, tail.min())
+        cum_ticks += len(tail)
+
+    columns = {'end': ends, 'open': opens, 'high': highs, 'low': lows, 'close': prices[ends],
+               'volume': volume_sums, 'buy_volume': buy_volume_sums, 'ticks': ticks, 'dollar': dollar_sums}
+    return columns, (cum_dollar_value, cum_volume, cum_buy_volume, cum_ticks, open_price, high_price, low_price)
+
+
+class BarState:
+    """
+    Accumulators of the threshold bar in progress, shared by the historical and the live bar builders. The same
+    state is advanced one batch at a time by run, with the threshold_bars kernels, or one tick at a time by step,
+    which is the scalar form of the compiled loop. Both can be mixed, and the bars do not depend on how the ticks
+    are split into batches.
+    """
+
+    __slots__ = ('metric', 'metric_code', 'cum_dollar_value', 'cum_volume', 'cum_buy_volume', 'cum_ticks',
+                 'open_price', 'high_price', 'low_price')
+
+    def __init__(self, metric: str):
+        """
+        Constructor
+
+        :param metric: (str) Type of bar: 'dollar', 'volume' or 'tick'
+        """
+        if metric not in METRIC_CODES:
+            raise ValueError(f"Unknown metric: {metric}. Expected one of 'dollar', 'volume' or 'tick'.")
+        self.metric = metric
+        self.metric_code = METRIC_CODES[metric]
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Starts a new bar. Prices are None while the bar has no tick.
+        """
+        self.cum_dollar_value = 0
+        self.cum_volume = 0
+        self.cum_buy_volume = 0
+        self.cum_ticks = 0
+        self.open_price = None
+        self.high_price = None
+        self.low_price = None
+
+    @property
+    def metric_value(self):
+        """
+        :return: (float or int) Accumulated metric of the bar in progress, compared with the threshold
+        """
+        return (self.cum_dollar_value, self.cum_volume, self.cum_ticks)[self.metric_code]
+
+    def step(self, price: float, volume: float, buy_volume: float, threshold: float) -> Union[tuple, None]:
+        """
+        Adds one tick to the bar in progress.
+
+        :param price: (float) Price of the tick
+        :param volume: (float) Volume of the tick
+        :param buy_volume: (float) Volume of the tick if it was buy-initiated, zero otherwise
+        :param threshold: (float) Threshold in effect at the tick
+        :return: (tuple) (open, high, low, close, volume, buy_volume, ticks, dollar) of the bar closed by the tick,
+                 or None
+        """
+        self.cum_dollar_value += price * volume
+        self.cum_ticks += 1
+        self.cum_volume += volume
+        self.cum_buy_volume += buy_volume
+        if self.open_price is None:
+            self.open_price = self.high_price = self.low_price = price
+        elif price > self.high_price:
+            self.high_price = price
+        elif price < self.low_price:
+            self.low_price = price
+
+        metric_code = self.metric_code
+        if metric_code == 0:
+            reached = self.cum_dollar_value >= threshold
+        elif metric_code == 1:
+            reached = self.cum_volume >= threshold
+        else:
+            reached = self.cum_ticks >= threshold
+        if not reached:
+            return None
+        bar = (self.open_price, self.high_price, self.low_price, price, self.cum_volume, self.cum_buy_volume,
+               self.cum_ticks, self.cum_dollar_value)
+        self.reset()
+        return bar
+
+    def run(self, threshold: Union[float, np.ndarray], prices: np.ndarray, volumes: np.ndarray,
+            buy_volumes: np.ndarray, engine: str = 'numpy') -> dict:
+        """
+        Adds a batch of ticks with threshold_bars.
+
+        :param threshold: (float or np.ndarray) Threshold, or threshold in effect at each tick
+        :param prices: (np.ndarray) Prices of the batch
+        :param volumes: (np.ndarray) Volumes of the batch
+        :param buy_volumes: (np.ndarray) Volumes of the buy-initiated ticks, zero for the sell-initiated ones
+        :param engine: (str) Engine of threshold_bars
+        :return: (dict) Bar columns of threshold_bars
+        """
+        columns, state = threshold_bars(self.metric, threshold, prices, volumes, buy_volumes, self.as_tuple(),
+                                        engine)
+        (self.cum_dollar_value, self.cum_volume, self.cum_buy_volume, self.cum_ticks, self.open_price,
+         self.high_price, self.low_price) = (value.item() if isinstance(value, np.generic) else value
+                                             for value in state)
+        return columns
+
+    def as_tuple(self) -> tuple:
+        """
+        :return: (tuple) State in the layout of threshold_bars: (cum_dollar_value, cum_volume, cum_buy_volume,
+                 cum_ticks, open_price, high_price, low_price)
+        """
+        return (self.cum_dollar_value, self.cum_volume, self.cum_buy_volume, self.cum_ticks, self.open_price,
+                self.high_price, self.low_price)
@@ -0,0 +1,324 @@
+"""
+Destinations for the bars built by batch_run.
+
+A sink is opened once for the whole run and receives the bars of every batch as columns, one array per field of
+BAR_COLUMNS, so there is no per-batch reopening of the output file and no list of per-bar lists to convert at the end.
+"""
+
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+from bar_engine import to_epoch_ns
+from tick_store import is_parquet, _import_pyarrow
+
+# Columns of the bars built by _create_bars, in order.
+BAR_COLUMNS = ['date_time', 'open', 'high', 'low', 'close', 'volume', 'buy_vol', 'ticks', 'dollar']
+
+
+def bars_to_columns(bars: list) -> Dict[str, np.ndarray]:
+    """
+    Converts bars built as lists [date_time, open, high, low, close, volume, buy_vol, ticks, dollar] into columns.
+
+    :param bars: (list) Bars built from one batch
+    :return: (dict) Array of each field of BAR_COLUMNS
+    """
+    if not bars:
+        return {column: np.empty(0) for column in BAR_COLUMNS}
+    return {column: np.asarray(values) for column, values in zip(BAR_COLUMNS, zip(*bars))}
+
+
+def bar_dtype(price_dtype=np.float64, value_dtype=np.float64) -> np.dtype:
+    """
+    Record layout of the bars of a StructuredSink: int64 epoch-ns timestamps, int32 tick counts, and prices and
+    volumes of the given float types.
+
+    :param price_dtype: (np.dtype) Type of open, high, low and close, e.g. np.float32 to halve their size
+    :param value_dtype: (np.dtype) Type of volume, buy_vol and dollar
+    :return: (np.dtype) Structured dtype with a field per column of BAR_COLUMNS
+    """
+    return np.dtype([('date_time', np.int64), ('open', price_dtype), ('high', price_dtype), ('low', price_dtype),
+                     ('close', price_dtype), ('volume', value_dtype), ('buy_vol', value_dtype), ('ticks', np.int32),
+                     ('dollar', value_dtype)])
+
+
+def structured_to_frame(bars: np.ndarray) -> pd.DataFrame:
+    """
+    :param bars: (np.ndarray) Bars with the layout of bar_dtype
+    :return: (pd.DataFrame) Bars, with date_time as datetime64[ns]
+    """
+    columns = {column: bars[column] for column in bars.dtype.names}
+    columns['date_time'] = columns['date_time'].view('datetime64[ns]')
+    return pd.DataFrame(columns)
+
+
+def columns_to_bars(columns: Dict[str, np.ndarray]) -> list:
+    """
+    Converts bars held as columns back into lists [date_time, open, high, low, close, volume, buy_vol, ticks, dollar].
+
+    :param columns: (dict) Array of each field of BAR_COLUMNS
+    :return: (list) Bars
+    """
+    # pd.Series.tolist keeps datetime64 timestamps as pd.Timestamp, like the per-tick loops
+    fields = [pd.Series(columns['date_time']).tolist()] + [columns[column].tolist() for column in BAR_COLUMNS[1:]]
+    return [list(bar) for bar in zip(*fields)]
+
+
+class BarSink(ABC):
+    """
+    Receives the bars of every batch of a run, as columns.
+    """
+
+    @abstractmethod
+    def write(self, columns: Dict[str, np.ndarray]) -> None:
+        """
+        :param columns: (dict) Array of each field of BAR_COLUMNS, for the bars built from one batch
+        """
+
+    def flush(self) -> None:
+        """
+        Makes the bars written so far durable, before the run is checkpointed.
+        """
+
+    def close(self) -> None:
+        """
+        Flushes and releases the output. Called once at the end of the run.
+        """
+
+    def result(self):
+        """
+        :return: Result of the run returned by batch_run, None for file sinks
+        """
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MemorySink(BarSink):
+    """
+    Keeps the bars in memory as a list of arrays per column, concatenated once at the end.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self._chunks = {column: [] for column in BAR_COLUMNS}
+
+    def write(self, columns: Dict[str, np.ndarray]) -> None:
+        if len(columns['close']):
+            for column in BAR_COLUMNS:
+                self._chunks[column].append(columns[column])
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """
+        :return: (dict) Array of each field of BAR_COLUMNS, for all the bars written so far
+        """
+        return {column: np.concatenate(chunks) if chunks else np.empty(0) for column, chunks in self._chunks.items()}
+
+    def result(self) -> pd.DataFrame:
+        """
+        :return: (pd.DataFrame) All the bars written so far
+        """
+        return pd.DataFrame(self.columns(), columns=BAR_COLUMNS)
+
+
+class StructuredSink(BarSink):
+    """
+    Keeps the bars in memory as a NumPy structured array of bar_dtype, a fixed size record per bar, instead of
+    DataFrame columns of object timestamps and float64 values. Each batch is converted on write, so no string or boxed
+    value is held, and the array is only turned into a DataFrame on demand with structured_to_frame.
+    """
+
+    def __init__(self, price_dtype=np.float64, value_dtype=np.float64):
+        """
+        Constructor
+
+        :param price_dtype: (np.dtype) Type of open, high, low and close
+        :param value_dtype: (np.dtype) Type of volume, buy_vol and dollar
+        """
+        self.dtype = bar_dtype(price_dtype, value_dtype)
+        self._chunks = []
+
+    def write(self, columns: Dict[str, np.ndarray]) -> None:
+        if not len(columns['close']):
+            return
+        if np.max(columns['ticks']) > np.iinfo(np.int32).max:
+            raise ValueError('Bars of more than 2**31 ticks cannot be stored as int32.')
+        records = np.empty(len(columns['close']), dtype=self.dtype)
+        records['date_time'] = to_epoch_ns(columns['date_time'])
+        for column in BAR_COLUMNS[1:]:
+            records[column] = columns[column]
+        self._chunks.append(records)
+
+    def result(self) -> np.ndarray:
+        """
+        :return: (np.ndarray) All the bars written so far, one record per bar
+        """
+        if len(self._chunks) > 1:
+            self._chunks = [np.concatenate(self._chunks)]
+        return self._chunks[0] if self._chunks else np.empty(0, dtype=self.dtype)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        :return: (pd.DataFrame) All the bars written so far
+        """
+        return structured_to_frame(self.result())
+
+
+class RingBufferSink(BarSink):
+    """
+    Keeps only the last bars, in arrays allocated once, for builders that run for weeks. Every bar is stored twice,
+    capacity rows apart, so the last n bars are always one contiguous slice of each array: they are read without
+    concatenation, and writing never reallocates.
+    """
+
+    def __init__(self, capacity: int, dtypes: Optional[dict] = None, columns: Optional[list] = None):
+        """
+        Constructor
+
+        :param capacity: (int) Number of bars kept
+        :param dtypes: (dict) Dtype of each column, in order. None takes them from the first write.
+        :param columns: (list) Names of the columns, if dtypes is None. Defaults to BAR_COLUMNS.
+        """
+        self.capacity = int(capacity)
+        self.column_names = list(dtypes) if dtypes is not None else list(columns or BAR_COLUMNS)
+        self.num_written = 0
+        self._arrays = None if dtypes is None else self._allocate(dtypes)
+
+    def _allocate(self, dtypes: dict) -> Dict[str, np.ndarray]:
+        return {column: np.empty(2 * self.capacity, dtype=dtypes[column]) for column in self.column_names}
+
+    def _allocate_like(self, columns: Dict[str, np.ndarray]) -> None:
+        self._arrays = self._allocate({column: np.asarray(columns[column]).dtype for column in self.column_names})
+
+    def write(self, columns: Dict[str, np.ndarray]) -> None:
+        num_bars = len(columns[self.column_names[0]])
+        if not num_bars:
+            return
+        if self._arrays is None:
+            self._allocate_like(columns)
+        # Only the bars that fit are stored
+        skip = max(num_bars - self.capacity, 0)
+        slots = (self.num_written + skip + np.arange(num_bars - skip)) % self.capacity
+        for column, array in self._arrays.items():
+            values = np.asarray(columns[column])[skip:]
+            array[slots] = values
+            array[slots + self.capacity] = values
+        self.num_written += num_bars
+
+    def append(self, bar: list) -> None:
+        """
+        Adds a single bar.
+
+        :param bar: (list) Value of each column, in order
+        """
+        if self._arrays is None:
+            self._allocate_like({column: [value] for column, value in zip(self.column_names, bar)})
+        slot = self.num_written % self.capacity
+        for array, value in zip(self._arrays.values(), bar):
+            array[slot] = array[slot + self.capacity] = value
+        self.num_written += 1
+
+    def __len__(self) -> int:
+        return min(self.num_written, self.capacity)
+
+    def columns(self, last: Optional[int] = None, copy: bool = True) -> Dict[str, np.ndarray]:
+        """
+        :param last: (int) Number of most recent bars, None for all the bars kept
+        :param copy: (bool) False returns views of the buffer, which later writes overwrite
+        :return: (dict) Array of each column, oldest bar first
+        """
+        num_bars = len(self) if last is None else min(int(last), len(self))
+        if self._arrays is None:
+            return {column: np.empty(0) for column in self.column_names}
+        end = self.num_written % self.capacity + self.capacity
+        return {column: array[end - num_bars:end].copy() if copy else array[end - num_bars:end]
+                for column, array in self._arrays.items()}
+
+    def result(self, last: Optional[int] = None, copy: bool = True) -> pd.DataFrame:
+        """
+        :param last: (int) Number of most recent bars, None for all the bars kept
+        :param copy: (bool) False returns a DataFrame over views of the buffer, which later writes overwrite
+        :return: (pd.DataFrame) Last bars
+        """
+        return pd.DataFrame(self.columns(last, copy), copy=False)
+
+
+class CsvSink(BarSink):
+    """
+    Appends bars to a csv file through a single buffered file handle. The header is written if the file is new.
+    """
+
+    def __init__(self, output_path: str, buffer_size: int = 1 << 20):
+        """
+        Constructor
+
+        :param output_path: (str) Path to results file
+        :param buffer_size: (int) Size of the write buffer in bytes
+        """
+        write_header = not os.path.isfile(output_path) or os.path.getsize(output_path) == 0
+        self._file = open(output_path, mode='a', newline='', buffering=buffer_size)
+        self._writer = csv.writer(self._file)
+        if write_header:
+            self._writer.writerow(BAR_COLUMNS)
+
+    def write(self, columns: Dict[str, np.ndarray]) -> None:
+        self._writer.writerows(zip(*(columns[column].tolist() for column in BAR_COLUMNS)))
+
+    def flush(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetSink(BarSink):
+    """
+    Writes bars to a Parquet file, one row group per batch with bars. Requires pyarrow.
+    """
+
+    def __init__(self, output_path: str):
+        """
+        Constructor
+
+        :param output_path: (str) Path of the Parquet file, overwritten if it exists
+        """
+        self.pyarrow = _import_pyarrow()
+        self.output_path = output_path
+        self._writer = None
+
+    def write(self, columns: Dict[str, np.ndarray]) -> None:
+        if not len(columns['close']):
+            return
+        table = self.pyarrow.Table.from_pandas(pd.DataFrame(columns, columns=BAR_COLUMNS), preserve_index=False)
+        if self._writer is None:
+            # Fix the numeric types, so that a batch where e.g. every volume is an integer keeps the schema
+            schema = self.pyarrow.schema([table.schema.field('date_time')] + [
+                (column, self.pyarrow.int64() if column == 'ticks' else self.pyarrow.float64())
+                for column in BAR_COLUMNS[1:]])
+            self._writer = self.pyarrow.parquet.ParquetWriter(self.output_path, schema)
+        self._writer.write_table(table.cast(self._writer.schema))
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+def open_sink(output_path: Optional[str]) -> BarSink:
+    """
+    :param output_path: (str) Parquet file if the path ends with .parquet or .pq, csv file otherwise
+    :return: (BarSink) Sink writing to output_path
+    """
+    if output_path is None:
+        raise ValueError("output_path must be provided if to_csv is True.")
+    return ParquetSink(output_path) if is_parquet(output_path) else CsvSink(output_path)
@@ -1,6 +1,21 @@
+import os
+import tempfile
 import unittest
+from unittest import mock
+import numpy as np
 import pandas as pd
-from base_bars import _crop_data_frame_in_batches
+from base_bars import _crop_data_frame_in_batches, IncrementalEWMA
+from bar_engine import tick_rule, to_epoch_ns
+from standard_data_structures import StandardBars, MultiBars
+from imbalance_data_structures import EMAImbalanceBars, get_const_dollar_imbalance_bars, get_ema_tick_imbalance_bars
+from run_data_structures import EMARunBars, get_const_volume_run_bars, get_ema_dollar_run_bars
+from run_stats import RunStats
+from checkpoint import load_checkpoint
+from bar_sinks import StructuredSink, structured_to_frame
+from tick_store import iter_csv, write_tick_store, write_parquet
+from time_data_structures import get_time_bars
+from features import DailyVolatility, EWMVolatility, IntradayVolatility, get_daily_vol, get_volatility
+from filters import CusumFilter, _cusum, cusum_events, cusum_filter, cusum_filter_many
 small_tick_fd = 0
 mid_tick_fd = './raw-data/tick_data.csv'
 big_tick_fd = 0
@@ -14,6 +29,20 @@ class base_bars(unittest.TestCase):
         res = int(df.shape[0] / 5000) + 1
         self.assertEqual(res, len(batch_list))
 
+    def test_windowed_ewma_matches_pandas(self):
+        values = np.random.default_rng(4).normal(size=200)
+        window = 20
+        ewma = IncrementalEWMA(window, window)
+        for i, value in enumerate(values):
+            result = ewma.update(value)
+            expected = pd.Series(values[max(i + 1 - window, 0):i + 1]).ewm(span=window).mean().iloc[-1]
+            self.assertAlmostEqual(result, expected, places=10)
+
+        unbounded = IncrementalEWMA(window)
+        for value in values:
+            unbounded.update(value)
+        self.assertAlmostEqual(unbounded.value, pd.Series(values).ewm(span=window).mean().iloc[-1], places=10)
+
     def test_null_data(self):
         self.assertEqual(True, True)  # add assertion here
 
@@ -21,5 +50,446 @@ class base_bars(unittest.TestCase):
     def test_open_close_price(self):
         self.assertEqual(True, True)  # add assertion here
 
+
+class standard_bars(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(42)
+        n_rows = 5000
+        self.df = pd.DataFrame({
+            'date_time': np.arange(n_rows) + 1693526400000,
+            'price': (1600 + np.cumsum(np.random.normal(0, 0.1, n_rows))).round(2),
+            'volume': np.random.exponential(1.0, n_rows).round(4)
+        })
+
+    def _run_in_batches(self, bars, batch_size):
+        res = []
+        for batch in _crop_data_frame_in_batches(self.df, batch_size):
+            res += bars.run(batch)
+        return res
+
+    def test_engines_match_loop(self):
+        for metric, threshold in [('dollar', 40000), ('volume', 20), ('tick', 50), ('tick', 1)]:
+            for batch_size in [5000, 333]:
+                loop_bars = StandardBars(metric, threshold, batch_size, engine='python')
+                expected = self._run_in_batches(loop_bars, batch_size)
+                for engine in ['numpy', 'numba']:
+                    engine_bars = StandardBars(metric, threshold, batch_size, engine=engine)
+                    result = self._run_in_batches(engine_bars, batch_size)
+                    self.assertEqual(np.array(expected).tolist(), np.array(result).tolist())
+                    self.assertEqual(loop_bars.cum_dollar_value, engine_bars.cum_dollar_value)
+                    self.assertEqual(loop_bars.cum_ticks, engine_bars.cum_ticks)
+
+    def test_series_threshold_matches_loop(self):
+        self.df['date_time'] = pd.to_datetime(self.df['date_time'], unit='ms')
+        for metric, threshold in [('dollar', 40000), ('volume', 20), ('tick', 50)]:
+            thresholds = pd.Series([threshold, threshold * 3, threshold / 2],
+                                   index=self.df['date_time'].iloc[[0, 1500, 3000]])
+            expected = self._run_in_batches(StandardBars(metric, thresholds, engine='python'), 333)
+            for engine in ['numpy', 'numba']:
+                result = self._run_in_batches(StandardBars(metric, thresholds, engine=engine), 333)
+                self.assertEqual(np.array(expected).tolist(), np.array(result).tolist())
+
+    def test_tick_rule_matches_scalar_rule(self):
+        prices = np.round(1600 + np.cumsum(np.random.choice([-0.01, 0, 0, 0.01], 1000)), 2)
+        bars = StandardBars('tick', 10)
+        expected = [bars._apply_tick_rule(price) for price in prices]
+        result, prev_price, prev_tick_rule = [], None, 0
+        for i in range(0, len(prices), 37):
+            signs = tick_rule(prices[i:i + 37], prev_price, prev_tick_rule)
+            prev_price, prev_tick_rule = prices[i + len(signs) - 1], signs[-1]
+            result.extend(signs.tolist())
+        self.assertEqual(expected, result)
+
+    def test_buy_volume_from_aggressor_flag(self):
+        self.df['is_buyer_maker'] = np.random.rand(len(self.df)) < 0.5
+        expected = self._run_in_batches(StandardBars('volume', 20, engine='python'), 333)
+        bars = StandardBars('volume', 20)
+        result = self._run_in_batches(bars, 333)
+        self.assertEqual(np.array(expected).tolist(), np.array(result).tolist())
+        buy_volume = self.df['volume'][~self.df['is_buyer_maker']].sum()
+        self.assertAlmostEqual(buy_volume, sum(bar[6] for bar in result) + bars.cum_buy_volume, places=6)
+
+    def test_multi_bars_match_single_builders(self):
+        specs = [('dollar', 40000), ('volume', 20), ('tick', 50)]
+        multi_bars = MultiBars(specs, batch_size=700).batch_run(self.df, verbose=False)
+        for metric, threshold in specs:
+            single_bars = self._run_in_batches(StandardBars(metric, threshold, 700), 700)
+            result = multi_bars[(metric, threshold)]
+            # batch_run parses the epoch-ms timestamps at ingest
+            self.assertEqual([bar[0] * 10 ** 6 for bar in single_bars], to_epoch_ns(result['date_time']).tolist())
+            self.assertEqual([bar[1:] for bar in single_bars], result.iloc[:, 1:].values.tolist())
+
+    def test_multi_bars_with_series_thresholds(self):
+        self.df['date_time'] = pd.to_datetime(self.df['date_time'], unit='ms')
+        thresholds = pd.Series([40000, 120000, 20000], index=self.df['date_time'].iloc[[0, 1500, 3000]])
+        specs = [('dollar', 40000), ('dollar', thresholds), ('tick', thresholds / 1000)]
+        keys = [('dollar', 40000), ('dollar', 1), ('tick', 2)]
+        multi_bars = MultiBars(specs, batch_size=700).batch_run(self.df, verbose=False)
+        named_bars = MultiBars(dict(zip('abc', specs)), batch_size=700).batch_run(self.df, verbose=False)
+        self.assertEqual(list(multi_bars), keys)
+        self.assertEqual(list(named_bars), list('abc'))
+        for (metric, threshold), key, name in zip(specs, keys, 'abc'):
+            single_bars = StandardBars(metric, threshold, 700).batch_run(self.df, verbose=False)
+            pd.testing.assert_frame_equal(single_bars, multi_bars[key])
+            pd.testing.assert_frame_equal(single_bars, named_bars[name])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            template = os.path.join(tmp_dir, 'bars_{metric}_{threshold}.csv')
+            MultiBars(specs, batch_size=700).batch_run(self.df, verbose=False, to_csv=True, output_path=template)
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['bars_dollar_1.csv', 'bars_dollar_40000.csv',
+                                                           'bars_tick_2.csv'])
+
+    def test_expected_ticks_use_last_bars_only(self):
+        num_prev_bars = 3
+        for bars in [EMAImbalanceBars('tick_imbalance', num_prev_bars, 500, 50, None, 1000, False),
+                     EMARunBars('tick_run', num_prev_bars, 500, 50, None, 1000, False)]:
+            ticks, exp_num_ticks = [], []
+            get_exp_num_ticks = bars._get_exp_num_ticks
+
+            def recorded():
+                ticks.append(bars.cum_ticks)
+                exp_num_ticks.append(get_exp_num_ticks())
+                return exp_num_ticks[-1]
+
+            bars._get_exp_num_ticks = recorded
+            self._run_in_batches(bars, 1000)
+            self.assertTrue(len(ticks) > num_prev_bars * 2)
+            for i in range(len(ticks)):
+                window = pd.Series(ticks[max(i + 1 - num_prev_bars, 0):i + 1], dtype=float)
+                self.assertAlmostEqual(exp_num_ticks[i], window.ewm(span=num_prev_bars).mean().iloc[-1], places=9)
+
+    def test_information_bars_stream_across_batches(self):
+        for get_bars in [get_const_dollar_imbalance_bars, get_ema_tick_imbalance_bars, get_const_volume_run_bars,
+                         get_ema_dollar_run_bars]:
+            one_batch, thresholds = get_bars(self.df, exp_num_ticks_init=100, expected_imbalance_window=500,
+                                             batch_size=len(self.df), analyse_thresholds=True, verbose=False)
+            many_batches, _ = get_bars(self.df, exp_num_ticks_init=100, expected_imbalance_window=500,
+                                       batch_size=333, verbose=False)
+            self.assertTrue(len(one_batch) > 0)
+            self.assertEqual(len(thresholds), len(self.df))
+            self.assertTrue(one_batch.equals(many_batches))
+            self.assertLessEqual(one_batch['ticks'].sum(), len(self.df))
+
+    def test_timestamp_unit_detected_per_file(self):
+        expected = get_time_bars(self.df, 'S', 30, batch_size=700, verbose=False)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_paths = [os.path.join(tmp_dir, 'day_us.csv'), os.path.join(tmp_dir, 'day_iso.csv')]
+            self.df.iloc[:3000].assign(date_time=self.df['date_time'] * 1000).to_csv(file_paths[0], index=False)
+            self.df.iloc[3000:].assign(date_time=pd.to_datetime(self.df['date_time'], unit='ms')).to_csv(
+                file_paths[1], index=False)
+            result = get_time_bars(file_paths, 'S', 30, batch_size=700, verbose=False)
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_time_bars_match_groupby(self):
+        one_batch = get_time_bars(self.df, 'S', 30, batch_size=len(self.df), verbose=False)
+        many_batches = get_time_bars(self.df, 'S', 30, batch_size=333, verbose=False)
+        groups = self.df.groupby(self.df['date_time'] // 30000)
+        self.assertTrue(np.array_equal(one_batch['date_time'], pd.to_datetime((groups.size().index[:-1] + 1) * 30000,
+                                                                               unit='ms')))
+        self.assertEqual(one_batch['ticks'].tolist(), groups.size().tolist()[:-1])
+        self.assertEqual(one_batch['close'].tolist(), groups['price'].last().tolist()[:-1])
+        self.assertTrue(np.allclose(one_batch['volume'], groups['volume'].sum().iloc[:-1]))
+        self.assertTrue(np.allclose(one_batch.iloc[:, 1:].to_numpy(float), many_batches.iloc[:, 1:].to_numpy(float)))
+
+    def test_binary_tick_data_matches_csv(self):
+        self.df['is_buyer_maker'] = np.random.rand(len(self.df)) < 0.5
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, 'ticks.csv')
+            self.df.to_csv(csv_path, index=False)
+            write_tick_store(csv_path, os.path.join(tmp_dir, 'store'), batch_size=1000)
+            write_parquet(self.df, os.path.join(tmp_dir, 'ticks.parquet'), batch_size=1000)
+            expected = StandardBars('dollar', 40000, 333).batch_run(csv_path, verbose=False)
+            for path in ['store', 'ticks.parquet']:
+                result = StandardBars('dollar', 40000, 333).batch_run(os.path.join(tmp_dir, path), verbose=False)
+                self.assertTrue(expected.equals(result))
+
+    def test_sinks_match_in_memory_bars(self):
+        expected = StandardBars('dollar', 40000, 333).batch_run(self.df, verbose=False)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for file_name in ['bars.csv', 'bars.parquet']:
+                output_path = os.path.join(tmp_dir, file_name)
+                StandardBars('dollar', 40000, 333).batch_run(self.df, verbose=False, to_csv=True,
+                                                             output_path=output_path)
+                result = pd.read_csv(output_path) if file_name.endswith('.csv') else pd.read_parquet(output_path)
+                self.assertEqual(list(result.columns), list(expected.columns))
+                self.assertTrue(np.allclose(expected.iloc[:, 1:].to_numpy(float), result.iloc[:, 1:].to_numpy(float)))
+
+    def test_parallel_files_match_serial(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_paths = []
+            for day, batch in enumerate(_crop_data_frame_in_batches(self.df, 1200)):
+                file_paths.append(os.path.join(tmp_dir, f'day_{day}.csv'))
+                batch.to_csv(file_paths[-1], index=False)
+            for metric, threshold in [('dollar', 40000), ('tick', 50)]:
+                serial = StandardBars(metric, threshold, 500).batch_run(file_paths, verbose=False)
+                parallel = StandardBars(metric, threshold, 500).batch_run(file_paths, verbose=False, processes=2)
+                self.assertTrue(serial.equals(parallel))
+
+    def test_checkpoint_resume_matches_uninterrupted_run(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_paths = [os.path.join(tmp_dir, 'day_0.csv'), os.path.join(tmp_dir, 'day_1')]
+            self.df.iloc[:3000].to_csv(file_paths[0], index=False)
+            write_tick_store(self.df.iloc[3000:], file_paths[1])
+            expected_path, output_path = os.path.join(tmp_dir, 'expected.csv'), os.path.join(tmp_dir, 'bars.csv')
+            checkpoint_path = os.path.join(tmp_dir, 'run.ckpt')
+            StandardBars('dollar', 40000, 400).batch_run(file_paths, verbose=False, to_csv=True,
+                                                         output_path=expected_path)
+
+            # Stop the run in the middle of the csv file, after its checkpoint of the third batch
+            class InterruptedBars(StandardBars):
+                num_batches = 0
+
+                def _run_columns(self, data):
+                    InterruptedBars.num_batches += 1
+                    if InterruptedBars.num_batches == 4:
+                        raise KeyboardInterrupt
+                    return super()._run_columns(data)
+
+            with self.assertRaises(KeyboardInterrupt):
+                InterruptedBars('dollar', 40000, 400).batch_run(file_paths, verbose=False, to_csv=True,
+                                                                output_path=output_path,
+                                                                checkpoint_path=checkpoint_path)
+            self.assertTrue(os.path.isfile(checkpoint_path))
+            self.assertEqual(set(load_checkpoint(checkpoint_path)['state']), {'state', 'prev_price', 'prev_tick_rule'})
+
+            # Other settings than those of the checkpointed run are not overwritten but refused
+            for bars in [StandardBars('dollar', 50000, 400), StandardBars('dollar', 40000, 400, engine='python')]:
+                with self.assertRaises(ValueError):
+                    bars.batch_run(file_paths, verbose=False, to_csv=True, output_path=output_path,
+                                   checkpoint_path=checkpoint_path)
+
+            StandardBars('dollar', 40000, 400).batch_run(file_paths, verbose=False, to_csv=True,
+                                                         output_path=output_path, checkpoint_path=checkpoint_path)
+            self.assertFalse(os.path.isfile(checkpoint_path))
+            with open(expected_path) as expected, open(output_path) as result:
+                self.assertEqual(expected.read(), result.read())
+
+    def test_csv_batches_have_batch_size_rows(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, 'ticks.csv')
+            self.df.iloc[:3000].to_csv(csv_path, index=False)
+            with open(csv_path, 'rb+') as file:
+                # Without a line break after the last row
+                file.truncate(os.path.getsize(csv_path) - 1)
+            expected = pd.read_csv(csv_path)
+            for batch_size in [7, 400, 3000, 5000]:
+                batches = list(iter_csv(csv_path, batch_size))
+                self.assertTrue(all(len(batch) == batch_size for batch, _ in batches[:-1]))
+                self.assertEqual(len(batches[-1][0]), 3000 - batch_size * (len(batches) - 1))
+                pd.testing.assert_frame_equal(pd.concat([batch for batch, _ in batches], ignore_index=True), expected)
+                self.assertEqual(batches[-1][1], os.path.getsize(csv_path))
+                if len(batches) > 1:
+                    resumed = pd.concat([batch for batch, _ in iter_csv(csv_path, batch_size, batches[0][1])],
+                                        ignore_index=True)
+                    pd.testing.assert_frame_equal(resumed, expected.iloc[batch_size:].reset_index(drop=True))
+
+    def test_checkpoint_resume_information_bars(self):
+        def make_bars():
+            return EMARunBars('dollar_run', num_prev_bars=3, expected_imbalance_window=500, exp_num_ticks_init=100,
+                              exp_num_ticks_constraints=None, batch_size=400, analyse_thresholds=True)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected_path, output_path = os.path.join(tmp_dir, 'expected.csv'), os.path.join(tmp_dir, 'bars.csv')
+            checkpoint_path = os.path.join(tmp_dir, 'run.ckpt')
+            make_bars().batch_run(self.df, verbose=False, to_csv=True, output_path=expected_path)
+
+            bars = make_bars()
+            extract_bars = bars._extract_bars
+
+            def interrupted(data):
+                if len(bars.bars_thresholds) > 20:
+                    raise KeyboardInterrupt
+                return extract_bars(data)
+
+            bars._extract_bars = interrupted
+            with self.assertRaises(KeyboardInterrupt):
+                bars.batch_run(self.df, verbose=False, to_csv=True, output_path=output_path,
+                               checkpoint_path=checkpoint_path)
+            # The thresholds recorded for analysis are not part of the checkpoint
+            self.assertNotIn('bars_thresholds', load_checkpoint(checkpoint_path)['state'])
+
+            make_bars().batch_run(self.df, verbose=False, to_csv=True, output_path=output_path,
+                                  checkpoint_path=checkpoint_path)
+            with open(expected_path) as expected, open(output_path) as result:
+                self.assertEqual(expected.read(), result.read())
+
+    def test_structured_sink_matches_data_frame(self):
+        expected = StandardBars('dollar', 40000, 700).batch_run(self.df, verbose=False)
+        bars = StandardBars('dollar', 40000, 700).batch_run(self.df, verbose=False, sink=StructuredSink())
+        self.assertEqual(bars['ticks'].dtype, np.int32)
+        result = structured_to_frame(bars)
+        np.testing.assert_array_equal(result['date_time'].to_numpy().view(np.int64), to_epoch_ns(expected['date_time']))
+        pd.testing.assert_frame_equal(result.iloc[:, 1:], expected.iloc[:, 1:], check_dtype=False)
+
+        compact = StandardBars('dollar', 40000, 700).batch_run(self.df, verbose=False,
+                                                               sink=StructuredSink(price_dtype=np.float32))
+        self.assertEqual(compact.dtype.itemsize, 8 + 4 * 4 + 3 * 8 + 4)
+        np.testing.assert_allclose(compact['close'], expected['close'], rtol=1e-6)
+
+    def test_run_stats(self):
+        seen = []
+        stats = RunStats(on_batch=seen.append)
+        bars = StandardBars('dollar', 40000, 700).batch_run(self.df, verbose=False, stats=stats)
+        self.assertEqual(seen, stats.batches)
+        self.assertEqual([batch.batch_no for batch in seen], list(range(1, len(seen) + 1)))
+        self.assertEqual(stats.rows, len(self.df))
+        self.assertEqual(stats.bars, len(bars))
+        self.assertTrue(all(seconds >= 0 for seconds in stats.stage_seconds().values()))
+        self.assertEqual(len(stats.to_frame()), len(seen))
+
+        specs = [('dollar', 40000), ('tick', 50)]
+        stats = RunStats()
+        multi_bars = MultiBars(specs, batch_size=700).batch_run(self.df, verbose=False, stats=stats)
+        self.assertEqual(stats.bars, sum(len(bars) for bars in multi_bars.values()))
+
+
+def baseline_cusum_filter(raw_time_series, threshold, time_stamps=True):
+    # The per-row CUSUM filter of the original repository
+    t_events = []
+    s_pos = s_neg = 0
+    diff = raw_time_series.diff()
+    if isinstance(threshold, pd.Series):
+        threshold = threshold.reindex(raw_time_series.index, method='bfill')
+    for i in diff.index[1:]:
+        s_pos = max(0, s_pos + diff.loc[i])
+        s_neg = min(0, s_neg + diff.loc[i])
+        thresh = threshold.loc[i] if isinstance(threshold, pd.Series) else threshold
+        if s_neg < -thresh:
+            s_neg = 0
+            t_events.append(i)
+        elif s_pos > thresh:
+            s_pos = 0
+            t_events.append(i)
+    if time_stamps:
+        return pd.DatetimeIndex(t_events)
+    return t_events
+
+
+class filters(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(12)
+        index = pd.date_range('2023-09-01', periods=2000, freq='min')
+        self.close = pd.Series(1600 + rng.normal(size=len(index)).cumsum(), index=index)
+        self.close.iloc[[5, 6, 700, 1999]] = np.nan
+        self.thresholds = pd.Series(rng.uniform(1, 4, size=201), index=index[::10].append(index[-1:]))
+
+    def test_cusum_filter_matches_baseline(self):
+        self._check_cusum_filter()
+        # Without numba, the same recursion runs on Python lists
+        with mock.patch('filters.compiled', return_value=None):
+            self._check_cusum_filter()
+
+    def _check_cusum_filter(self):
+        for threshold in [2.5, self.thresholds]:
+            expected = baseline_cusum_filter(self.close, threshold)
+            self.assertTrue(len(expected) > 10)
+            result = cusum_filter(self.close, threshold)
+            self.assertIsInstance(result, pd.DatetimeIndex)
+            pd.testing.assert_index_equal(expected, result)
+            self.assertEqual(baseline_cusum_filter(self.close, threshold, time_stamps=False),
+                             cusum_filter(self.close, threshold, time_stamps=False))
+
+        positional = pd.Series(self.close.to_numpy())
+        self.assertEqual(baseline_cusum_filter(positional, 2.5, time_stamps=False),
+                         cusum_filter(positional, 2.5, time_stamps=False))
+        self.assertEqual(baseline_cusum_filter(positional, 2.5, time_stamps=False),
+                         cusum_events(positional.to_numpy(), 2.5).tolist())
+        aligned = self.thresholds.reindex(self.close.index, method='bfill').to_numpy()
+        self.assertEqual(cusum_filter(self.close, self.thresholds, time_stamps=False),
+                         self.close.index[cusum_events(self.close.to_numpy(), aligned)].tolist())
+
+    def test_stateful_filter_matches_cusum_filter(self):
+        close = self.close.iloc[:-1]
+        aligned = self.thresholds.reindex(close.index, method='bfill')
+        rng = np.random.default_rng(13)
+        for threshold in [2.5, aligned]:
+            expected = cusum_filter(close, threshold)
+            # Split points at random, with runs of length-1 chunks
+            cuts = np.unique(np.concatenate([rng.integers(1, len(close), 40), np.arange(500, 520)]))
+            stateful = CusumFilter(2.5)
+            events = []
+            for start, end in zip(np.r_[0, cuts], np.r_[cuts, len(close)]):
+                chunk_threshold = None if np.ndim(threshold) == 0 else threshold.iloc[start:end].to_numpy()
+                if end - start == 1 and start % 2:
+                    if stateful.update(close.iloc[start], None if chunk_threshold is None else chunk_threshold[0]):
+                        events.append(close.index[start])
+                else:
+                    events.extend(stateful.update_many(close.iloc[start:end], chunk_threshold))
+
+                # s_pos and s_neg carry over exactly as in one run over the values seen so far
+                diff = np.diff(close.iloc[:end].to_numpy())
+                _, s_pos, s_neg = _cusum(diff, threshold if chunk_threshold is None else aligned.to_numpy()[1:end])
+                self.assertEqual((s_pos, s_neg), (stateful.s_pos, stateful.s_neg))
+            pd.testing.assert_index_equal(expected, pd.DatetimeIndex(events))
+
+    def test_cusum_filter_many_matches_one_symbol_at_a_time(self):
+        frame = pd.DataFrame({'ETHUSDT': self.close, 'BTCUSDT': self.close.iloc[::-1].to_numpy() * 2})
+        frame.iloc[100:150, 1] = np.nan
+        thresholds = {'ETHUSDT': self.thresholds, 'BTCUSDT': 5.0}
+        for threshold in [2.5, self.thresholds, thresholds]:
+            result = cusum_filter_many(frame, threshold)
+            self.assertEqual(list(result), list(frame.columns))
+            for symbol in frame.columns:
+                symbol_threshold = threshold[symbol] if isinstance(threshold, dict) else threshold
+                expected = cusum_filter(frame[symbol].dropna(), symbol_threshold)
+                pd.testing.assert_index_equal(expected, result[symbol])
+
+        series = {symbol: frame[symbol].dropna() for symbol in frame.columns}
+        result = cusum_filter_many(series, 2.5, time_stamps=False)
+        for symbol in frame.columns:
+            self.assertEqual(cusum_filter(series[symbol], 2.5, time_stamps=False), result[symbol])
+
+
+class features(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(14)
+        # Irregular closes over two weeks, with a day without any close
+        gaps = (rng.exponential(300, size=3000).astype('int64') + 1) * 10 ** 9
+        times = pd.Timestamp('2023-09-01').value + gaps.cumsum()
+        times = np.where(times > pd.Timestamp('2023-09-05').value, times + 86400 * 10 ** 9, times)
+        self.close = pd.Series(1600 * np.exp(rng.normal(0, 0.002, size=len(times)).cumsum()),
+                               index=pd.DatetimeIndex(times))
+
+    def test_ewm_volatility_matches_pandas(self):
+        values = self.close.pct_change().to_numpy()
+        values[[10, 11, 500]] = np.nan
+        for span in [2, 20, 100]:
+            ewm = EWMVolatility(span)
+            result = [ewm.update(value) for value in values]
+            expected = pd.Series(values).ewm(span=span).std().to_numpy()
+            np.testing.assert_allclose(result, expected, rtol=1e-9, atol=1e-15)
+            self.assertEqual(np.isnan(result).tolist(), np.isnan(expected).tolist())
+
+    def test_daily_volatility_matches_get_daily_vol(self):
+        daily = DailyVolatility(lookback=5)
+        checked = 0
+        for i, (time_stamp, close) in enumerate(self.close.items()):
+            result = daily.update(time_stamp, close)
+            if i % 97 == 0 or i == len(self.close) - 1:
+                expected = get_daily_vol(self.close.iloc[:i + 1], lookback=5).iloc[-1]
+                if np.isnan(expected):
+                    self.assertTrue(np.isnan(result))
+                else:
+                    self.assertAlmostEqual(expected, result, places=12)
+                    checked += 1
+        self.assertTrue(checked > 10)
+
+    def test_intraday_volatility_matches_get_volatility(self):
+        expected = get_volatility(self.close, span0=50)
+        intraday = IntradayVolatility(span0=50)
+        result = pd.Series([intraday.update(time_stamp, close) for time_stamp, close in self.close.items()],
+                           index=self.close.index)
+        self.assertTrue(len(expected) > 1000)
+        np.testing.assert_allclose(result[expected.index].to_numpy(), expected.to_numpy(), rtol=1e-9)
+        self.assertTrue(result[:expected.index[0]].iloc[:-1].isna().all())
+
+    def test_get_daily_vol_keeps_the_index(self):
+        close = self.close.set_axis(self.close.index.astype(str))
+        index = close.index.copy()
+        vol = get_daily_vol(close, lookback=5)
+        pd.testing.assert_index_equal(index, close.index)
+        pd.testing.assert_series_equal(vol, get_daily_vol(self.close, lookback=5))
+
+
 if __name__ == '__main__':
     unittest.main()
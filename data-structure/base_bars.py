@@ -8,7 +8,18 @@ from typing import Tuple, Union, Generator, Iterable, Optional, Any
 import numpy as np
 import pandas as pd
 import csv
+import math
 import os
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+from bar_engine import tick_rule, aggressor_signs
+from checkpoint import load_checkpoint, save_checkpoint
+from tick_store import (TICK_COLUMNS, is_tick_store, is_parquet, iter_tick_store, iter_parquet, iter_csv,
+                        normalize_timestamps)
+from bar_sinks import BAR_COLUMNS, BarSink, MemorySink, bars_to_columns, open_sink
+from run_stats import BatchStats, RunStats, Stopwatch, peak_rss
 
 
 def _crop_data_frame_in_batches(df: pd.DataFrame, chunksize: int) -> list:
@@ -26,6 +37,68 @@ def _crop_data_frame_in_batches(df: pd.DataFrame, chunksize: int) -> list:
     return chunk_list
 
 
+def _read_in_batches(file_path: str, batch_size: int,
+                     start: int = 0) -> Generator[Tuple[pd.DataFrame, int], None, None]:
+    """
+    Reads one input file in batches. Tick stores and Parquet files are read without parsing, anything else as csv.
+    Every batch comes with the position of the next one: a row for tick stores and Parquet files, a byte offset for
+    csv files. The timestamps are parsed into datetime64[ns], with the unit of numeric timestamps detected once per
+    file.
+
+    :param file_path: (str) Path to the csv file, tick store directory or Parquet file
+    :param batch_size: (int) Number of rows per batch
+    :param start: (int) Position to read from, as yielded with a previous batch
+    """
+    unit = None
+    if is_tick_store(file_path) or is_parquet(file_path):
+        read = iter_tick_store if is_tick_store(file_path) else iter_parquet
+        for batch in read(file_path, batch_size, start):
+            start += len(batch)
+            batch, unit = normalize_timestamps(batch, unit)
+            yield batch, start
+    else:
+        for batch, offset in iter_csv(file_path, batch_size, start):
+            batch, unit = normalize_timestamps(batch, unit)
+            yield batch, offset
+
+
+def _read_file(file_path: str, batch_size: int, start: int = 0) -> list:
+    """
+    Reads all the batches of one input file, in a worker process of BaseBars._batch_iterator.
+
+    :param file_path: (str) Path to the csv file, tick store directory or Parquet file
+    :param batch_size: (int) Number of rows per batch
+    :param start: (int) Position to read from
+    :return: (list) Batches (pd.DataFrames), each with the position of the next one
+    """
+    return list(_read_in_batches(file_path, batch_size, start))
+
+
+def _same_settings(saved, current) -> bool:
+    """
+    :param saved: (dict) Settings saved in a checkpoint
+    :param current: (dict) Settings of the builder resuming from it
+    :return: (bool) Whether the settings are the same, comparing pd.Series thresholds by value
+    """
+    if isinstance(saved, dict) and isinstance(current, dict):
+        return saved.keys() == current.keys() and all(_same_settings(saved[key], current[key]) for key in saved)
+    if isinstance(saved, pd.Series) or isinstance(current, pd.Series):
+        return isinstance(saved, pd.Series) and isinstance(current, pd.Series) and saved.equals(current)
+    return saved == current
+
+
+def _describe_input(file_path_or_df: Union[str, list, pd.DataFrame]) -> tuple:
+    """
+    :param file_path_or_df: (str, list of str, or pd.DataFrame) Input of batch_run
+    :return: (tuple) Paths of the input files, or the length of the DataFrame, to check a checkpoint against
+    """
+    if isinstance(file_path_or_df, pd.DataFrame):
+        return 'DataFrame', len(file_path_or_df)
+    if isinstance(file_path_or_df, str):
+        return file_path_or_df,
+    return tuple(file_path_or_df)
+
+
 # pylint: disable=too-many-instance-attributes
 
 
@@ -36,6 +109,12 @@ class BaseBars(ABC):
     they are included here so as to avoid a complicated nested class structure.
     """
 
+    # Constructor arguments, which must be the same to resume from a checkpoint
+    checkpoint_settings = ('metric', 'batch_size')
+    # Running state saved in checkpoints: the bar in progress and the accumulators carried across bars
+    checkpoint_state = ('high_price', 'low_price', 'cum_dollar_value', 'cum_ticks', 'cum_volume', 'open_price',
+                        'cum_buy_volume', 'prev_price', 'prev_tick_rule')
+
     def __init__(self, metric: str, batch_size: int = 2e7):
         """
         Constructor
@@ -52,11 +131,16 @@ class BaseBars(ABC):
         self.cum_volume = 0
         self.open_price = None
         self.cum_buy_volume = 0
-        pass
+
+        # Tick rule state, carried across bars and batches
+        self.prev_price = None
+        self.prev_tick_rule = 0
 
     def batch_run(self, file_path_or_df: Union[str, Iterable[str], pd.DataFrame], verbose: bool = True,
                   to_csv: bool = False,
-                  output_path: Optional[str] = None) -> Union[pd.DataFrame, None]:
+                  output_path: Optional[str] = None, processes: Optional[int] = None,
+                  sink: Optional[BarSink] = None, checkpoint_path: Optional[str] = None,
+                  stats: Optional[RunStats] = None) -> Union[pd.DataFrame, None]:
         """
         Reads csv file(s) or pd.DataFrame in batches and then constructs the financial data structure in the form of a DataFrame.
         The csv file or DataFrame must have only 3 columns: date_time, price, & volume.
@@ -65,62 +149,194 @@ class BaseBars(ABC):
                                 raw tick data  in the format[date_time, price, volume]
         :param verbose: (bool) Flag whether to print message on each processed batch or not
         :param to_csv: (bool) Flag for writing the results of bars generation to local csv file, or to in-memory DataFrame
-        :param output_path: (bool) Path to results file, if to_csv = True
+        :param output_path: (bool) Path to results file, if to_csv = True. Written as Parquet if it ends with .parquet
+        :param processes: (int) Number of worker processes reading several files in parallel, see _batch_iterator
+        :param sink: (BarSink) Destination of the bars, overriding to_csv and output_path
+        :param checkpoint_path: (str) File where the state of the run is saved after every batch, removed when the run
+                                completes. If it exists, the run resumes from it: the input is read from the saved
+                                position, and the csv output is cut back to the bars written until then. An in-memory
+                                result, and the thresholds recorded with analyse_thresholds, only hold the bars built
+                                after the checkpoint. The builder must have the same settings as the checkpointed one.
+        :param stats: (RunStats) Filled in with the time spent reading, building, writing and checkpointing each
+                      batch, with its number of ticks and bars and the peak memory of the process
+
+        :return: (pd.DataFrame or None) Financial data structure, or the result of the sink
+        """
+        output_paths = [output_path] if to_csv and sink is None else []
+        file_path_or_df, start = self._resume(checkpoint_path, file_path_or_df, output_paths)
+        if sink is None:
+            sink = open_sink(output_path) if to_csv else MemorySink()
+
+        with sink:
+            stopwatch = Stopwatch()
+            for batch_no, (batch, position) in enumerate(self._batch_iterator(file_path_or_df, processes, start)):
+                parse_seconds = stopwatch.lap()
+                # If verbose is True, print the batch number
+                if verbose:
+                    print(f"Processing batch {batch_no + 1}...")
+
+                columns = self._run_columns(batch)
+                extract_seconds = stopwatch.lap()
+                sink.write(columns)
+                write_seconds = stopwatch.lap()
+                self._save_checkpoint(checkpoint_path, file_path_or_df, position, [sink], output_paths)
+                if stats is not None:
+                    stats.add(BatchStats(batch_no + 1, len(batch), len(columns['close']), parse_seconds,
+                                         extract_seconds, write_seconds, stopwatch.lap(), peak_rss()))
+                    # The statistics and their callback are not part of the next batch
+                    stopwatch.lap()
+
+        if checkpoint_path is not None and os.path.isfile(checkpoint_path):
+            os.remove(checkpoint_path)
+        return sink.result()
+
+    def _resume(self, checkpoint_path: Optional[str], file_path_or_df: Union[str, Iterable[str], pd.DataFrame],
+                output_paths: list) -> Tuple[Union[str, list, pd.DataFrame], Tuple[int, int]]:
+        """
+        Restores the state saved in checkpoint_path, if it exists, and cuts the csv outputs back to their size when it
+        was saved.
+
+        :param checkpoint_path: (str) Path of the checkpoint file, or None
+        :param file_path_or_df: (str, iterable of str, or pd.DataFrame) Input of batch_run
+        :param output_paths: (list) Paths of the csv files written by the run
+        :return: (tuple) Input, with an iterable of paths turned into a list, and the position to read it from:
+                 (file number, position in the file)
+        """
+        if not isinstance(file_path_or_df, (str, pd.DataFrame)) and isinstance(file_path_or_df, Iterable):
+            file_path_or_df = list(file_path_or_df)
+        if checkpoint_path is None:
+            return file_path_or_df, (0, 0)
+        if any(is_parquet(output_path) for output_path in output_paths):
+            raise ValueError('Runs writing Parquet files cannot be checkpointed, as they cannot be appended to.')
+        if not os.path.isfile(checkpoint_path):
+            return file_path_or_df, (0, 0)
+
+        checkpoint = load_checkpoint(checkpoint_path)
+        if checkpoint['input'] != _describe_input(file_path_or_df) or set(checkpoint['outputs']) != set(output_paths):
+            raise ValueError(f'{checkpoint_path} is the checkpoint of a run with other input or output files.')
+        if not _same_settings(checkpoint.get('settings'), self._get_checkpoint_settings()):
+            raise ValueError(f'{checkpoint_path} is the checkpoint of a run with other settings.')
+        self._set_checkpoint_state(checkpoint['state'])
+        for output_path, size in checkpoint['outputs'].items():
+            os.truncate(output_path, size)
+        return file_path_or_df, checkpoint['position']
+
+    def _save_checkpoint(self, checkpoint_path: Optional[str], file_path_or_df: Union[str, list, pd.DataFrame],
+                         position: Tuple[int, int], sinks: list, output_paths: list) -> None:
+        """
+        Saves the state of the builder and the position of the next batch, once the bars built so far are written.
+
+        :param checkpoint_path: (str) Path of the checkpoint file, or None to skip
+        :param file_path_or_df: (str, list of str, or pd.DataFrame) Input of batch_run
+        :param position: (tuple) Position of the next batch: (file number, position in the file)
+        :param sinks: (list) Sinks of the run, flushed before saving
+        :param output_paths: (list) Paths of the csv files written by the run
+        """
+        if checkpoint_path is None:
+            return
+        for sink in sinks:
+            sink.flush()
+        save_checkpoint(checkpoint_path, {
+            'input': _describe_input(file_path_or_df), 'position': position,
+            'settings': self._get_checkpoint_settings(), 'state': self._get_checkpoint_state(),
+            'outputs': {output_path: os.path.getsize(output_path) for output_path in output_paths}})
+
+    def _get_checkpoint_settings(self) -> dict:
+        """
+        :return: (dict) Constructor arguments of the builder, see checkpoint_settings
+        """
+        return {name: getattr(self, name) for name in self.checkpoint_settings}
+
+    def _get_checkpoint_state(self) -> dict:
+        """
+        :return: (dict) Running state of the builder, see checkpoint_state
+        """
+        return {name: getattr(self, name) for name in self.checkpoint_state}
+
+    def _set_checkpoint_state(self, state: dict) -> None:
+        """
+        :param state: (dict) Running state returned by _get_checkpoint_state
+        """
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def _batch_iterator(self, file_path_or_df: Union[str, Iterable[str], pd.DataFrame],
+                        processes: Optional[int] = None,
+                        start: Tuple[int, int] = (0, 0)) -> Generator[Tuple[pd.DataFrame, Tuple[int, int]], None, None]:
+        """
+        Yields the batches of the input, each with the position of the next one: (file number, row or byte offset).
+        The timestamps of every batch are parsed into datetime64[ns], see tick_store.normalize_timestamps.
+
+        :param file_path_or_df: (str, iterable of str, or pd.DataFrame) Path to the csv file(s), tick store(s) or
+                                Parquet file(s), or Pandas Data Frame containing raw tick data in the
+                                format[date_time, price, volume]
+        :param processes: (int) Number of worker processes reading an iterable of files in parallel, e.g. one file
+                          per trading day. None reads the files one after the other.
+        :param start: (tuple) Position to read from, as yielded with a previous batch
+        """
+        start_file, start_offset = start
+        if isinstance(file_path_or_df, pd.DataFrame):
+            unit = None
+            for batch in _crop_data_frame_in_batches(file_path_or_df.iloc[start_offset:], self.batch_size):
+                start_offset += len(batch)
+                batch, unit = normalize_timestamps(batch, unit, copy=True)
+                yield batch, (0, start_offset)
+            return
+        if isinstance(file_path_or_df, str):
+            file_path_or_df = [file_path_or_df]
+        elif not isinstance(file_path_or_df, Iterable):
+            return
 
-        :return: (pd.DataFrame or None) Financial data structure
-        """
-        all_bars = []  # List to store the bars dataframes before concatenation
+        file_paths = islice(enumerate(file_path_or_df), start_file, None)
+        if processes is not None:
+            yield from self._read_in_parallel(file_paths, processes, start)
+            return
+        for file_no, file_path in file_paths:
+            for batch, offset in self._read_in_batches(file_path, start_offset if file_no == start_file else 0):
+                yield batch, (file_no, offset)
 
-        for batch_no, batch in enumerate(self._batch_iterator(file_path_or_df)):
-            # If verbose is True, print the batch number
-            if verbose:
-                print(f"Processing batch {batch_no + 1}...")
+    def _read_in_batches(self, file_path: str, start: int = 0) -> Generator[Tuple[pd.DataFrame, int], None, None]:
+        """
+        Reads one input file in batches. Tick stores and Parquet files are read without parsing, anything else as csv.
 
-            # Generate bars and append to all_bars
-            bars = self.run(batch)
-            all_bars.append(bars)
+        :param file_path: (str) Path to the csv file, tick store directory or Parquet file
+        :param start: (int) Position to read from
+        """
+        yield from _read_in_batches(file_path, self.batch_size, start)
 
-            # If to_csv is True, save the bars to a CSV file
-            if to_csv:
-                if output_path is None:
-                    raise ValueError("output_path must be provided if to_csv is True.")
+    def _read_in_parallel(self, file_paths: Iterable[Tuple[int, str]], processes: int, start: Tuple[int, int] = (0, 0)
+                          ) -> Generator[Tuple[pd.DataFrame, Tuple[int, int]], None, None]:
+        """
+        Reads several files in a pool of worker processes and yields their batches in file order.
 
-                file_exists = os.path.isfile(output_path)
-                with open(output_path, mode='a', newline='') as file:
-                    writer = csv.writer(file)
-                    if not file_exists:
-                        writer.writerow(
-                            ['date_time', 'open', 'high', 'low', 'close', 'volume', 'buy_vol', 'ticks', 'dollar'])
-                    writer.writerows(bars)
+        Parsing the files is what costs time, while the bars are built many times faster than a csv is parsed. So
+        the workers only read the files, and the bars are still built here in a single pass, each file starting
+        from the state left by the previous one: the bars are the same as when reading the files one by one.
+        At most processes + 1 files are read ahead, to bound memory use.
 
-        # Concatenate all the bar dataframes and return
-        if to_csv:
-            return None
-        all_bars = pd.DataFrame(all_bars, columns=['date_time', 'price', 'volume'], index=None)
-        return all_bars
+        :param file_paths: (iterable of tuples) File numbers and paths to the csv files, tick stores or Parquet files,
+                           in time order
+        :param processes: (int) Number of worker processes
+        :param start: (tuple) Position to read from: (file number, position in the file)
+        """
+        with Pool(processes) as pool:
+            pending = deque()
+            for file_no, file_path in file_paths:
+                offset = start[1] if file_no == start[0] else 0
+                pending.append((file_no, pool.apply_async(_read_file, (file_path, self.batch_size, offset))))
+                if len(pending) > processes:
+                    yield from self._positioned(*pending.popleft())
+            while pending:
+                yield from self._positioned(*pending.popleft())
 
-    def _batch_iterator(self, file_path_or_df: Union[str, Iterable[str], pd.DataFrame]) -> Generator[
-        pd.DataFrame, None, None]:
+    @staticmethod
+    def _positioned(file_no: int, result) -> Generator[Tuple[pd.DataFrame, Tuple[int, int]], None, None]:
         """
-        :param file_path_or_df: (str, iterable of str, or pd.DataFrame) Path to the csv file(s) or Pandas Data Frame
-                                containing raw tick data in the format[date_time, price, volume]
+        :param file_no: (int) Number of the file read by a worker
+        :param result: (AsyncResult) Batches of the file, each with the position of the next one in the file
         """
-
-        if isinstance(file_path_or_df, str):
-            file_path_or_df = [file_path_or_df]
-            for file_path in file_path_or_df:
-                for batch in pd.read_csv(file_path, chunksize=self.batch_size):
-                    yield batch
-
-        elif isinstance(file_path_or_df, pd.DataFrame):
-            for batch in _crop_data_frame_in_batches(file_path_or_df, self.batch_size):
-                yield batch
-        elif isinstance(file_path_or_df, Iterable):
-            for file_path in file_path_or_df:
-                for batch in pd.read_csv(file_path, chunksize=self.batch_size):
-                    yield batch
-        else:
-            pass
+        for batch, offset in result.get():
+            yield batch, (file_no, offset)
 
     @staticmethod
     def _read_first_row(self, file_path: str):
@@ -132,14 +348,16 @@ class BaseBars(ABC):
     def run(self, data: Union[list, tuple, pd.DataFrame]) -> list:
         """
         Reads a List, Tuple, or Dataframe and then constructs the financial data structure in the form of a list.
-        The List, Tuple, or DataFrame must have only 3 attrs: date_time, price, & volume.
+        The List, Tuple, or DataFrame must have 3 attrs: date_time, price, & volume, optionally followed by the
+        exchange's is_buyer_maker flag.
 
         :param data: (list, tuple, or pd.DataFrame) Dict or ndarray containing raw tick data in the format[date_time, price, volume]
 
         :return: (list) Financial data structure
         """
         if isinstance(data, (list, tuple)):
-            data = pd.DataFrame(data, columns=['date_time', 'price', 'volume'])
+            data = pd.DataFrame(data)
+            data.columns = TICK_COLUMNS[:data.shape[1]]
         elif isinstance(data, pd.DataFrame):
             pass  # Data is already a DataFrame
         else:
@@ -147,6 +365,15 @@ class BaseBars(ABC):
 
         return self._extract_bars(data)
 
+    def _run_columns(self, data: pd.DataFrame) -> dict:
+        """
+        Same as run, but returns the bars as columns, which is what batch_run passes to its sink.
+
+        :param data: (pd.DataFrame) Contains 3 columns - date_time, price, and volume.
+        :return: (dict) Array of each field of BAR_COLUMNS
+        """
+        return bars_to_columns(self.run(data))
+
 
     @abstractmethod
     def _extract_bars(self, data: pd.DataFrame) -> list:
@@ -167,12 +394,13 @@ class BaseBars(ABC):
     @staticmethod
     def _assert_csv(test_batch: pd.DataFrame):
         """
-        Tests that the csv file read has the format: date_time, price, and volume.
+        Tests that the csv file read has the format: date_time, price, and volume, optionally followed by is_buyer_maker.
         If not then the user needs to create such a file. This format is in place to remove any unwanted overhead.
 
         :param test_batch: (pd.DataFrame) The first row of the dataset.
         """
-        assert test_batch.shape[1] == 3, 'Must have only 3 columns in csv: date_time, price, & volume.'
+        assert test_batch.shape[1] in (3, 4), \
+            'Must have only 3 columns in csv: date_time, price, & volume (and optionally is_buyer_maker).'
         assert isinstance(test_batch.iloc[0, 1], float), 'price column in csv not float.'
         assert not isinstance(test_batch.iloc[0, 2], str), 'volume column in csv not int or float.'
 
@@ -235,22 +463,113 @@ class BaseBars(ABC):
         :param price: (float) Price at time t
         :return: (int) The signed tick
         """
+        if self.prev_price is not None and price != self.prev_price:
+            self.prev_tick_rule = 1 if price > self.prev_price else -1
+        self.prev_price = price
+        return self.prev_tick_rule
 
-        pass
+    def _signed_ticks(self, data: pd.DataFrame) -> np.ndarray:
+        """
+        Signs all the ticks of a batch at once. The exchange's aggressor flag is used when the data has the optional
+        fourth column (is_buyer_maker), otherwise the tick rule, continued from the last tick of the previous batch.
+
+        :param data: (pd.DataFrame) Contains 3 or 4 columns - date_time, price, volume, and is_buyer_maker.
+        :return: (np.ndarray) Signed ticks
+        """
+        prices = data.iloc[:, 1].to_numpy()
+        if data.shape[1] > 3:
+            signs = aggressor_signs(data.iloc[:, 3].to_numpy())
+        else:
+            signs = tick_rule(prices, self.prev_price, self.prev_tick_rule)
+        if len(signs):
+            self.prev_price = prices[-1]
+            self.prev_tick_rule = int(signs[-1])
+        return signs
+
+    @staticmethod
+    def _loop_times(data: pd.DataFrame) -> Iterable:
+        """
+        Timestamps of a batch for the per-tick loops. datetime64 timestamps are iterated as np.datetime64 scalars,
+        which is about 30 times faster than boxing them into pd.Timestamp with tolist.
+
+        :param data: (pd.DataFrame) Contains 3 columns - date_time, price, and volume.
+        :return: (iterable) Timestamp of each tick
+        """
+        date_times = data.iloc[:, 0]
+        return date_times.to_numpy() if date_times.dtype.kind == 'M' else date_times.tolist()
 
-    def _get_imbalance(self, price: float, signed_tick: int, volume: float) -> float:
+    def _get_imbalance(self, price, signed_tick, volume):
         """
         Advances in Financial Machine Learning, page 29.
 
-        Get the imbalance at a point in time, denoted as Theta_t
+        Get the imbalance at a point in time, denoted as Theta_t. Also works element-wise on arrays of ticks.
 
-        :param price: (float) Price at t
-        :param signed_tick: (int) signed tick, using the tick rule
-        :param volume: (float) Volume traded at t
-        :return: (float) Imbalance at time t
+        :param price: (float or np.ndarray) Price at t
+        :param signed_tick: (int or np.ndarray) signed tick, using the tick rule
+        :param volume: (float or np.ndarray) Volume traded at t
+        :return: (float or np.ndarray) Imbalance at time t
         """
+        if self.metric in ('tick_imbalance', 'tick_run'):
+            return signed_tick
+        if self.metric in ('volume_imbalance', 'volume_run'):
+            return signed_tick * volume
+        if self.metric in ('dollar_imbalance', 'dollar_run'):
+            return signed_tick * volume * price
+        raise ValueError(f"Unknown imbalance metric: {self.metric}")
 
-        pass
+
+class IncrementalEWMA:
+    """
+    Exponentially weighted moving average, updated in O(1) per observation.
+
+    Uses the weights of pandas ewm(span=window, adjust=True): the value after n observations is
+    sum((1 - alpha)^i * x_(n-i)) / sum((1 - alpha)^i), with alpha = 2 / (window + 1). Only the two sums are stored,
+    so the whole history is taken into account without keeping it in memory. With max_length, only the last
+    max_length observations are weighted, like ewm(span=window) over array[-max_length:]: the observation leaving
+    the window is subtracted from the numerator, so the update stays O(1).
+    """
+
+    __slots__ = ('decay', 'numerator', 'denominator', 'count', 'history', 'oldest_weight')
+
+    def __init__(self, window: int, max_length: Optional[int] = None):
+        """
+        Constructor
+
+        :param window: (int) Span of the EWMA
+        :param max_length: (int) Number of most recent observations in the average, None for all of them
+        """
+        self.decay = 1 - 2 / (window + 1)
+        self.numerator = 0.0
+        self.denominator = 0.0
+        self.count = 0
+        self.history = None if max_length is None else deque(maxlen=int(max_length))
+        self.oldest_weight = None if max_length is None else self.decay ** int(max_length)
+
+    def update(self, value: float) -> float:
+        """
+        Adds an observation.
+
+        :param value: (float) New observation
+        :return: (float) Updated EWMA
+        """
+        history = self.history
+        if history is not None and len(history) == history.maxlen:
+            # The denominator already holds the weights of a full window
+            self.numerator = value + self.decay * self.numerator - self.oldest_weight * history[0]
+        else:
+            self.numerator = value + self.decay * self.numerator
+            self.denominator = 1 + self.decay * self.denominator
+        if history is not None:
+            history.append(value)
+        self.count += 1
+        return self.numerator / self.denominator
+
+    @property
+    def value(self) -> float:
+        """
+        :return: (float) Current EWMA, NaN before the first observation
+        """
+        return self.numerator / self.denominator if self.count else np.nan
 
 
 class BaseImbalanceBars(BaseBars):
@@ -258,6 +577,9 @@ class BaseImbalanceBars(BaseBars):
     Base class for Imbalance Bars (EMA and Const) which implements imbalance bars calculation logic
     """
 
+    checkpoint_settings = BaseBars.checkpoint_settings + ('expected_imbalance_window', 'exp_num_ticks_init')
+    checkpoint_state = BaseBars.checkpoint_state + ('thresholds', 'imbalance_ewma')
+
     def __init__(self, metric: str, batch_size: int,
                  expected_imbalance_window: int, exp_num_ticks_init: int,
                  analyse_thresholds: bool):
@@ -272,34 +594,76 @@ class BaseImbalanceBars(BaseBars):
         :param analyse_thresholds: (bool) Flag to return thresholds values (theta, exp_num_ticks, exp_imbalance) in a
                                           form of Pandas DataFrame
         """
+        super().__init__(metric, batch_size)
 
-        pass
+        self.expected_imbalance_window = expected_imbalance_window
+        self.exp_num_ticks_init = exp_num_ticks_init
+
+        self.thresholds = {'cum_theta': 0, 'expected_imbalance': np.nan, 'exp_num_ticks': exp_num_ticks_init}
+        self.imbalance_ewma = IncrementalEWMA(expected_imbalance_window, expected_imbalance_window)
+
+        # Thresholds of every tick, only stored when asked for
+        self.bars_thresholds = [] if analyse_thresholds else None
 
     def _reset_cache(self):
         """
         Implementation of abstract method _reset_cache for imbalance bars
         """
+        self.open_price = None
+        self.high_price, self.low_price = None, None
+        self.cum_ticks, self.cum_dollar_value, self.cum_volume, self.cum_buy_volume = 0, 0, 0, 0
+        self.thresholds['cum_theta'] = 0
 
-        pass
-
-    def _extract_bars(self, data: Tuple[dict, pd.DataFrame]) -> list:
+    def _extract_bars(self, data: pd.DataFrame) -> list:
         """
         For loop which compiles the various imbalance bars: dollar, volume, or tick.
 
         :param data: (pd.DataFrame) Contains 3 columns - date_time, price, and volume.
         :return: (list) Bars built using the current batch.
         """
-
-        pass
-
-    def _get_expected_imbalance(self, window: int):
-        """
-        Calculate the expected imbalance: 2P[b_t=1]-1, using a EWMA, pg 29
-        :param window: (int) EWMA window for calculation
-        :return: expected_imbalance: (np.ndarray) 2P[b_t=1]-1, approximated using a EWMA
-        """
-
-        pass
+        list_bars = []
+        thresholds = self.thresholds
+        signs = self._signed_ticks(data)
+        imbalances = self._get_imbalance(data.iloc[:, 1].to_numpy(), signs, data.iloc[:, 2].to_numpy())
+        for date_time, price, volume, signed_tick, imbalance in zip(
+                self._loop_times(data), data.iloc[:, 1].tolist(), data.iloc[:, 2].tolist(), signs.tolist(),
+                imbalances.tolist()):
+            self.cum_ticks += 1
+            self.cum_dollar_value += price * volume
+            self.cum_volume += volume
+            if self.open_price is None:
+                self.open_price = price
+            self._update_high_low(price)
+
+            if signed_tick > 0:
+                self.cum_buy_volume += volume
+            self.imbalance_ewma.update(imbalance)
+            thresholds['cum_theta'] += imbalance
+
+            # Expected imbalance becomes available once exp_num_ticks_init ticks have been seen
+            if math.isnan(thresholds['expected_imbalance']):
+                thresholds['expected_imbalance'] = self._get_expected_imbalance()
+
+            if self.bars_thresholds is not None:
+                self.bars_thresholds.append(dict(thresholds, timestamp=date_time))
+
+            if abs(thresholds['cum_theta']) > thresholds['exp_num_ticks'] * abs(thresholds['expected_imbalance']):
+                self._create_bars(date_time, price, list_bars)
+                thresholds['exp_num_ticks'] = self._get_exp_num_ticks()
+                thresholds['expected_imbalance'] = self._get_expected_imbalance()
+                self._reset_cache()
+
+        return list_bars
+
+    def _get_expected_imbalance(self):
+        """
+        Calculate the expected imbalance: 2P[b_t=1]-1, using a EWMA of the last expected_imbalance_window
+        imbalances, pg 29
+        :return: expected_imbalance: (float) 2P[b_t=1]-1, approximated using a EWMA, NaN during the warm up
+        """
+        if self.imbalance_ewma.count < self.exp_num_ticks_init:
+            return np.nan
+        return self.imbalance_ewma.value
 
     @abstractmethod
     def _get_exp_num_ticks(self):
@@ -314,6 +678,11 @@ class BaseRunBars(BaseBars):
     Base class for Run Bars (EMA and Const) which implements run bars calculation logic
     """
 
+    checkpoint_settings = BaseBars.checkpoint_settings + ('num_prev_bars', 'expected_imbalance_window',
+                                                          'exp_num_ticks_init')
+    checkpoint_state = BaseBars.checkpoint_state + ('thresholds', 'buy_imbalance_ewma', 'sell_imbalance_ewma',
+                                                    'buy_proportion_ewma', 'buy_ticks_num')
+
     def __init__(self, metric: str, batch_size: int, num_prev_bars: int,
                  expected_imbalance_window: int,
                  exp_num_ticks_init: int, analyse_thresholds: bool):
@@ -322,44 +691,108 @@ class BaseRunBars(BaseBars):
 
         :param metric: (str) Type of imbalance bar to create. Example: dollar_imbalance.
         :param batch_size: (int) Number of rows to read in from the csv, per batch.
+        :param num_prev_bars: (int) Window size for estimating the buy ticks proportion (number of previous bars)
         :param expected_imbalance_window: (int) Window used to estimate expected imbalance from previous trades
         :param exp_num_ticks_init: (int) Initial estimate for expected number of ticks in bar.
                                          For Const Imbalance Bars expected number of ticks equals expected number of ticks init
         :param analyse_thresholds: (bool) Flag to return thresholds values (thetas, exp_num_ticks, exp_runs) in Pandas DataFrame
         """
+        super().__init__(metric, batch_size)
 
-        pass
+        self.num_prev_bars = num_prev_bars
+        self.expected_imbalance_window = expected_imbalance_window
+        self.exp_num_ticks_init = exp_num_ticks_init
+
+        self.thresholds = {'cum_theta_buy': 0, 'cum_theta_sell': 0, 'exp_imbalance_buy': np.nan,
+                           'exp_imbalance_sell': np.nan, 'exp_num_ticks': exp_num_ticks_init,
+                           'exp_buy_ticks_proportion': np.nan, 'buy_ticks_proportion': 0}
+        self.buy_imbalance_ewma = IncrementalEWMA(expected_imbalance_window, expected_imbalance_window)
+        self.sell_imbalance_ewma = IncrementalEWMA(expected_imbalance_window, expected_imbalance_window)
+        self.buy_proportion_ewma = IncrementalEWMA(num_prev_bars, num_prev_bars)
+        self.buy_ticks_num = 0
+
+        # Thresholds of every tick, only stored when asked for
+        self.bars_thresholds = [] if analyse_thresholds else None
 
     def _reset_cache(self):
         """
         Implementation of abstract method _reset_cache for imbalance bars
         """
+        self.open_price = None
+        self.high_price, self.low_price = None, None
+        self.cum_ticks, self.cum_dollar_value, self.cum_volume, self.cum_buy_volume = 0, 0, 0, 0
+        self.buy_ticks_num = 0
+        self.thresholds['cum_theta_buy'], self.thresholds['cum_theta_sell'] = 0, 0
 
-        pass
-
-    def _extract_bars(self, data: Tuple[list, np.ndarray]) -> list:
+    def _extract_bars(self, data: pd.DataFrame) -> list:
         """
         For loop which compiles the various run bars: dollar, volume, or tick.
 
-        :param data: (list or np.ndarray) Contains 3 columns - date_time, price, and volume.
+        :param data: (pd.DataFrame) Contains 3 columns - date_time, price, and volume.
         :return: (list) of bars built using the current batch.
         """
-
-        pass
-
-    def _get_expected_imbalance(self, array: list, window: int, warm_up: bool = False):
+        list_bars = []
+        thresholds = self.thresholds
+        signs = self._signed_ticks(data)
+        imbalances = self._get_imbalance(data.iloc[:, 1].to_numpy(), signs, data.iloc[:, 2].to_numpy())
+        for date_time, price, volume, imbalance in zip(self._loop_times(data), data.iloc[:, 1].tolist(),
+                                                       data.iloc[:, 2].tolist(), imbalances.tolist()):
+            self.cum_ticks += 1
+            self.cum_dollar_value += price * volume
+            self.cum_volume += volume
+            if self.open_price is None:
+                self.open_price = price
+            self._update_high_low(price)
+
+            if imbalance > 0:
+                self.buy_imbalance_ewma.update(imbalance)
+                thresholds['cum_theta_buy'] += imbalance
+                self.buy_ticks_num += 1
+                self.cum_buy_volume += volume
+            elif imbalance < 0:
+                self.sell_imbalance_ewma.update(-imbalance)
+                thresholds['cum_theta_sell'] -= imbalance
+
+            # Expected imbalances become available once exp_num_ticks_init buy and sell ticks have been seen
+            if math.isnan(thresholds['exp_imbalance_buy']) or math.isnan(thresholds['exp_imbalance_sell']):
+                thresholds['exp_imbalance_buy'] = self._get_expected_imbalance(self.buy_imbalance_ewma, warm_up=True)
+                thresholds['exp_imbalance_sell'] = self._get_expected_imbalance(self.sell_imbalance_ewma, warm_up=True)
+                if not math.isnan(thresholds['exp_imbalance_buy']) and not math.isnan(thresholds['exp_imbalance_sell']):
+                    thresholds['exp_buy_ticks_proportion'] = self.buy_ticks_num / self.cum_ticks
+
+            if self.bars_thresholds is not None:
+                self.bars_thresholds.append(dict(thresholds, timestamp=date_time))
+
+            # Check expression for possible bar generation
+            max_proportion = max(thresholds['exp_imbalance_buy'] * thresholds['exp_buy_ticks_proportion'],
+                                 thresholds['exp_imbalance_sell'] * (1 - thresholds['exp_buy_ticks_proportion']))
+            max_theta = max(thresholds['cum_theta_buy'], thresholds['cum_theta_sell'])
+            if max_theta > thresholds['exp_num_ticks'] * max_proportion and not math.isnan(max_proportion):
+                self._create_bars(date_time, price, list_bars)
+
+                thresholds['buy_ticks_proportion'] = self.buy_ticks_num / self.cum_ticks
+                thresholds['exp_buy_ticks_proportion'] = self.buy_proportion_ewma.update(
+                    thresholds['buy_ticks_proportion'])
+                thresholds['exp_num_ticks'] = self._get_exp_num_ticks()
+                thresholds['exp_imbalance_buy'] = self._get_expected_imbalance(self.buy_imbalance_ewma)
+                thresholds['exp_imbalance_sell'] = self._get_expected_imbalance(self.sell_imbalance_ewma)
+                self._reset_cache()
+
+        return list_bars
+
+    def _get_expected_imbalance(self, ewma: IncrementalEWMA, warm_up: bool = False):
         """
         Advances in Financial Machine Learning, page 29.
 
         Calculates the expected imbalance: 2P[b_t=1]-1, using a EWMA.
 
-        :param array: (list) of imbalances
-        :param window: (int) EWMA window for calculation
-        :parawm warm_up: (bool) flag of whether warm up period passed
-        :return: expected_imbalance: (np.ndarray) 2P[b_t=1]-1, approximated using a EWMA
+        :param ewma: (IncrementalEWMA) EWMA of the last expected_imbalance_window buy or sell imbalances
+        :param warm_up: (bool) flag of whether warm up period passed
+        :return: expected_imbalance: (float) 2P[b_t=1]-1, approximated using a EWMA
         """
-
-        pass
+        if warm_up and ewma.count < self.exp_num_ticks_init:
+            return np.nan
+        return ewma.value
 
     @abstractmethod
     def _get_exp_num_ticks(self):
@@ -0,0 +1,327 @@
+"""
+Benchmarks of the bar builders, filters and features on synthetic tick data.
+
+Every entry point is timed on the same generated ticks, for throughput (rows per second) and peak memory. Peak memory
+is the peak of the Python and NumPy allocations traced by tracemalloc, measured in a separate run so that tracing does
+not slow down the timed one. The results are written as JSON and can be compared against a baseline saved by an
+earlier run, e.g. before and after an optimization:
+
+    python benchmarks.py --rows 1e5 1e7 --output baseline.json
+    python benchmarks.py --rows 1e5 1e7 --output results.json --baseline baseline.json
+
+The comparison exits with status 1 if a benchmark is slower than its baseline by more than the tolerance. The csv
+files read by some entry points are only written for the benchmarks selected with --benchmarks.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from DataStructures import DataStructures, RealTimeBars
+from features import get_daily_vol
+from filters import cusum_filter
+from jit import numba_available
+from standard_data_structures import StandardBars
+
+# Number of ticks of the warm-up run, which compiles the numba kernels before anything is timed
+WARM_UP_ROWS = 10000
+# Average number of ticks per bar of the generated thresholds
+TICKS_PER_BAR = 50
+
+
+def make_ticks(num_rows: int, seed: int = 42) -> pd.DataFrame:
+    """
+    Generates trades: a random walk of prices, exponential volumes and random aggressor flags, about 10 per second.
+
+    :param num_rows: (int) Number of ticks
+    :param seed: (int) Seed of the random generator
+    :return: (pd.DataFrame) date_time, price, volume and is_buyer_maker of each tick
+    """
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2023-01-01T00:00:00', 'ms')
+    return pd.DataFrame({
+        'date_time': start + np.cumsum(rng.integers(0, 200, num_rows)).astype('timedelta64[ms]'),
+        'price': np.round(1600 + np.cumsum(rng.normal(0, 0.05, num_rows)), 2),
+        'volume': np.round(rng.exponential(1.0, num_rows), 4),
+        'is_buyer_maker': rng.random(num_rows) < 0.5})
+
+
+class Fixtures:
+    """
+    Inputs of the benchmarks for one number of ticks, each generated the first time it is needed.
+    """
+
+    def __init__(self, num_rows: int, tmp_dir: str):
+        """
+        Constructor
+
+        :param num_rows: (int) Number of ticks
+        :param tmp_dir: (str) Directory of the generated csv files
+        """
+        self.num_rows = num_rows
+        self.tmp_dir = tmp_dir
+        self.ticks = make_ticks(num_rows)
+        self._files = {}
+        mean_dollar = float((self.ticks['price'] * self.ticks['volume']).mean())
+        self.thresholds = {'dollar': mean_dollar * TICKS_PER_BAR, 'volume': float(self.ticks['volume'].mean()) *
+                           TICKS_PER_BAR, 'tick': TICKS_PER_BAR}
+
+    def _file(self, name: str, write: Callable[[str], None]) -> str:
+        if name not in self._files:
+            self._files[name] = os.path.join(self.tmp_dir, f'{name}_{self.num_rows}.csv')
+            write(self._files[name])
+        return self._files[name]
+
+    @property
+    def tick_csv(self) -> str:
+        """
+        :return: (str) csv of date_time, price, volume, read by BaseBars.batch_run
+        """
+        return self._file('ticks', lambda path: self.ticks.iloc[:, :3].to_csv(path, index=False))
+
+    @property
+    def trades_csv(self) -> str:
+        """
+        :return: (str) csv of Date, Time, Price, Volume, IsBuyerMaker, read by DataStructures
+        """
+        def write(path):
+            date_times = self.ticks['date_time'].dt
+            pd.DataFrame({'Date': date_times.strftime('%Y-%m-%d'), 'Time': date_times.strftime('%H:%M:%S.%f').str[:-3],
+                          'Price': self.ticks['price'], 'Volume': self.ticks['volume'],
+                          'IsBuyerMaker': self.ticks['is_buyer_maker']}).to_csv(path, index=False)
+        return self._file('trades', write)
+
+    @property
+    def raw_csv(self) -> str:
+        """
+        :return: (str) Raw Binance trades csv, without header, read by ExtractData
+        """
+        def write(path):
+            pd.DataFrame({'trade_id': np.arange(self.num_rows), 'price': self.ticks['price'],
+                          'qty': self.ticks['volume'], 'quote_qty': self.ticks['price'] * self.ticks['volume'],
+                          'time': self.ticks['date_time'].astype('int64') // 10 ** 6,
+                          'is_buyer_maker': self.ticks['is_buyer_maker'], 'is_best_match': True}).to_csv(
+                path, index=False, header=False)
+        return self._file('raw', write)
+
+    @property
+    def close(self) -> pd.Series:
+        """
+        :return: (pd.Series) Prices indexed by their timestamps
+        """
+        return pd.Series(self.ticks['price'].to_numpy(), index=pd.DatetimeIndex(self.ticks['date_time']))
+
+
+def _standard_bars(metric: str, engine: str = 'auto', from_csv: bool = False):
+    def setup(fixtures: Fixtures, max_loop_rows: int) -> Tuple[Callable[[], object], int]:
+        data = fixtures.tick_csv if from_csv else fixtures.ticks.iloc[:, :3]
+        bars = StandardBars(metric, fixtures.thresholds[metric], batch_size=1000000, engine=engine)
+        return lambda: bars.batch_run(data, verbose=False), fixtures.num_rows
+    return setup
+
+
+def _data_structures(metric: str):
+    def setup(fixtures: Fixtures, max_loop_rows: int) -> Tuple[Callable[[], object], int]:
+        get_bars = getattr(DataStructures, f'get_{metric}_bars')
+        file_path, threshold = fixtures.trades_csv, fixtures.thresholds[metric]
+        return lambda: get_bars(file_path, threshold), fixtures.num_rows
+    return setup
+
+
+def _handle_trade(fixtures: Fixtures, max_loop_rows: int) -> Tuple[Callable[[], object], int]:
+    num_rows = min(fixtures.num_rows, max_loop_rows)
+    ticks = fixtures.ticks.iloc[:num_rows]
+    trades = pd.DataFrame({'Date': '2023-01-01', 'Time': '00:00:00.000', 'Price': ticks['price'],
+                           'Volume': ticks['volume'], 'IsBuyerMaker': ticks['is_buyer_maker']}).to_dict('records')
+
+    def run():
+        bars = RealTimeBars(fixtures.thresholds['dollar'], 'dollar')
+        for trade in trades:
+            bars.handle_trade(trade)
+    return run, num_rows
+
+
+def _handle_trades(fixtures: Fixtures, max_loop_rows: int, batch_size: int = 1000) -> Tuple[Callable[[], object], int]:
+    ticks = fixtures.ticks
+    columns = {'Date': np.full(len(ticks), '2023-01-01', dtype=object),
+               'Time': np.full(len(ticks), '00:00:00.000', dtype=object), 'Price': ticks['price'].to_numpy(),
+               'Volume': ticks['volume'].to_numpy(), 'IsBuyerMaker': ticks['is_buyer_maker'].to_numpy()}
+
+    def run():
+        bars = RealTimeBars(fixtures.thresholds['dollar'], 'dollar')
+        for start in range(0, len(ticks), batch_size):
+            bars.handle_trades({name: values[start:start + batch_size] for name, values in columns.items()})
+    return run, fixtures.num_rows
+
+
+def _cusum_filter(fixtures: Fixtures, max_loop_rows: int) -> Tuple[Callable[[], object], int]:
+    close = fixtures.close
+    threshold = float(close.diff().std()) * 5
+    return lambda: cusum_filter(close, threshold), fixtures.num_rows
+
+
+def _daily_vol(fixtures: Fixtures, max_loop_rows: int) -> Tuple[Callable[[], object], int]:
+    close = fixtures.close
+    return lambda: get_daily_vol(close), fixtures.num_rows
+
+
+def _extract_data(fixtures: Fixtures, max_loop_rows: int) -> Tuple[Callable[[], object], int]:
+    from data_preprocess import ExtractData
+    input_file = fixtures.raw_csv
+    output_file = os.path.join(fixtures.tmp_dir, f'extracted_{fixtures.num_rows}.csv')
+    return lambda: ExtractData().extract_and_save_tick(input_file, output_file), fixtures.num_rows
+
+
+BENCHMARKS = {
+    'standard_bars_dollar': _standard_bars('dollar'),
+    'standard_bars_volume': _standard_bars('volume'),
+    'standard_bars_tick': _standard_bars('tick'),
+    'standard_bars_dollar_numpy': _standard_bars('dollar', engine='numpy'),
+    'standard_bars_dollar_csv': _standard_bars('dollar', from_csv=True),
+    'data_structures_dollar': _data_structures('dollar'),
+    'data_structures_volume': _data_structures('volume'),
+    'data_structures_tick': _data_structures('tick'),
+    'real_time_bars_handle_trade': _handle_trade,
+    'real_time_bars_handle_trades': _handle_trades,
+    'cusum_filter': _cusum_filter,
+    'get_daily_vol': _daily_vol,
+    'extract_and_save_tick': _extract_data,
+}
+
+
+def _measure(run: Callable[[], object], repeat: int, memory: bool) -> Tuple[float, Optional[float]]:
+    """
+    :param run: (callable) Benchmarked call
+    :param repeat: (int) Number of timed runs
+    :param memory: (bool) Also measure the peak memory, in a separate run
+    :return: (tuple) Best time in seconds, and peak memory in MB or None
+    """
+    seconds = []
+    # The entry points print progress and timings, which are not part of the benchmark
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - start)
+        peak_memory = None
+        if memory:
+            tracemalloc.start()
+            try:
+                run()
+                peak_memory = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            finally:
+                tracemalloc.stop()
+    return min(seconds), peak_memory
+
+
+def run_benchmarks(sizes: List[int], names: List[str], repeat: int = 1, memory: bool = True,
+                   max_loop_rows: int = 1000000, tmp_dir: Optional[str] = None, verbose: bool = True) -> List[dict]:
+    """
+    Runs the benchmarks for every number of ticks.
+
+    :param sizes: (list) Numbers of ticks
+    :param names: (list) Names of the benchmarks, keys of BENCHMARKS
+    :param repeat: (int) Number of timed runs of each benchmark, the best one is kept
+    :param memory: (bool) Measure the peak memory of each benchmark
+    :param max_loop_rows: (int) Maximum number of ticks fed one at a time to the per-tick Python entry points
+    :param tmp_dir: (str) Directory of the generated csv files, a temporary directory if None
+    :param verbose: (bool) Print each result
+    :return: (list) Result of each benchmark and number of ticks
+    """
+    results = []
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as work_dir:
+        fixtures = Fixtures(WARM_UP_ROWS, work_dir)
+        for name in names:
+            _measure(BENCHMARKS[name](fixtures, max_loop_rows)[0], 1, False)
+
+        for num_rows in sizes:
+            fixtures = Fixtures(num_rows, work_dir)
+            for name in names:
+                run, rows = BENCHMARKS[name](fixtures, max_loop_rows)
+                seconds, peak_memory = _measure(run, repeat, memory)
+                results.append({'benchmark': name, 'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds,
+                                'peak_memory_mb': peak_memory})
+                if verbose:
+                    memory_text = f'{peak_memory:10.1f} MB' if peak_memory is not None else ''
+                    print(f'{name:32s} {rows:>12,d} rows {seconds:10.4f} s {rows / seconds:14,.0f} rows/s '
+                          f'{memory_text}')
+            del fixtures
+    return results
+
+
+def environment() -> Dict[str, str]:
+    """
+    :return: (dict) Versions and machine the benchmarks ran on
+    """
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'numba': str(numba_available()), 'machine': platform.machine(), 'processor': platform.processor(),
+            'cpu_count': str(os.cpu_count()), 'date': datetime.now(timezone.utc).isoformat(timespec='seconds')}
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float = 0.1) -> List[dict]:
+    """
+    Compares the times of the benchmarks run in both results.
+
+    :param results: (list) Results of run_benchmarks
+    :param baseline: (list) Results of an earlier run
+    :param tolerance: (float) Relative slowdown above which a benchmark is reported as a regression
+    :return: (list) Time ratio of each benchmark over its baseline, and whether it is a regression
+    """
+    baseline_seconds = {(result['benchmark'], result['rows']): result['seconds'] for result in baseline}
+    comparison = []
+    for result in results:
+        key = (result['benchmark'], result['rows'])
+        if key in baseline_seconds:
+            ratio = result['seconds'] / baseline_seconds[key]
+            comparison.append({'benchmark': key[0], 'rows': key[1], 'ratio': ratio,
+                               'regression': ratio > 1 + tolerance})
+    return comparison
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks of the bar builders, filters and features.')
+    parser.add_argument('--rows', type=float, nargs='+', default=[1e5, 1e7],
+                        help='numbers of ticks, e.g. 1e5 1e7 1e8')
+    parser.add_argument('--benchmarks', nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS),
+                        metavar='NAME', help=f'benchmarks to run, among: {", ".join(BENCHMARKS)}')
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs per benchmark, the best one is kept')
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory runs')
+    parser.add_argument('--max-loop-rows', type=float, default=1e6,
+                        help='maximum number of ticks fed one at a time to the per-tick entry points')
+    parser.add_argument('--tmp-dir', help='directory of the generated csv files')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON file of earlier results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative slowdown over the baseline reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks([int(rows) for rows in args.rows], args.benchmarks, args.repeat, not args.no_memory,
+                             int(args.max_loop_rows), args.tmp_dir)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'environment': environment(), 'results': results}, file, indent=2)
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as file:
+        comparison = compare(results, json.load(file)['results'], args.tolerance)
+    for item in comparison:
+        flag = 'REGRESSION' if item['regression'] else ''
+        print(f"{item['benchmark']:32s} {item['rows']:>12,d} rows {item['ratio']:8.2f}x baseline time {flag}")
+    return int(any(item['regression'] for item in comparison))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+"""
+Checkpoints of the bar builders, to resume after a restart instead of building the bars again from the start.
+
+A checkpoint holds the state of a builder (the bar in progress and every other accumulator) and the position in the
+input up to which the bars were built: a row of a DataFrame, tick store or Parquet file, or a byte offset in a csv
+file, so the csv is not parsed again up to it. It is pickled to a temporary file which then atomically replaces the
+previous checkpoint, so a crash while saving leaves the previous checkpoint intact.
+"""
+
+import os
+import pickle
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    """
+    :param path: (str) Path of the checkpoint file
+    :param checkpoint: (dict) Picklable state to save
+    """
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as file:
+        pickle.dump(checkpoint, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(path: str) -> dict:
+    """
+    :param path: (str) Path of the checkpoint file
+    :return: (dict) State saved by save_checkpoint
+    """
+    with open(path, 'rb') as file:
+        return pickle.load(file)
@@ -1,9 +1,17 @@
 import csv
-from datetime import datetime
+import io
+import os
+import zipfile
+from datetime import date
+from multiprocessing import Pool
 from logger import logger
 from binance_historical_data import BinanceDataDumper
 from typing import Tuple, Union, Generator, Iterable, Optional
 import pandas as pd
+from bar_engine import to_epoch_ns
+from downloads import BINANCE_DATA_URL, DownloadManager
+from tick_store import open_tick_writer
+
 
 class DataDumper:
     from binance_historical_data import BinanceDataDumper
@@ -19,18 +27,55 @@ class DataDumper:
             data_frequency=data_frequency,
         )
 
-    def dump(self, start: Union[Iterable[int], int], end: None):
-        if isinstance(start, Iterable):
-            sy, sm, sd = start
-        if isinstance(start, int) and end is None:
-            sy, sm, sd = start, 1, 1
+    def dump(self, start: Union[Iterable[int], int], end: Union[Iterable[int], None] = None,
+             tickers: Iterable[str] = ('ETHUSDT',)):
+        """
+        Downloads the data of the tickers one file after the other, with binance_historical_data.
+
+        :param start: (tuple or int) First day as (year, month, day), or a year to start on its first day
+        :param end: (tuple) Last day as (year, month, day), None for the last published day
+        :param tickers: (iterable of str) Trading pairs
+        """
+        start = date(start, 1, 1) if isinstance(start, int) else date(*start)
         self.data_dumper.dump_data(
-            tickers=['ETHUSDT'],
-            date_start=datetime.date(year=sy, month=sm, day=sd),
-            date_end=datetime.date(year=2023, month=9, day=28),
+            tickers=list(tickers),
+            date_start=start,
+            date_end=None if end is None else date(*end),
             is_to_update_existing=False,
         )
 
+    def download(self, tickers: Iterable[str], start, end=None, output_dir: Optional[str] = None,
+                 output_format: str = 'csv', with_aggressor: bool = False, max_workers: int = 8,
+                 base_url: str = BINANCE_DATA_URL) -> dict:
+        """
+        Downloads the daily archives of many tickers concurrently, verifies them against their checksums and skips
+        the ones already downloaded, see downloads.DownloadManager. Each archive is converted as soon as it is
+        verified, while the others are still downloading.
+
+        :param tickers: (iterable of str) Trading pairs, e.g. ['ETHUSDT', 'BTCUSDT']
+        :param start: (str or datetime.date) First day, e.g. '2023-09-01'
+        :param end: (str or datetime.date) Last day, included. Defaults to the last published day.
+        :param output_dir: (str) Directory of the converted files, None to only download the archives
+        :param output_format: (str) Format of the converted files: 'csv', 'parquet' or 'tick_store'
+        :param with_aggressor: (bool) Also write the is_buyer_maker flag
+        :param max_workers: (int) Number of archives downloaded at the same time
+        :param base_url: (str) Address of the server, e.g. a local server for testing
+        :return: (dict) Archives downloaded, skipped, missing on the server and failed, see DownloadManager.download
+        """
+        on_complete = None
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            extension = {'csv': '.csv', 'parquet': '.parquet', 'tick_store': ''}[output_format]
+            extractor = ExtractData()
+
+            def on_complete(archive_path, ticker, day):
+                output_path = os.path.join(output_dir, os.path.basename(archive_path)[:-len('.zip')] + extension)
+                extractor.extract_and_save(archive_path, output_path, with_aggressor=with_aggressor)
+
+        manager = DownloadManager(self.path_dir_where_to_dump, base_url=base_url, asset_class=self.asset_class,
+                                  data_type=self.data_type, max_workers=max_workers, on_complete=on_complete)
+        return manager.download(tickers, start, end)
+
 
 class BinanceTickData:
     def __init__(self):
@@ -47,64 +92,140 @@ class ExtractData:
     def __init__(self, data_src=BinanceTickData()):
         self.data_src = data_src
 
-    def extract_and_save_tick(self, input_file, output_file, writerow=None):
+    def extract_and_save_tick(self, input_file, output_file, writerow=None, with_aggressor=False, chunksize=1000000):
+        """
+        Converts a raw trades file into the date_time, price, volume format read by the bar builders. The file is
+        read and written in chunks, so memory use does not grow with the size of the file.
+
+        :param input_file: (str) Raw trades csv from the exchange
+        :param output_file: (str) Path of the converted csv
+        :param writerow: (list) Header of the converted csv
+        :param with_aggressor: (bool) Also write the is_buyer_maker flag, used to sign the trades instead of the tick rule
+        :param chunksize: (int) Number of rows converted at a time
+        """
         if writerow is None:
             writerow = ['Datetime', 'Price', 'Volume']
+            if with_aggressor:
+                writerow.append('IsBuyerMaker')
 
         try:
-            with open(input_file, 'r') as infile, open(output_file, 'w', newline='') as outfile:
-                # Initialize CSV reader and writer
-                reader = csv.reader(infile)
+            with open(output_file, 'w', newline='') as outfile:
                 writer = csv.writer(outfile)
-
-                # Write header to the output file
                 writer.writerow(writerow)
-
-                for row in reader:
-                    try:
-                        unix_time = int(row[self.data_src.unix_time])
-                        price = row[self.data_src.price]
-                        volume = row[self.data_src.qt]
-
-                        # Convert UNIX time to Date and Time
-                        dt = datetime.utcfromtimestamp(unix_time / 1000)
-                        date = dt.strftime('%Y-%m-%d')
-                        time = dt.strftime('%H:%M:%S.%f')[:-3]  # Include milliseconds and truncate to 3 decimal places
-                        # Write the extracted data to the output file
-                        writer.writerow([unix_time, price, volume])
-                    except ValueError as ve:
-                        logger.value_error(ve)
-                    except IndexError as ie:
-                        logger.index_error(ie, row)
-                logger.success_save(output_file)
+                terminator = writer.dialect.lineterminator
+                for chunk in self._read_raw_trades(input_file, chunksize, with_aggressor, as_text=True):
+                    # The fields are copied as text, which is much faster than formatting floats, and joined a
+                    # column at a time.
+                    lines = chunk.iloc[:, 0].str.cat([chunk[column] for column in chunk.columns[1:]], sep=',')
+                    outfile.write(terminator.join(lines))
+                    outfile.write(terminator)
+            logger.success_save(output_file)
         except FileNotFoundError:
             logger.file_not_found(input_file)
+        except ValueError as ve:
+            logger.value_error(ve)
         except Exception as e:
             logger.unexpected_error(e)
 
+    def _read_raw_trades(self, input_file: str, chunksize: int, with_aggressor: bool,
+                         as_text: bool = False) -> Generator[pd.DataFrame, None, None]:
+        """
+        Reads a raw trades csv in chunks with explicit dtypes, keeping only the date_time, price, volume and,
+        optionally, is_buyer_maker columns.
+
+        :param input_file: (str) Raw trades csv from the exchange, with or without a header line, or the zip archive
+                           holding it
+        :param chunksize: (int) Number of rows per chunk
+        :param with_aggressor: (bool) Also keep the is_buyer_maker flag
+        :param as_text: (bool) Keep every field as the original text instead of parsing it, for csv output
+        """
+        src = self.data_src
+        columns = {src.unix_time: 'int64', src.price: 'float64', src.qt: 'float64'}
+        if with_aggressor:
+            columns[src.maker_buying] = 'bool'
+        if as_text:
+            columns = dict.fromkeys(columns, str)
+        if zipfile.is_zipfile(input_file):
+            with zipfile.ZipFile(input_file) as archive, archive.open(archive.namelist()[0]) as member:
+                first_line = io.TextIOWrapper(member).readline()
+        else:
+            with open(input_file) as infile:
+                first_line = infile.readline()
+        has_header = not first_line.split(',')[0].strip().isdigit()
+        for chunk in pd.read_csv(input_file, header=None, skiprows=int(has_header), usecols=list(columns),
+                                 dtype=columns, chunksize=chunksize):
+            yield chunk[list(columns)]
+
+    def extract_and_save_tick_store(self, input_file, output_path, with_aggressor=False, chunksize=1000000):
+        """
+        Converts a raw trades file into a binary tick store, or into a Parquet file if output_path ends with
+        .parquet, which BaseBars.batch_run reads without parsing text.
+
+        :param input_file: (str) Raw trades csv from the exchange
+        :param output_path: (str) Directory of the tick store, or path of the Parquet file
+        :param with_aggressor: (bool) Also write the is_buyer_maker flag, used to sign the trades instead of the tick rule
+        :param chunksize: (int) Number of rows converted at a time
+        """
+        try:
+            with open_tick_writer(output_path) as writer:
+                for chunk in self._read_raw_trades(input_file, chunksize, with_aggressor):
+                    writer.write(chunk)
+            logger.success_save(output_path)
+        except FileNotFoundError:
+            logger.file_not_found(input_file)
+        except Exception as e:
+            logger.unexpected_error(e)
 
-def convert_datetime(df: pd.DataFrame, to_index: bool) -> pd.DataFrame:
+    def extract_and_save(self, input_file, output_path, with_aggressor=False, chunksize=1000000):
+        """
+        Converts a raw trades file into a csv if output_path ends with .csv, and into a tick store or Parquet file
+        otherwise.
+
+        :param input_file: (str) Raw trades csv from the exchange
+        :param output_path: (str) Path of the converted file
+        :param with_aggressor: (bool) Also write the is_buyer_maker flag, used to sign the trades instead of the tick rule
+        :param chunksize: (int) Number of rows converted at a time
+        """
+        if output_path.endswith('.csv'):
+            self.extract_and_save_tick(input_file, output_path, with_aggressor=with_aggressor, chunksize=chunksize)
+        else:
+            self.extract_and_save_tick_store(input_file, output_path, with_aggressor=with_aggressor,
+                                             chunksize=chunksize)
+
+    def extract_and_save_many(self, input_files, output_paths, with_aggressor=False, chunksize=1000000,
+                              processes=None):
+        """
+        Converts several raw trades files, e.g. the daily files of a month, in parallel with one file per process.
+
+        :param input_files: (iterable of str) Raw trades csv files from the exchange
+        :param output_paths: (iterable of str) Path of the converted file for each input file, see extract_and_save
+        :param with_aggressor: (bool) Also write the is_buyer_maker flag, used to sign the trades instead of the tick rule
+        :param chunksize: (int) Number of rows converted at a time by each process
+        :param processes: (int) Number of worker processes, defaults to the number of CPUs
+        """
+        jobs = [(input_file, output_path, with_aggressor, chunksize)
+                for input_file, output_path in zip(input_files, output_paths)]
+        if processes == 1 or len(jobs) <= 1:
+            for job in jobs:
+                self.extract_and_save(*job)
+            return
+        with Pool(processes) as pool:
+            pool.starmap(self.extract_and_save, jobs)
+
+
+def convert_datetime(df: pd.DataFrame, to_index: bool, unit: Optional[str] = None) -> pd.DataFrame:
     """
-    Convert the 'datetime' column of a DataFrame from UNIX format to standard datetime format if necessary.
-
-    :param df: Input DataFrame.
-    :return: DataFrame with converted 'datetime' column.
+    Converts the 'date_time' column of a DataFrame to datetime64[ns]. Only that column is allocated: the other columns
+    are shared with df, which is left unchanged.
+
+    :param df: (pd.DataFrame) Input DataFrame, with date_time as datetime strings, datetime64 values or numbers since
+               the epoch
+    :param to_index: (bool) Make date_time the index
+    :param unit: (str) Unit of numeric timestamps ('s', 'ms', 'us' or 'ns'), None to detect it from their magnitude
+    :return: (pd.DataFrame) DataFrame with converted 'date_time' column
     """
-
-    # Check the first entry of 'datetime' column to see if it's in UNIX format
-    # UNIX timestamps are typically large integers (e.g., 1617859850 for '2021-04-08 01:57:30')
-    # We'll use a simple heuristic: if it's a large integer, we assume it's UNIX timestamp
-    X = df.copy()
-    first_entry = X['date_time'].iloc[0]
-
-    try:
-        if isinstance(first_entry,
-                      (int, float)) and first_entry > 1e9:  # 1e9 is just an arbitrary large number as a threshold
-            # Convert UNIX timestamps to datetime format
-            X['date_time'] = pd.to_datetime(X['date_time'], unit='ms')  # 's' specifies seconds since epoch
-            print(f"Converted UNIX timestamp to datetime format: {X['date_time'].iloc[0]}")
-    except:
-        pass
+    X = df.copy(deep=False)
+    X['date_time'] = to_epoch_ns(X['date_time'].to_numpy(), unit).view('datetime64[ns]')
     if to_index:
         X.set_index('date_time', inplace=True)
     return X
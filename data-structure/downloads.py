@@ -0,0 +1,250 @@
+"""
+Parallel download of the daily trade archives published on data.binance.vision.
+
+The archives of many tickers and days are fetched by a bounded pool of threads. Each archive is verified against the
+sha256 of its .CHECKSUM file while it is written, and only then moved into place, so a file in the destination
+directory is always complete. A manifest in the destination directory records every verified archive, so a later run
+skips them without hashing them again. Each archive is passed to the on_complete hook as soon as it is verified, e.g.
+to convert it with ExtractData, while the other downloads continue.
+"""
+
+import datetime
+import hashlib
+import http.client
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, Optional, Union
+
+from logger import logger
+
+BINANCE_DATA_URL = 'https://data.binance.vision'
+MANIFEST_NAME = 'manifest.json'
+FUTURES_ASSET_CLASSES = ('um', 'cm')
+
+
+def as_date(value: Union[str, datetime.date]) -> datetime.date:
+    """
+    :param value: (str or datetime.date) Date, or string in the format YYYY-MM-DD
+    :return: (datetime.date) Date
+    """
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(value)
+
+
+def date_range(start: Union[str, datetime.date], end: Union[str, datetime.date, None] = None) -> list:
+    """
+    :param start: (str or datetime.date) First day
+    :param end: (str or datetime.date) Last day, included. Defaults to yesterday (UTC), the last published day.
+    :return: (list) Every day from start to end
+    """
+    start = as_date(start)
+    if end is None:
+        end = datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=1)
+    return [start + datetime.timedelta(days=offset) for offset in range((as_date(end) - start).days + 1)]
+
+
+class Manifest:
+    """
+    Index of the verified archives of a directory: the sha256 and size of each, by path relative to the directory.
+    Saved to a temporary file which then replaces the previous manifest, so it is never left half written.
+    """
+
+    def __init__(self, path: str):
+        """
+        Constructor
+
+        :param path: (str) Path of the manifest file, read if it exists
+        """
+        self.path = path
+        self.entries = {}
+        if os.path.isfile(path):
+            with open(path) as file:
+                self.entries = json.load(file)
+
+    def is_present(self, relative_path: str, directory: str) -> bool:
+        """
+        :param relative_path: (str) Path of the archive, relative to directory
+        :param directory: (str) Directory of the archives
+        :return: (bool) Whether the archive was verified and still has the verified size
+        """
+        entry = self.entries.get(relative_path)
+        path = os.path.join(directory, relative_path)
+        return entry is not None and os.path.isfile(path) and os.path.getsize(path) == entry['size']
+
+    def add(self, relative_path: str, sha256: str, size: int) -> None:
+        """
+        Records a verified archive and saves the manifest.
+
+        :param relative_path: (str) Path of the archive, relative to the directory of the manifest
+        :param sha256: (str) Hexadecimal sha256 of the archive
+        :param size: (int) Size of the archive in bytes
+        """
+        self.entries[relative_path] = {'sha256': sha256, 'size': size}
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.entries, file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+
+class DownloadManager:
+    """
+    Downloads and verifies the daily archives of several tickers and date ranges concurrently.
+    """
+
+    def __init__(self, dest_dir: str = '.', base_url: str = BINANCE_DATA_URL, asset_class: str = 'spot',
+                 data_type: str = 'trades', max_workers: int = 8, retries: int = 3, timeout: float = 60,
+                 on_complete: Optional[Callable[[str, str, datetime.date], None]] = None):
+        """
+        Constructor
+
+        :param dest_dir: (str) Directory where the archives are saved, in the layout of the server
+        :param base_url: (str) Address of the server, e.g. a local server for testing
+        :param asset_class: (str) 'spot', or 'um' / 'cm' for the USD-M and COIN-M futures
+        :param data_type: (str) Type of data, e.g. 'trades' or 'aggTrades'
+        :param max_workers: (int) Number of archives downloaded at the same time
+        :param retries: (int) Number of further attempts after a failed download
+        :param timeout: (float) Seconds to wait for the server before an attempt fails
+        :param on_complete: (callable) Called with the path, ticker and day of every archive once it is verified.
+                            Called in the thread that runs download, while the other archives are downloaded.
+        """
+        self.dest_dir = dest_dir
+        self.base_url = base_url.rstrip('/')
+        self.asset_class = asset_class
+        self.data_type = data_type
+        self.max_workers = max_workers
+        self.retries = retries
+        self.timeout = timeout
+        self.on_complete = on_complete
+        self.manifest = Manifest(os.path.join(dest_dir, MANIFEST_NAME))
+
+    def archive_path(self, ticker: str, day: datetime.date) -> str:
+        """
+        :param ticker: (str) Trading pair, e.g. 'ETHUSDT'
+        :param day: (datetime.date) Day of the archive
+        :return: (str) Path of the archive on the server, which is also its path relative to dest_dir
+        """
+        market = f'futures/{self.asset_class}' if self.asset_class in FUTURES_ASSET_CLASSES else self.asset_class
+        return (f'data/{market}/daily/{self.data_type}/{ticker}/'
+                f'{ticker}-{self.data_type}-{day.isoformat()}.zip')
+
+    def download(self, tickers: Iterable[str], start: Union[str, datetime.date],
+                 end: Union[str, datetime.date, None] = None) -> dict:
+        """
+        Downloads the archives of every ticker for every day from start to end. Archives already in the manifest
+        are skipped, and days without an archive on the server are reported as missing.
+
+        :param tickers: (iterable of str) Trading pairs, e.g. ['ETHUSDT', 'BTCUSDT']
+        :param start: (str or datetime.date) First day
+        :param end: (str or datetime.date) Last day, included. Defaults to yesterday (UTC).
+        :return: (dict) Paths relative to dest_dir of the archives 'downloaded', 'skipped' and 'missing', and the
+                 error of each archive that 'failed', to download or in on_complete
+        """
+        report = {'downloaded': [], 'skipped': [], 'missing': [], 'failed': {}}
+        jobs = []
+        for ticker in tickers:
+            for day in date_range(start, end):
+                relative_path = self.archive_path(ticker, day)
+                if self.manifest.is_present(relative_path, self.dest_dir):
+                    report['skipped'].append(relative_path)
+                else:
+                    jobs.append((ticker, day, relative_path))
+
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            futures = {pool.submit(self._fetch, relative_path): (ticker, day, relative_path)
+                       for ticker, day, relative_path in jobs}
+            # The manifest and the hook are only used from this thread
+            for future in as_completed(futures):
+                ticker, day, relative_path = futures[future]
+                try:
+                    result = future.result()
+                except (OSError, ValueError, http.client.HTTPException) as error:
+                    logger.value_error(f'{relative_path}: {error}')
+                    report['failed'][relative_path] = error
+                    continue
+                if result is None:
+                    report['missing'].append(relative_path)
+                    continue
+                if self.on_complete is not None:
+                    try:
+                        self.on_complete(os.path.join(self.dest_dir, relative_path), ticker, day)
+                    except Exception as error:
+                        # Left out of the manifest, so the next run processes the archive again
+                        logger.unexpected_error(f'{relative_path}: {error}')
+                        report['failed'][relative_path] = error
+                        continue
+                self.manifest.add(relative_path, *result)
+                report['downloaded'].append(relative_path)
+        return report
+
+    def _open(self, relative_path: str):
+        """
+        :param relative_path: (str) Path of a file on the server
+        :return: (http.client.HTTPResponse) Response, None if the server has no such file
+        """
+        try:
+            return urllib.request.urlopen(f'{self.base_url}/{relative_path}', timeout=self.timeout)
+        except urllib.error.HTTPError as error:
+            if error.code == 404:
+                return None
+            raise
+
+    def _fetch(self, relative_path: str) -> Optional[tuple]:
+        """
+        Downloads an archive and checks it against its .CHECKSUM file, in a worker thread. A download that fails
+        midway, e.g. on a lost connection or a truncated body, or that does not match its checksum, e.g. a corrupted
+        body or a stale copy served by a cache, is started again, up to retries times.
+
+        :param relative_path: (str) Path of the archive on the server
+        :return: (tuple) sha256 and size of the archive, None if the server has no such archive
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self._fetch_once(relative_path)
+            except (OSError, ValueError, http.client.HTTPException):
+                if attempt == self.retries:
+                    raise
+            time.sleep(0.5 * 2 ** attempt)
+
+    def _fetch_once(self, relative_path: str) -> Optional[tuple]:
+        """
+        :param relative_path: (str) Path of the archive on the server
+        :return: (tuple) sha256 and size of the archive, None if the server has no such archive
+        """
+        response = self._open(f'{relative_path}.CHECKSUM')
+        if response is None:
+            return None
+        with response:
+            expected = response.read().decode().split()[0].lower()
+
+        path = os.path.join(self.dest_dir, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.part'
+        response = self._open(relative_path)
+        if response is None:
+            return None
+        digest, size = hashlib.sha256(), 0
+        try:
+            with response, open(temp_path, 'wb') as file:
+                for block in iter(lambda: response.read(1 << 20), b''):
+                    digest.update(block)
+                    file.write(block)
+                    size += len(block)
+                if response.length:
+                    # read(amt) ends without an error when the connection is cut before the end of the body
+                    raise http.client.IncompleteRead(b'', response.length)
+            if digest.hexdigest() != expected:
+                raise ValueError(f'sha256 {digest.hexdigest()} does not match the checksum {expected}.')
+        except BaseException:
+            # Never leave a partial archive behind
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        os.replace(temp_path, path)
+        return expected, size
@@ -1,5 +1,11 @@
-from logger import logger
+from collections import deque
+import math
+
+import numpy as np
 import pandas as pd
+from logger import logger
+
+DAY_NS = 86400 * 10 ** 9
 
 def get_daily_vol(close, lookback=100):
     """
@@ -23,12 +29,12 @@ def get_daily_vol(close, lookback=100):
     :return: (pd.Series) Daily volatility value
     """
     if not isinstance(close.index, pd.DatetimeIndex):
-        close.index = pd.to_datetime(close.index)
+        close = close.set_axis(pd.to_datetime(close.index))
 
     daily_close = close.resample('D').last()
 
-    # Calculate the daily returns
-    daily_returns = daily_close.pct_change()
+    # Calculate the daily returns, days without a close keeping the previous close
+    daily_returns = daily_close.ffill().pct_change(fill_method=None)
 
     # Calculate the exponentially weighted moving standard deviation
     vol = daily_returns.ewm(span=lookback).std()
@@ -36,14 +42,197 @@ def get_daily_vol(close, lookback=100):
     return vol
 
 
-# def getVolatility(close, span0=100):
-#     # daily vol, reindexed to close
-#     try:
-#         df0 = close.index.searchsorted(close.index - pd.Timedelta(days=1))
-#         df0 = df0[df0 > 0]
-#         df0 = pd.Series(close.index[df0 - 1], index=close.index[close.shape[0] - df0.shape[0]:])
-#         df0 = close.loc[df0.index] / close.loc[df0.values].values - 1  # daily returns
-#         df0 = df0.ewm(span=span0).std()
-#         return df0
-#     except Exception as e:
-#         logger.value_error(e)
+def get_volatility(close, span0=100):
+    """
+    Advances in Financial Machine Learning, Snippet 3.1, page 44, intraday variant.
+
+    Computes the volatility of the returns over the last day at every timestamp of close: each close is compared with
+    the last close more than one day earlier, found for all the timestamps at once with searchsorted. Timestamps
+    without a close one day earlier are left out.
+
+    :param close: (pd.Series) Closing prices, with a sorted DatetimeIndex
+    :param span0: (int) Span of the exponentially weighted moving standard deviation
+    :return: (pd.Series) Volatility value
+    """
+    times = close.index.values
+    values = close.to_numpy(dtype=np.float64)
+    prev = np.searchsorted(times, times - np.timedelta64(1, 'D'))
+    prev = prev[prev > 0] - 1
+    first = len(values) - len(prev)
+    returns = pd.Series(values[first:] / values[prev] - 1, index=close.index[first:])
+    return returns.ewm(span=span0).std()
+
+
+class EWMVolatility:
+    """
+    Exponentially weighted moving standard deviation, updated in O(1) per observation.
+
+    Same recursion as pandas ewm(span=span).std(), with adjust=True, bias=False and ignore_na=False: the weighted mean
+    and variance are updated in place of recomputing them over the whole history, and missing values only decay the
+    weights. The values are the same as the batch computation.
+    """
+
+    __slots__ = ('old_wt_factor', 'mean', 'cov', 'sum_wt', 'sum_wt2', 'old_wt', 'nobs')
+
+    def __init__(self, span: float):
+        """
+        Constructor
+
+        :param span: (float) Span of the EWM standard deviation
+        """
+        com = (span - 1) / 2.0
+        self.old_wt_factor = 1.0 - 1.0 / (1.0 + com)
+        self.mean = None
+        self.cov = 0.0
+        self.sum_wt = self.sum_wt2 = self.old_wt = 1.0
+        self.nobs = 0
+
+    def _step(self, value: float) -> tuple:
+        """
+        :param value: (float) New observation, NaN if missing
+        :return: (tuple) State after value: mean, cov, sum_wt, sum_wt2, old_wt, nobs
+        """
+        is_observation = value == value
+        if self.mean is None:
+            return value, 0.0, 1.0, 1.0, 1.0, int(is_observation)
+
+        mean, cov, sum_wt, sum_wt2, old_wt = self.mean, self.cov, self.sum_wt, self.sum_wt2, self.old_wt
+        nobs = self.nobs + is_observation
+        if mean == mean:
+            sum_wt *= self.old_wt_factor
+            sum_wt2 *= self.old_wt_factor * self.old_wt_factor
+            old_wt *= self.old_wt_factor
+            if is_observation:
+                old_mean = mean
+                if mean != value:
+                    mean = ((old_wt * old_mean) + value) / (old_wt + 1.0)
+                cov = ((old_wt * (cov + ((old_mean - mean) * (old_mean - mean)))) +
+                       ((value - mean) * (value - mean))) / (old_wt + 1.0)
+                sum_wt += 1.0
+                sum_wt2 += 1.0
+                old_wt += 1.0
+        elif is_observation:
+            mean = value
+        return mean, cov, sum_wt, sum_wt2, old_wt, nobs
+
+    @staticmethod
+    def _std(state: tuple) -> float:
+        """
+        :param state: (tuple) State returned by _step
+        :return: (float) Bias-corrected standard deviation, NaN before two observations
+        """
+        _, cov, sum_wt, sum_wt2, _, nobs = state
+        numerator = sum_wt * sum_wt
+        denominator = numerator - sum_wt2
+        if nobs < 1 or denominator <= 0:
+            return math.nan
+        variance = (numerator / denominator) * cov
+        return math.sqrt(variance) if variance > 0 else (variance if variance != variance else 0.0)
+
+    def update(self, value: float) -> float:
+        """
+        :param value: (float) New observation, NaN if missing
+        :return: (float) Standard deviation including value
+        """
+        state = self._step(float(value))
+        self.mean, self.cov, self.sum_wt, self.sum_wt2, self.old_wt, self.nobs = state
+        return self._std(state)
+
+    def peek(self, value: float) -> float:
+        """
+        :param value: (float) Possible next observation
+        :return: (float) Standard deviation if value were added, without adding it
+        """
+        return self._std(self._step(float(value)))
+
+    @property
+    def value(self) -> float:
+        """
+        :return: (float) Current standard deviation
+        """
+        if self.mean is None:
+            return math.nan
+        return self._std((self.mean, self.cov, self.sum_wt, self.sum_wt2, self.old_wt, self.nobs))
+
+
+class DailyVolatility:
+    """
+    Incremental get_daily_vol, for closes arriving one bar at a time. The value returned after each close is the last
+    value of get_daily_vol over all the closes received so far, in O(1) instead of resampling the whole history: the
+    day in progress counts with its latest close, and days without closes are padded, as pct_change does.
+    """
+
+    def __init__(self, lookback: int = 100):
+        """
+        Constructor
+
+        :param lookback: (int) Lookback period to compute volatility
+        """
+        self.ewm = EWMVolatility(lookback)
+        self.day = None
+        self.day_close = math.nan
+        self.prev_close = math.nan
+
+    def _day_return(self) -> float:
+        """
+        :return: (float) Return of the day in progress over the close of the previous day
+        """
+        day_close = self.day_close if self.day_close == self.day_close else self.prev_close
+        return day_close / self.prev_close - 1
+
+    def _close_day(self) -> None:
+        """
+        Adds the return of the day in progress to the EWM and starts the next day.
+        """
+        self.ewm.update(self._day_return())
+        if self.day_close == self.day_close:
+            self.prev_close = self.day_close
+        self.day_close = math.nan
+
+    def update(self, time_stamp, close: float) -> float:
+        """
+        :param time_stamp: (pd.Timestamp, datetime or str) Time of the close
+        :param close: (float) Closing price of the last bar
+        :return: (float) Daily volatility value
+        """
+        day = pd.Timestamp(time_stamp).value // DAY_NS
+        if self.day is None:
+            self.day = day
+        elif day > self.day:
+            for _ in range(day - self.day):
+                self._close_day()
+            self.day = day
+        if close == close:
+            self.day_close = float(close)
+        return self.ewm.peek(self._day_return())
+
+
+class IntradayVolatility:
+    """
+    Incremental get_volatility, for closes arriving one bar at a time. Only the closes of the last day are kept.
+    """
+
+    def __init__(self, span0: int = 100):
+        """
+        Constructor
+
+        :param span0: (int) Span of the exponentially weighted moving standard deviation
+        """
+        self.ewm = EWMVolatility(span0)
+        self._closes = deque()
+
+    def update(self, time_stamp, close: float) -> float:
+        """
+        :param time_stamp: (pd.Timestamp, datetime or str) Time of the close, not earlier than the previous one
+        :param close: (float) Closing price of the last bar
+        :return: (float) Volatility value, NaN until a close more than one day earlier is known
+        """
+        time_ns = pd.Timestamp(time_stamp).value
+        self._closes.append((time_ns, float(close)))
+        start = time_ns - DAY_NS
+        # Keep the last close before start, and the ones after it
+        while len(self._closes) > 1 and self._closes[1][0] < start:
+            self._closes.popleft()
+        if self._closes[0][0] < start:
+            return self.ewm.update(close / self._closes[0][1] - 1)
+        return self.ewm.value
@@ -1,5 +1,79 @@
+from typing import Dict, Tuple, Union
+
+import numpy as np
 import pandas as pd
 
+from jit import compiled
+
+
+def _cusum_loop(diff, thresholds, threshold_step, s_pos, s_neg, events):
+    """
+    Symmetric CUSUM recursion, compiled with numba when it is installed and run on Python lists otherwise. The
+    threshold of element i is thresholds[i * threshold_step], so a step of 0 uses a single threshold.
+
+    :return: (tuple) Number of events written to events, and the final s_pos and s_neg
+    """
+    n_events = 0
+    for i in range(len(diff)):
+        # Same as max(0, s_pos + diff) and min(0, s_neg + diff), including for NaN
+        s_pos = s_pos + diff[i]
+        s_pos = s_pos if s_pos > 0 else 0.0
+        s_neg = s_neg + diff[i]
+        s_neg = s_neg if s_neg < 0 else 0.0
+
+        thresh = thresholds[i * threshold_step]
+        if s_neg < -thresh:
+            s_neg = 0.0
+            events[n_events] = i
+            n_events += 1
+        elif s_pos > thresh:
+            s_pos = 0.0
+            events[n_events] = i
+            n_events += 1
+    return n_events, s_pos, s_neg
+
+
+def _cusum(diff: np.ndarray, threshold: Union[float, np.ndarray], s_pos: float = 0.0,
+           s_neg: float = 0.0) -> Tuple[np.ndarray, float, float]:
+    """
+    Runs the CUSUM recursion over an array of changes.
+
+    :param diff: (np.ndarray) Changes of the time series
+    :param threshold: (float or np.ndarray) Threshold, or threshold for each change
+    :param s_pos: (float) Positive cumulative sum carried from previous changes
+    :param s_neg: (float) Negative cumulative sum carried from previous changes
+    :return: (tuple) Positions of the events in diff, and the final s_pos and s_neg
+    """
+    diff = np.ascontiguousarray(diff, dtype=np.float64)
+    thresholds = np.ascontiguousarray(np.atleast_1d(threshold), dtype=np.float64)
+    threshold_step = int(np.ndim(threshold) == 1)
+    events = np.empty(len(diff), dtype=np.int64)
+    kernel = compiled(_cusum_loop)
+    if kernel is None:
+        # Python floats are much faster to iterate than NumPy scalars
+        n_events, s_pos, s_neg = _cusum_loop(diff.tolist(), thresholds.tolist(), threshold_step, float(s_pos),
+                                             float(s_neg), events)
+    else:
+        n_events, s_pos, s_neg = kernel(diff, thresholds, threshold_step, float(s_pos), float(s_neg), events)
+    return events[:n_events], s_pos, s_neg
+
+
+def cusum_events(values: np.ndarray, threshold: Union[float, np.ndarray]) -> np.ndarray:
+    """
+    Symmetric CUSUM filter on raw arrays, see cusum_filter.
+
+    :param values: (np.ndarray) Close prices (or other time series, e.g. volatility)
+    :param threshold: (float or np.ndarray) Threshold, or threshold aligned with values
+    :return: (np.ndarray) Positions in values at which the events occurred
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 2:
+        return np.empty(0, dtype=np.int64)
+    if np.ndim(threshold) == 1:
+        threshold = np.asarray(threshold)[1:]
+    events, _, _ = _cusum(np.diff(values), threshold)
+    return events + 1
+
 
 def cusum_filter(raw_time_series, threshold, time_stamps=True):
     """
@@ -28,28 +102,101 @@ def cusum_filter(raw_time_series, threshold, time_stamps=True):
     :return: (datetime index vector) Vector of datetimes when the events occurred. This is used later to sample.
     """
 
-    t_events = []
-    s_pos = s_neg = 0
-    diff = raw_time_series.diff()
-
     # If threshold is a series, reindex it to raw_time_series index for compatibility
     if isinstance(threshold, pd.Series):
-        threshold = threshold.reindex(raw_time_series.index, method='bfill')
-
-    for i in diff.index[1:]:
-        s_pos = max(0, s_pos + diff.loc[i])
-        s_neg = min(0, s_neg + diff.loc[i])
-
-        thresh = threshold.loc[i] if isinstance(threshold, pd.Series) else threshold
+        threshold = threshold.reindex(raw_time_series.index, method='bfill').to_numpy(dtype=np.float64)
 
-        if s_neg < -thresh:
-            s_neg = 0
-            t_events.append(i)
-        elif s_pos > thresh:
-            s_pos = 0
-            t_events.append(i)
+    events = cusum_events(raw_time_series.to_numpy(dtype=np.float64), threshold)
+    t_events = raw_time_series.index[events]
 
     if time_stamps:
         return pd.DatetimeIndex(t_events)
     else:
-        return t_events
+        return t_events.tolist()
+
+
+def cusum_filter_many(raw_time_series: Union[pd.DataFrame, Dict[str, pd.Series]],
+                      threshold: Union[float, pd.Series, pd.DataFrame, Dict[str, Union[float, pd.Series]]],
+                      time_stamps: bool = True) -> Dict[str, Union[pd.DatetimeIndex, list]]:
+    """
+    Applies the CUSUM filter to the series of several symbols in one call.
+
+    :param raw_time_series: (pd.DataFrame or dict) One series per symbol, as columns or as a dict of pd.Series. The
+                            missing values of a column are dropped, so every symbol is filtered on its own timestamps.
+    :param threshold: (float, pd.Series, pd.DataFrame or dict) Threshold shared by all the symbols, or one per symbol
+                      as a column or dict entry
+    :param time_stamps: (bool) Default is to return a DateTimeIndex, change to false to have it return a list.
+    :return: (dict) Events of each symbol, see cusum_filter
+    """
+    if isinstance(raw_time_series, pd.DataFrame):
+        raw_time_series = {symbol: raw_time_series[symbol].dropna() for symbol in raw_time_series.columns}
+    t_events = {}
+    for symbol, series in raw_time_series.items():
+        symbol_threshold = threshold[symbol] if isinstance(threshold, (pd.DataFrame, dict)) else threshold
+        t_events[symbol] = cusum_filter(series, symbol_threshold, time_stamps)
+    return t_events
+
+
+class CusumFilter:
+    """
+    Stateful symmetric CUSUM filter, for a series arriving a few values at a time, e.g. the closes of the bars built by
+    RealTimeBars. s_pos, s_neg and the last value are kept between calls, so events are found without going over the
+    history again. Fed the same series, it emits the same events as cusum_filter.
+    """
+
+    def __init__(self, threshold: float):
+        """
+        Constructor
+
+        :param threshold: (float) Default threshold, used when update or update_many are not given one
+        """
+        self.threshold = threshold
+        self.prev_value = None
+        self.s_pos = 0.0
+        self.s_neg = 0.0
+        self._event = [0]
+
+    def update(self, value: float, threshold: float = None) -> bool:
+        """
+        Adds the next value of the series.
+
+        :param value: (float) Next value, e.g. the close of the last bar
+        :param threshold: (float) Threshold for this value, the default threshold if None
+        :return: (bool) True if the value triggers an event
+        """
+        value = float(value)
+        if self.prev_value is None:
+            self.prev_value = value
+            return False
+        threshold = self.threshold if threshold is None else threshold
+        n_events, self.s_pos, self.s_neg = _cusum_loop((value - self.prev_value,), (float(threshold),), 0,
+                                                       self.s_pos, self.s_neg, self._event)
+        self.prev_value = value
+        return n_events > 0
+
+    def update_many(self, values: Union[np.ndarray, pd.Series],
+                    threshold: Union[float, np.ndarray, None] = None) -> Union[np.ndarray, pd.Index]:
+        """
+        Adds the next values of the series.
+
+        :param values: (np.ndarray or pd.Series) Next values
+        :param threshold: (float or np.ndarray) Threshold, or threshold aligned with values. The default threshold if
+                          None
+        :return: (np.ndarray or pd.Index) Positions in values at which events occurred, or their index labels if values
+                 is a pd.Series
+        """
+        array = np.asarray(values, dtype=np.float64)
+        threshold = self.threshold if threshold is None else threshold
+        if len(array) == 0:
+            events = np.empty(0, dtype=np.int64)
+        elif self.prev_value is None:
+            if np.ndim(threshold) == 1:
+                threshold = np.asarray(threshold)[1:]
+            events, self.s_pos, self.s_neg = _cusum(np.diff(array), threshold, self.s_pos, self.s_neg)
+            events += 1
+        else:
+            events, self.s_pos, self.s_neg = _cusum(np.diff(array, prepend=self.prev_value), threshold, self.s_pos,
+                                                    self.s_neg)
+        if len(array):
+            self.prev_value = float(array[-1])
+        return values.index[events] if isinstance(values, pd.Series) else events
@@ -0,0 +1,235 @@
+"""
+Advances in Financial Machine Learning, Marcos Lopez de Prado
+Chapter 2: Financial Data Structures
+
+This module contains the functions to help users create structured financial data from raw unstructured data,
+in the form of tick, volume, and dollar imbalance bars.
+
+Imbalance bars sample whenever the cumulative signed flow (ticks, volume or dollar value, signed with the tick rule)
+exceeds its expected value, so that more bars are formed when informed traders are active. The expected imbalance and,
+for the EMA variant, the expected number of ticks per bar are estimated with exponentially weighted moving averages
+which are updated in O(1) per tick, so arbitrarily long files are processed in bounded memory.
+"""
+
+# Imports
+from typing import Union, Iterable, List, Optional, Tuple
+import time
+
+import numpy as np
+import pandas as pd
+
+from base_bars import BaseImbalanceBars, IncrementalEWMA
+
+
+class EMAImbalanceBars(BaseImbalanceBars):
+    """
+    Contains all of the logic to construct the EMA imbalance bars from chapter 2. The expected number of ticks per
+    bar is an EWMA of the number of ticks of the previous bars.
+    """
+
+    checkpoint_settings = BaseImbalanceBars.checkpoint_settings + ('num_prev_bars', 'min_exp_num_ticks',
+                                                                   'max_exp_num_ticks')
+    checkpoint_state = BaseImbalanceBars.checkpoint_state + ('num_ticks_ewma',)
+
+    def __init__(self, metric: str, num_prev_bars: int, expected_imbalance_window: int, exp_num_ticks_init: int,
+                 exp_num_ticks_constraints: Optional[List[float]], batch_size: int, analyse_thresholds: bool):
+        """
+        Constructor
+
+        :param metric: (str) Type of imbalance bar to create. Example: "dollar_imbalance"
+        :param num_prev_bars: (int) Window size for the EWMA of the number of ticks per bar
+        :param expected_imbalance_window: (int) EMA window used to estimate expected imbalance
+        :param exp_num_ticks_init: (int) Initial expected number of ticks per bar
+        :param exp_num_ticks_constraints: (list) Minimum and maximum possible number of expected ticks. Used to control
+                                          bars sampling convergence
+        :param batch_size: (int) Number of rows to read in from the csv, per batch
+        :param analyse_thresholds: (bool) Flag to save and return thresholds used to sample imbalance bars
+        """
+        super().__init__(metric, batch_size, expected_imbalance_window, exp_num_ticks_init, analyse_thresholds)
+
+        self.num_prev_bars = num_prev_bars
+        if exp_num_ticks_constraints is None:
+            self.min_exp_num_ticks = 0
+            self.max_exp_num_ticks = np.inf
+        else:
+            self.min_exp_num_ticks = exp_num_ticks_constraints[0]
+            self.max_exp_num_ticks = exp_num_ticks_constraints[1]
+        self.num_ticks_ewma = IncrementalEWMA(num_prev_bars, num_prev_bars)
+
+    def _get_exp_num_ticks(self):
+        """
+        Updates the EWMA of the number of ticks per bar with the bar being closed.
+
+        :return: (float) Expected number of ticks of the next bar, within the constraints
+        """
+        exp_num_ticks = self.num_ticks_ewma.update(self.cum_ticks)
+        return min(max(exp_num_ticks, self.min_exp_num_ticks), self.max_exp_num_ticks)
+
+
+class ConstImbalanceBars(BaseImbalanceBars):
+    """
+    Contains all of the logic to construct the imbalance bars with fixed expected number of ticks from chapter 2.
+    """
+
+    def __init__(self, metric: str, expected_imbalance_window: int, exp_num_ticks_init: int, batch_size: int,
+                 analyse_thresholds: bool):
+        """
+        Constructor
+
+        :param metric: (str) Type of imbalance bar to create. Example: "dollar_imbalance"
+        :param expected_imbalance_window: (int) EMA window used to estimate expected imbalance
+        :param exp_num_ticks_init: (int) Expected number of ticks per bar, kept constant
+        :param batch_size: (int) Number of rows to read in from the csv, per batch
+        :param analyse_thresholds: (bool) Flag to save and return thresholds used to sample imbalance bars
+        """
+        super().__init__(metric, batch_size, expected_imbalance_window, exp_num_ticks_init, analyse_thresholds)
+
+    def _get_exp_num_ticks(self):
+        """
+        :return: (float) Expected number of ticks, which stays equal to exp_num_ticks_init
+        """
+        return self.thresholds['exp_num_ticks']
+
+
+def _run_imbalance_bars(bars_generator: BaseImbalanceBars,
+                        file_path_or_df: Union[str, Iterable[str], pd.DataFrame], verbose: bool, to_csv: bool,
+                        output_path: Optional[str], timer: bool) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """
+    Runs an imbalance bars generator and collects the thresholds it recorded.
+
+    :return: (tuple) Bars (None if to_csv) and thresholds (None unless analyse_thresholds)
+    """
+    start_time = time.time()
+    bars_df = bars_generator.batch_run(file_path_or_df, verbose=verbose, to_csv=to_csv, output_path=output_path)
+    if timer:
+        print(f"Time taken to generate bars: {time.time() - start_time:.2f} seconds")
+    thresholds_df = None
+    if bars_generator.bars_thresholds is not None:
+        thresholds_df = pd.DataFrame(bars_generator.bars_thresholds)
+    return bars_df, thresholds_df
+
+
+def get_ema_dollar_imbalance_bars(file_path_or_df: Union[str, Iterable[str], pd.DataFrame], num_prev_bars: int = 3,
+                                  expected_imbalance_window: int = 10000, exp_num_ticks_init: int = 20000,
+                                  exp_num_ticks_constraints: Optional[List[float]] = None, batch_size: int = 2e7,
+                                  analyse_thresholds: bool = False, verbose: bool = True, to_csv: bool = False,
+                                  output_path: Optional[str] = None,
+                                  timer: bool = False) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """
+    Creates the EMA dollar imbalance bars: date_time, open, high, low, close, volume, cum_buy_volume, cum_ticks,
+    cum_dollar_value.
+
+    :param file_path_or_df: (str, iterable of str, or pd.DataFrame) Path to the csv file(s) or Pandas Data Frame containing raw tick data
+                            in the format[date_time, price, volume]
+    :param num_prev_bars: (int) Window size for the EWMA of the number of ticks per bar
+    :param expected_imbalance_window: (int) EMA window used to estimate expected imbalance
+    :param exp_num_ticks_init: (int) Initial expected number of ticks per bar
+    :param exp_num_ticks_constraints: (list) Minimum and maximum possible number of expected ticks
+    :param batch_size: (int) The number of rows per batch. Less RAM = smaller batch size.
+    :param analyse_thresholds: (bool) Flag to return the thresholds of every tick
+    :param verbose: (bool) Print out batch numbers (True or False)
+    :param to_csv: (bool) Save bars to csv after every batch run (True or False)
+    :param output_path: (str) Path to csv file, if to_csv is True
+    :param timer: (bool) Print the time taken to generate the bars
+    :return: (tuple) Dataframe of dollar imbalance bars and DataFrame of thresholds (None unless analyse_thresholds)
+    """
+    bars = EMAImbalanceBars(metric='dollar_imbalance', num_prev_bars=num_prev_bars,
+                            expected_imbalance_window=expected_imbalance_window,
+                            exp_num_ticks_init=exp_num_ticks_init, exp_num_ticks_constraints=exp_num_ticks_constraints,
+                            batch_size=batch_size, analyse_thresholds=analyse_thresholds)
+    return _run_imbalance_bars(bars, file_path_or_df, verbose, to_csv, output_path, timer)
+
+
+def get_ema_volume_imbalance_bars(file_path_or_df: Union[str, Iterable[str], pd.DataFrame], num_prev_bars: int = 3,
+                                  expected_imbalance_window: int = 10000, exp_num_ticks_init: int = 20000,
+                                  exp_num_ticks_constraints: Optional[List[float]] = None, batch_size: int = 2e7,
+                                  analyse_thresholds: bool = False, verbose: bool = True, to_csv: bool = False,
+                                  output_path: Optional[str] = None,
+                                  timer: bool = False) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """
+    Creates the EMA volume imbalance bars. Parameters are the same as get_ema_dollar_imbalance_bars.
+
+    :return: (tuple) Dataframe of volume imbalance bars and DataFrame of thresholds (None unless analyse_thresholds)
+    """
+    bars = EMAImbalanceBars(metric='volume_imbalance', num_prev_bars=num_prev_bars,
+                            expected_imbalance_window=expected_imbalance_window,
+                            exp_num_ticks_init=exp_num_ticks_init, exp_num_ticks_constraints=exp_num_ticks_constraints,
+                            batch_size=batch_size, analyse_thresholds=analyse_thresholds)
+    return _run_imbalance_bars(bars, file_path_or_df, verbose, to_csv, output_path, timer)
+
+
+def get_ema_tick_imbalance_bars(file_path_or_df: Union[str, Iterable[str], pd.DataFrame], num_prev_bars: int = 3,
+                                expected_imbalance_window: int = 10000, exp_num_ticks_init: int = 20000,
+                                exp_num_ticks_constraints: Optional[List[float]] = None, batch_size: int = 2e7,
+                                analyse_thresholds: bool = False, verbose: bool = True, to_csv: bool = False,
+                                output_path: Optional[str] = None,
+                                timer: bool = False) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """
+    Creates the EMA tick imbalance bars. Parameters are the same as get_ema_dollar_imbalance_bars.
+
+    :return: (tuple) Dataframe of tick imbalance bars and DataFrame of thresholds (None unless analyse_thresholds)
+    """
+    bars = EMAImbalanceBars(metric='tick_imbalance', num_prev_bars=num_prev_bars,
+                            expected_imbalance_window=expected_imbalance_window,
+                            exp_num_ticks_init=exp_num_ticks_init, exp_num_ticks_constraints=exp_num_ticks_constraints,
+                            batch_size=batch_size, analyse_thresholds=analyse_thresholds)
+    return _run_imbalance_bars(bars, file_path_or_df, verbose, to_csv, output_path, timer)
+
+
+def get_const_dollar_imbalance_bars(file_path_or_df: Union[str, Iterable[str], pd.DataFrame],
+                                    expected_imbalance_window: int = 10000, exp_num_ticks_init: int = 20000,
+                                    batch_size: int = 2e7, analyse_thresholds: bool = False, verbose: bool = True,
+                                    to_csv: bool = False, output_path: Optional[str] = None,
+                                    timer: bool = False) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """
+    Creates the Const dollar imbalance bars: date_time, open, high, low, close, volume, cum_buy_volume, cum_ticks,
+    cum_dollar_value.
+
+    :param file_path_or_df: (str, iterable of str, or pd.DataFrame) Path to the csv file(s) or Pandas Data Frame containing raw tick data
+                            in the format[date_time, price, volume]
+    :param expected_imbalance_window: (int) EMA window used to estimate expected imbalance
+    :param exp_num_ticks_init: (int) Expected number of ticks per bar
+    :param batch_size: (int) The number of rows per batch. Less RAM = smaller batch size.
+    :param analyse_thresholds: (bool) Flag to return the thresholds of every tick
+    :param verbose: (bool) Print out batch numbers (True or False)
+    :param to_csv: (bool) Save bars to csv after every batch run (True or False)
+    :param output_path: (str) Path to csv file, if to_csv is True
+    :param timer: (bool) Print the time taken to generate the bars
+    :return: (tuple) Dataframe of dollar imbalance bars and DataFrame of thresholds (None unless analyse_thresholds)
+    """
+    bars = ConstImbalanceBars(metric='dollar_imbalance', expected_imbalance_window=expected_imbalance_window,
+                              exp_num_ticks_init=exp_num_ticks_init, batch_size=batch_size,
+                              analyse_thresholds=analyse_thresholds)
+    return _run_imbalance_bars(bars, file_path_or_df, verbose, to_csv, output_path, timer)
+
+
+def get_const_volume_imbalance_bars(file_path_or_df: Union[str, Iterable[str], pd.DataFrame],
+                                    expected_imbalance_window: int = 10000, exp_num_ticks_init: int = 20000,
+                                    batch_size: int = 2e7, analyse_thresholds: bool = False, verbose: bool = True,
+                                    to_csv: bool = False, output_path: Optional[str] = None,
+                                    timer: bool = False) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """
+    Creates the Const volume imbalance bars. Parameters are the same as get_const_dollar_imbalance_bars.
+
+    :return: (tuple) Dataframe of volume imbalance bars and DataFrame of thresholds (None unless analyse_thresholds)
+    """
+    bars = ConstImbalanceBars(metric='volume_imbalance', expected_imbalance_window=expected_imbalance_window,
+                              exp_num_ticks_init=exp_num_ticks_init, batch_size=batch_size,
+                              analyse_thresholds=analyse_thresholds)
+    return _run_imbalance_bars(bars, file_path_or_df, verbose, to_csv, output_path, timer)
+
+
+def get_const_tick_imbalance_bars(file_path_or_df: Union[str, Iterable[str], pd.DataFrame],
+                                  expected_imbalance_window: int = 10000, exp_num_ticks_init: int = 20000,
+                                  batch_size: int = 2e7, analyse_thresholds: bool = False, verbose: bool = True,
+                                  to_csv: bool = False, output_path: Optional[str] = None,
+                                  timer: bool = False) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """
+    Creates the Const tick imbalance bars. Parameters are the same as get_const_dollar_imbalance_bars.
+
+    :return: (tuple) Dataframe of tick imbalance bars and DataFrame of thresholds (None unless analyse_thresholds)
+    """
+    bars = ConstImbalanceBars(metric='tick_imbalance', expected_imbalance_window=expected_imbalance_window,
+                              exp_num_ticks_init=exp_num_ticks_init, batch_size=batch_size,
+                              analyse_thresholds=analyse_thresholds)
+    return _run_imbalance_bars(bars, file_path_or_df, verbose, to_csv, output_path, timer)
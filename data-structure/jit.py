@@ -0,0 +1,46 @@
+"""
+Optional just-in-time compilation of the array kernels with Numba.
+
+Numba is imported lazily, the first time a compiled kernel is requested, so that it stays an optional dependency.
+Every kernel is written as a plain Python function over NumPy arrays; callers fall back to a NumPy implementation when
+compiled() returns None.
+"""
+
+from typing import Callable, Optional
+
+_numba = None
+_compiled = {}
+
+
+def _import_numba():
+    """
+    Imports numba once and caches the module, or False if it is not installed.
+    """
+    global _numba
+    if _numba is None:
+        try:
+            import numba
+            _numba = numba
+        except ImportError:
+            _numba = False
+    return _numba
+
+
+def numba_available() -> bool:
+    """
+    :return: (bool) True if numba can be imported
+    """
+    return bool(_import_numba())
+
+
+def compiled(py_func: Callable) -> Optional[Callable]:
+    """
+    Compiles py_func in nopython mode the first time it is requested.
+
+    :param py_func: (callable) Kernel written in the subset of Python supported by numba
+    :return: (callable or None) The compiled kernel, or None if numba is not installed
+    """
+    if py_func not in _compiled:
+        numba = _import_numba()
+        _compiled[py_func] = numba.njit(cache=True, nogil=True)(py_func) if numba else None
+    return _compiled[py_func]
@@ -0,0 +1,195 @@
+"""
+Latency and throughput of the live bars, to check how long after the trade that closes a bar the bar is emitted.
+
+Every trade message has the time of its event at the exchange (E, in milliseconds). TradeStream stamps it when it
+receives it and again when a bar builder emits a bar from it, and records the delays in histograms of fixed size,
+queried at any time or logged periodically: exchange event to receipt (network and queueing in the client), receipt
+to bar emission (processing), and exchange event to bar emission.
+"""
+
+import asyncio
+import time
+from typing import Callable, Optional
+
+from logger import logger
+
+# Each power of two is split into 2 ** SUB_BUCKET_BITS buckets, so percentiles are within 1/32 of the actual value
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies in nanoseconds, with log-linear buckets: exact below 64ns, then 32 buckets per power of
+    two. Recording a value is O(1) and the memory is fixed, however many values are recorded.
+    """
+
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.counts = [0] * (SUB_BUCKETS * (64 - SUB_BUCKET_BITS))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value: int) -> None:
+        """
+        Adds a latency. Negative values, from clocks out of sync, are recorded as 0.
+
+        :param value: (int) Latency in nanoseconds
+        """
+        value = max(int(value), 0)
+        shift = max(value.bit_length() - SUB_BUCKET_BITS - 1, 0)
+        self.counts[(shift << SUB_BUCKET_BITS) + (value >> shift)] += 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    @staticmethod
+    def _upper_bound(index: int) -> int:
+        """
+        :param index: (int) Bucket number
+        :return: (int) Largest value of the bucket
+        """
+        shift = max((index >> SUB_BUCKET_BITS) - 1, 0)
+        return ((index - (shift << SUB_BUCKET_BITS)) << shift) + (1 << shift) - 1
+
+    def percentile(self, percent: float) -> Optional[int]:
+        """
+        :param percent: (float) Percentile between 0 and 100
+        :return: (int) Latency below which percent of the values are, None if no value was recorded
+        """
+        if not self.count:
+            return None
+        rank = max(percent / 100 * self.count, 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(max(self._upper_bound(index), self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        """
+        :return: (float) Mean latency, None if no value was recorded
+        """
+        return self.total / self.count if self.count else None
+
+    def summary(self) -> dict:
+        """
+        :return: (dict) Count, then p50, p99, max and mean in milliseconds
+        """
+        def to_ms(value):
+            return None if value is None else value / 1e6
+
+        return {'count': self.count, 'p50_ms': to_ms(self.percentile(50)), 'p99_ms': to_ms(self.percentile(99)),
+                'max_ms': to_ms(self.max), 'mean_ms': to_ms(self.mean)}
+
+
+class LiveStats:
+    """
+    Latencies and rates of the messages and bars of a TradeStream, since it started and since the last reset.
+    """
+
+    def __init__(self, on_report: Optional[Callable[[dict], None]] = None):
+        """
+        Constructor
+
+        :param on_report: (callable) Called with every periodic snapshot, instead of logging it
+        """
+        self.on_report = on_report
+        self.total_messages = 0
+        self.total_bars = 0
+        self.started = time.monotonic()
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Starts a new interval: clears the histograms and the interval counts, but not the totals.
+        """
+        self.receive_latency = LatencyHistogram()
+        self.emit_latency = LatencyHistogram()
+        self.event_to_emit_latency = LatencyHistogram()
+        self.messages = 0
+        self.ignored_messages = 0
+        self.bars = 0
+        self.interval_started = time.monotonic()
+
+    def record_message(self, event_ms: int, received_ns: int, handled: bool = True) -> None:
+        """
+        :param event_ms: (int) Time of the trade at the exchange, in epoch milliseconds
+        :param received_ns: (int) Time the message was received, in epoch nanoseconds
+        :param handled: (bool) False if no builder was registered for the symbol of the message
+        """
+        self.messages += 1
+        self.total_messages += 1
+        if not handled:
+            self.ignored_messages += 1
+        self.receive_latency.record(received_ns - event_ms * 1000000)
+
+    def record_bar(self, event_ms: int, received_ns: int, emitted_ns: int) -> None:
+        """
+        :param event_ms: (int) Time at the exchange of the trade that closed the bar, in epoch milliseconds
+        :param received_ns: (int) Time that trade was received, in epoch nanoseconds
+        :param emitted_ns: (int) Time the bar was emitted, in epoch nanoseconds
+        """
+        self.bars += 1
+        self.total_bars += 1
+        self.emit_latency.record(emitted_ns - received_ns)
+        self.event_to_emit_latency.record(emitted_ns - event_ms * 1000000)
+
+    def snapshot(self, reset: bool = False) -> dict:
+        """
+        :param reset: (bool) Start a new interval after taking the snapshot
+        :return: (dict) Rates and latency percentiles of the current interval, and the totals
+        """
+        now = time.monotonic()
+        seconds = now - self.interval_started
+        snapshot = {
+            'seconds': seconds,
+            'messages': self.messages,
+            'ignored_messages': self.ignored_messages,
+            'bars': self.bars,
+            'messages_per_second': self.messages / seconds if seconds else None,
+            'bars_per_second': self.bars / seconds if seconds else None,
+            'receive_latency': self.receive_latency.summary(),
+            'emit_latency': self.emit_latency.summary(),
+            'event_to_emit_latency': self.event_to_emit_latency.summary(),
+            'total_messages': self.total_messages,
+            'total_bars': self.total_bars,
+            'uptime_seconds': now - self.started,
+        }
+        if reset:
+            self.reset()
+        return snapshot
+
+    def report(self) -> dict:
+        """
+        Takes a snapshot and starts a new interval. The snapshot is passed to on_report, or logged.
+
+        :return: (dict) Snapshot of the interval
+        """
+        snapshot = self.snapshot(reset=True)
+        if self.on_report is not None:
+            self.on_report(snapshot)
+        else:
+            logger.live_stats(snapshot)
+        return snapshot
+
+    async def report_every(self, interval: float) -> None:
+        """
+        Reports the statistics every interval seconds, until cancelled.
+
+        :param interval: (float) Seconds between reports
+        """
+        while True:
+            await asyncio.sleep(interval)
+            self.report()
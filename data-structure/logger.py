@@ -5,7 +5,7 @@ class logger:
     def __init__(self):
         logging.basicConfig(level=logging.INFO)
 
-    def file_not_found(input_file):
+    def file_not_found(self, input_file):
         logging.error(f"FileNotFoundError: {input_file} not found.")
 
     def success_save(self, output_file):
@@ -20,5 +20,23 @@ class logger:
     def unexpected_error(self, e):
         logging.error(f"An unexpected error occurred: {e}")
 
+    def connection_error(self, error):
+        logging.warning(f"Connection lost: {error}")
 
-logger = logger()
\ No newline at end of file
+    def batch_stats(self, stats):
+        logging.info(f"{stats}")
+
+    def live_stats(self, snapshot):
+        def to_text(name):
+            latency = snapshot[name]
+            if not latency['count']:
+                return f"{name} -"
+            return (f"{name} p50 {latency['p50_ms']:.3f} ms, p99 {latency['p99_ms']:.3f} ms, "
+                    f"max {latency['max_ms']:.3f} ms")
+
+        latencies = ', '.join(map(to_text, ('receive_latency', 'emit_latency', 'event_to_emit_latency')))
+        logging.info(f"{snapshot['messages']} messages ({snapshot['messages_per_second']:.1f}/s), "
+                     f"{snapshot['bars']} bars ({snapshot['bars_per_second']:.1f}/s), {latencies}")
+
+
+logger = logger()
@@ -0,0 +1,201 @@
+"""
+Timing of the stages of batch_run, to tell whether a slow run is bound by reading the input or by building the bars,
+without attaching a profiler.
+
+Every batch records the time spent waiting for it to be read and parsed, building its bars, writing them to the sink
+and checkpointing, with the number of ticks read, the number of bars emitted and the peak memory of the process.
+"""
+
+from typing import Callable, Optional
+import sys
+import time
+
+import pandas as pd
+
+from logger import logger
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def peak_rss() -> Optional[int]:
+    """
+    :return: (int) Peak resident set size of the process so far in bytes, None where it cannot be read
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, in kilobytes elsewhere
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class Stopwatch:
+    """
+    Measures consecutive stages of a loop with time.perf_counter.
+    """
+
+    __slots__ = ('last',)
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.last = time.perf_counter()
+
+    def lap(self) -> float:
+        """
+        :return: (float) Seconds since the previous lap, or since the stopwatch was started
+        """
+        now = time.perf_counter()
+        elapsed, self.last = now - self.last, now
+        return elapsed
+
+
+class BatchStats:
+    """
+    Statistics of one batch of batch_run.
+    """
+
+    __slots__ = ('batch_no', 'rows', 'bars', 'parse_seconds', 'extract_seconds', 'write_seconds',
+                 'checkpoint_seconds', 'peak_rss')
+
+    def __init__(self, batch_no: int, rows: int, bars: int, parse_seconds: float, extract_seconds: float,
+                 write_seconds: float, checkpoint_seconds: float = 0.0, peak_rss: Optional[int] = None):
+        """
+        Constructor
+
+        :param batch_no: (int) Number of the batch, from 1
+        :param rows: (int) Number of ticks in the batch
+        :param bars: (int) Number of bars built from the batch
+        :param parse_seconds: (float) Time waiting for the batch to be read and parsed. When the files are read by
+                              worker processes, only the time the workers did not hide.
+        :param extract_seconds: (float) Time building the bars
+        :param write_seconds: (float) Time writing the bars to the sink
+        :param checkpoint_seconds: (float) Time flushing the sink and saving the checkpoint
+        :param peak_rss: (int) Peak resident set size of the process after the batch, in bytes
+        """
+        self.batch_no = batch_no
+        self.rows = rows
+        self.bars = bars
+        self.parse_seconds = parse_seconds
+        self.extract_seconds = extract_seconds
+        self.write_seconds = write_seconds
+        self.checkpoint_seconds = checkpoint_seconds
+        self.peak_rss = peak_rss
+
+    @property
+    def seconds(self) -> float:
+        """
+        :return: (float) Time spent on the batch
+        """
+        return self.parse_seconds + self.extract_seconds + self.write_seconds + self.checkpoint_seconds
+
+    @property
+    def rows_per_second(self) -> float:
+        """
+        :return: (float) Ticks processed per second
+        """
+        return self.rows / self.seconds if self.seconds else float('nan')
+
+    def as_dict(self) -> dict:
+        """
+        :return: (dict) Every statistic of the batch
+        """
+        stats = {name: getattr(self, name) for name in self.__slots__}
+        stats['seconds'] = self.seconds
+        stats['rows_per_second'] = self.rows_per_second
+        return stats
+
+    def __repr__(self) -> str:
+        memory = '' if self.peak_rss is None else f", peak RSS {self.peak_rss / 2 ** 20:,.0f} MiB"
+        return (f"Batch {self.batch_no}: {self.rows} rows, {self.bars} bars, parse {self.parse_seconds:.3f}s, "
+                f"extract {self.extract_seconds:.3f}s, write {self.write_seconds:.3f}s, "
+                f"checkpoint {self.checkpoint_seconds:.3f}s, {self.rows_per_second:,.0f} rows/s{memory}")
+
+
+class RunStats:
+    """
+    Statistics of every batch of a run, passed to batch_run and filled in as the batches are processed.
+
+    Example: stats = RunStats(log=True); bars.batch_run(path, stats=stats); stats.to_frame()
+    """
+
+    def __init__(self, on_batch: Optional[Callable[[BatchStats], None]] = None, log: bool = False):
+        """
+        Constructor
+
+        :param on_batch: (callable) Called with the BatchStats of every batch, as soon as it is processed
+        :param log: (bool) Log the statistics of every batch with the logger module
+        """
+        self.on_batch = on_batch
+        self.log = log
+        self.batches = []
+
+    def add(self, batch: BatchStats) -> None:
+        """
+        Records the statistics of a batch.
+
+        :param batch: (BatchStats) Statistics of the batch
+        """
+        self.batches.append(batch)
+        if self.log:
+            logger.batch_stats(batch)
+        if self.on_batch is not None:
+            self.on_batch(batch)
+
+    def _total(self, name: str):
+        return sum(getattr(batch, name) for batch in self.batches)
+
+    @property
+    def rows(self) -> int:
+        """
+        :return: (int) Number of ticks processed
+        """
+        return self._total('rows')
+
+    @property
+    def bars(self) -> int:
+        """
+        :return: (int) Number of bars built
+        """
+        return self._total('bars')
+
+    @property
+    def seconds(self) -> float:
+        """
+        :return: (float) Time spent on all the batches
+        """
+        return self._total('seconds')
+
+    @property
+    def rows_per_second(self) -> float:
+        """
+        :return: (float) Ticks processed per second over the run
+        """
+        return self.rows / self.seconds if self.seconds else float('nan')
+
+    @property
+    def peak_rss(self) -> Optional[int]:
+        """
+        :return: (int) Peak resident set size of the process during the run, in bytes
+        """
+        return max((batch.peak_rss for batch in self.batches if batch.peak_rss is not None), default=None)
+
+    def stage_seconds(self) -> dict:
+        """
+        :return: (dict) Total time of each stage: parse, extract, write and checkpoint
+        """
+        return {stage: self._total(f'{stage}_seconds') for stage in ('parse', 'extract', 'write', 'checkpoint')}
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        :return: (pd.DataFrame) Statistics of every batch, one row per batch
+        """
+        return pd.DataFrame([batch.as_dict() for batch in self.batches])
+
+    def __repr__(self) -> str:
+        stages = ', '.join(f'{stage} {seconds:.3f}s' for stage, seconds in self.stage_seconds().items())
+        return (f"{len(self.batches)} batches: {self.rows} rows, {self.bars} bars, {stages}, "
+                f"{self.rows_per_second:,.0f} rows/s")
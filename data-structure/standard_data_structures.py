@@ -16,90 +16,303 @@ Many of the projects going forward will require Dollar and Volume bars.
 """
 
 # Imports
-from typing import Union, Iterable, Optional
+from contextlib import ExitStack
+import os
+from typing import Union, Iterable, Optional, Dict, Tuple
 import numpy as np
 import pandas as pd
 import time
-from base_bars import BaseBars
+from base_bars import BaseBars, BAR_COLUMNS
+from bar_sinks import MemorySink, bars_to_columns, columns_to_bars, open_sink
+from run_stats import BatchStats, RunStats, Stopwatch, peak_rss
+import bar_engine
+from bar_engine import BarState, align_thresholds, to_epoch_ns
+
+ENGINES = bar_engine.ENGINES + ('python',)
+
+
+def _state_attribute(name: str) -> property:
+    """
+    :param name: (str) Attribute of BarState
+    :return: (property) Attribute of the bar builder read from and written to its BarState
+    """
+    return property(lambda self: getattr(self.state, name), lambda self, value: setattr(self.state, name, value))
 
 
 class StandardBars(BaseBars):
-    def __init__(self, metric: str, threshold: int = 50000, batch_size: int = 20000000):
+    # The bar in progress is held by a BarState, the same as for the live bars
+    cum_dollar_value = _state_attribute('cum_dollar_value')
+    cum_volume = _state_attribute('cum_volume')
+    cum_buy_volume = _state_attribute('cum_buy_volume')
+    cum_ticks = _state_attribute('cum_ticks')
+    open_price = _state_attribute('open_price')
+    high_price = _state_attribute('high_price')
+    low_price = _state_attribute('low_price')
+
+    checkpoint_settings = BaseBars.checkpoint_settings + ('threshold', 'engine')
+    checkpoint_state = ('state', 'prev_price', 'prev_tick_rule')
+
+    def __init__(self, metric: str, threshold: Union[float, pd.Series] = 50000, batch_size: int = 20000000,
+                 engine: str = 'auto'):
         """
         Constructor
 
         :param metric: (str) Type of run bar to create. Example: "dollar_run"
-        :param threshold: (int) Threshold at which to sample
+        :param threshold: (float or pd.Series) Threshold at which to sample. A pd.Series indexed by timestamps (or by
+                          epoch milliseconds) gives the threshold in effect from each timestamp on, e.g. a daily
+                          threshold derived from the average daily volume
         :param batch_size: (int) Number of rows to read in from the csv, per batch
+        :param engine: (str) Sampling engine: 'auto' (numba if installed, numpy otherwise), 'numba', 'numpy', or
+                       'python' for the per-tick loop
         """
+        self.state = BarState(metric)
         super().__init__(metric, batch_size)
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}. Expected one of {ENGINES}.")
         self.threshold = threshold
-        self.cum_dollar_value = 0
-        self.cum_ticks = 0
-        self.cum_volume = 0
-        self.open_price = None
-        self.high_price = None
-        self.low_price = None
+        self.engine = engine
+        self._threshold_times = None
+        if isinstance(threshold, pd.Series):
+            threshold = threshold.sort_index()
+            self._threshold_times = to_epoch_ns(threshold.index)
+            self._threshold_values = threshold.to_numpy(dtype=np.float64)
 
     def _reset_cache(self):
         """
         Implementation of abstract method _reset_cache for standard bars
         """
-        self.cum_dollar_value = 0
-        self.cum_ticks = 0
-        self.cum_volume = 0
-        self.open_price = None
-        self.high_price = None
-        self.low_price = None
+        self.state.reset()
+
+    def _extract_bars(self, data: pd.DataFrame) -> list:
+        """
+        Compiles the various bars: dollar, volume, or tick, with the engine selected in the constructor.
+
+        :param data: (pd.DataFrame) Contains 3 columns - date_time, price, and volume, optionally is_buyer_maker.
+        :return: (list) Extracted bars
+        """
+        return columns_to_bars(self._run_columns(data))
+
+    def _run_columns(self, data: pd.DataFrame) -> dict:
+        """
+        Compiles the bars of a batch as columns, without building a list per bar.
+
+        :param data: (pd.DataFrame) Contains 3 columns - date_time, price, and volume, optionally is_buyer_maker.
+        :return: (dict) Array of each field of BAR_COLUMNS
+        """
+        signs = self._signed_ticks(data)
+        date_times = data.iloc[:, 0].to_numpy()
+        thresholds = self._tick_thresholds(date_times)
+        if self.engine == 'python':
+            return bars_to_columns(self._extract_bars_loop(data, signs, thresholds))
+
+        prices = data.iloc[:, 1].to_numpy()
+        volumes = data.iloc[:, 2].to_numpy()
+        buy_volumes = np.where(signs > 0, volumes, 0)
+        columns = self.state.run(thresholds, prices, volumes, buy_volumes, self.engine)
+
+        return {'date_time': date_times[columns['end']], 'open': columns['open'], 'high': columns['high'],
+                'low': columns['low'], 'close': columns['close'], 'volume': columns['volume'],
+                'buy_vol': columns['buy_volume'], 'ticks': columns['ticks'], 'dollar': columns['dollar']}
+
+    def _tick_thresholds(self, date_times: np.ndarray) -> Union[float, np.ndarray]:
+        """
+        :param date_times: (np.ndarray) Timestamps of the batch
+        :return: (float or np.ndarray) The threshold, or the threshold in effect at each tick if it is a pd.Series
+        """
+        if self._threshold_times is None:
+            return self.threshold
+        return align_thresholds(self._threshold_times, self._threshold_values, to_epoch_ns(date_times))
 
-    def _extract_bars(self, data: Union[list, tuple, np.ndarray]) -> list:
+    def _extract_bars_loop(self, data: pd.DataFrame, signs: np.ndarray, thresholds: Union[float, np.ndarray]) -> list:
         """
-        For loop which compiles the various bars: dollar, volume, or tick.
+        For loop which compiles the various bars: dollar, volume, or tick. Reference implementation of the numpy engine.
 
-        :param data: (tuple) Contains 3 columns - date_time, price, and volume.
+        :param data: (pd.DataFrame) Contains 3 columns - date_time, price, and volume, optionally is_buyer_maker.
+        :param signs: (np.ndarray) Signed ticks of the batch
+        :param thresholds: (float or np.ndarray) Threshold, or threshold per tick
         :return: (list) Extracted bars
         """
         bars = []
-        for index, row in data.iterrows():
-            date_time, price, volume = row
-            self.cum_dollar_value += price * volume
-            self.cum_ticks += 1
-            self.cum_volume += volume
-
-            if self.open_price is None:
-                self.open_price = price
-
-            self._update_high_low(price)
-            if (self.metric == 'dollar' and self.cum_dollar_value >= self.threshold) or (
-                    self.metric == 'volume' and self.cum_volume >= self.threshold) or (
-                    self.metric == 'tick' and self.cum_ticks >= self.threshold):
-                self._create_bars(date_time, price, bars)
-                self._reset_cache()
+        thresholds = np.broadcast_to(thresholds, len(data))
+        for (index, row), date_time, signed_tick, threshold in zip(data.iterrows(), self._loop_times(data), signs,
+                                                                   thresholds):
+            price, volume = row.iloc[1:3]
+            bar = self.state.step(price, volume, volume if signed_tick > 0 else 0, threshold)
+            if bar is not None:
+                bars.append([date_time, *bar])
 
         return bars
 
 
+class MultiBars(BaseBars):
+    """
+    Builds several standard bars (e.g. dollar, volume and tick bars with different thresholds) from a single pass
+    over the data, so the csv files are read and parsed once instead of once per bar type.
+    """
+
+    def __init__(self, specs: Union[Iterable[Tuple[str, Union[float, pd.Series]]], Dict[str, Tuple]],
+                 batch_size: int = 20000000, engine: str = 'auto'):
+        """
+        Constructor
+
+        :param specs: (iterable of tuples, or dict) (metric, threshold) pairs, e.g. [('dollar', 7e7), ('tick', 1000)],
+                      or a dict mapping a name to each pair. The bars of a pair are keyed by its name, or by
+                      (metric, threshold) without names. A pd.Series threshold cannot be a key, so without names its
+                      bars are keyed by (metric, position of the pair in specs).
+        :param batch_size: (int) Number of rows to read in from the csv, per batch
+        :param engine: (str) Sampling engine passed to every StandardBars
+        """
+        super().__init__('multi', batch_size)
+        if isinstance(specs, dict):
+            keyed_specs = specs.items()
+        else:
+            keyed_specs = (((metric, position) if isinstance(threshold, pd.Series) else (metric, threshold),
+                            (metric, threshold)) for position, (metric, threshold) in enumerate(specs))
+        self.builders = {}
+        for key, (metric, threshold) in keyed_specs:
+            if key in self.builders:
+                raise ValueError(f"Duplicate bar spec {key}.")
+            self.builders[key] = StandardBars(metric=metric, threshold=threshold, batch_size=batch_size,
+                                              engine=engine)
+
+    def _format_output_path(self, template: str, key) -> str:
+        """
+        :param template: (str) Template such as 'bars_{metric}_{threshold}.csv' or 'bars_{name}.csv'
+        :param key: Key of a bar spec
+        :return: (str) Path of the bars of the spec
+        """
+        builder = self.builders[key]
+        if isinstance(key, tuple):
+            return template.format(metric=key[0], threshold=key[1], name=f'{key[0]}_{key[1]}')
+        threshold = key if isinstance(builder.threshold, pd.Series) else builder.threshold
+        return template.format(metric=builder.metric, threshold=threshold, name=key)
+
+    def batch_run(self, file_path_or_df: Union[str, Iterable[str], pd.DataFrame], verbose: bool = True,
+                  to_csv: bool = False,
+                  output_path: Union[str, Dict[Tuple[str, float], str], None] = None,
+                  processes: Optional[int] = None,
+                  checkpoint_path: Optional[str] = None,
+                  stats: Optional[RunStats] = None) -> Union[Dict[Tuple[str, float], pd.DataFrame], None]:
+        """
+        Reads csv file(s) or pd.DataFrame in batches and constructs every bar type from each batch.
+
+        :param file_path_or_df: (str, iterable of str, or pd.DataFrame) Path to the csv file(s) or Pandas Data Frame
+                                containing raw tick data in the format[date_time, price, volume]
+        :param verbose: (bool) Flag whether to print message on each processed batch or not
+        :param to_csv: (bool) Flag for writing the results to one local csv file per spec, or to in-memory DataFrames
+        :param output_path: (str or dict) Paths to results files, if to_csv = True. Either a dict mapping the key
+                            of each spec to a path, or a template such as 'bars_{metric}_{threshold}.csv' or
+                            'bars_{name}.csv'
+        :param processes: (int) Number of worker processes reading several files in parallel
+        :param checkpoint_path: (str) File where the state of the run is saved after every batch, see
+                                BaseBars.batch_run
+        :param stats: (RunStats) Filled in with the statistics of each batch, see BaseBars.batch_run. The bars of a
+                      batch are counted over every spec.
+        :return: (dict or None) DataFrame of bars for each spec, keyed as in the constructor
+        """
+        if to_csv:
+            if output_path is None:
+                raise ValueError("output_path must be provided if to_csv is True.")
+            if isinstance(output_path, str):
+                output_path = {spec: self._format_output_path(output_path, spec) for spec in self.builders}
+        output_paths = [output_path[spec] for spec in self.builders] if to_csv else []
+        file_path_or_df, start = self._resume(checkpoint_path, file_path_or_df, output_paths)
+
+        with ExitStack() as stack:
+            sinks = {}
+            for spec in self.builders:
+                sinks[spec] = stack.enter_context(open_sink(output_path[spec]) if to_csv else MemorySink())
+            stopwatch = Stopwatch()
+            for batch_no, (batch, position) in enumerate(self._batch_iterator(file_path_or_df, processes, start)):
+                parse_seconds = stopwatch.lap()
+                if verbose:
+                    print(f"Processing batch {batch_no + 1}...")
+
+                num_bars, extract_seconds, write_seconds = 0, 0.0, 0.0
+                for spec, builder in self.builders.items():
+                    columns = builder._run_columns(batch)
+                    extract_seconds += stopwatch.lap()
+                    sinks[spec].write(columns)
+                    write_seconds += stopwatch.lap()
+                    num_bars += len(columns['close'])
+                self._save_checkpoint(checkpoint_path, file_path_or_df, position, list(sinks.values()), output_paths)
+                if stats is not None:
+                    stats.add(BatchStats(batch_no + 1, len(batch), num_bars, parse_seconds, extract_seconds,
+                                         write_seconds, stopwatch.lap(), peak_rss()))
+                    stopwatch.lap()
+
+        if checkpoint_path is not None and os.path.isfile(checkpoint_path):
+            os.remove(checkpoint_path)
+        if to_csv:
+            return None
+        return {spec: sink.result() for spec, sink in sinks.items()}
+
+    def _get_checkpoint_settings(self) -> dict:
+        """
+        :return: (dict) Batch size, and constructor arguments of every builder
+        """
+        return {'batch_size': self.batch_size,
+                'builders': {key: builder._get_checkpoint_settings() for key, builder in self.builders.items()}}
+
+    def _get_checkpoint_state(self) -> dict:
+        """
+        :return: (dict) Running state of every builder
+        """
+        return {key: builder._get_checkpoint_state() for key, builder in self.builders.items()}
+
+    def _set_checkpoint_state(self, state: dict) -> None:
+        """
+        :param state: (dict) Running state of every builder, returned by _get_checkpoint_state
+        """
+        for key, builder_state in state.items():
+            self.builders[key]._set_checkpoint_state(builder_state)
+
+    def _reset_cache(self):
+        """
+        Implementation of abstract method _reset_cache for multi bars
+        """
+        for builder in self.builders.values():
+            builder._reset_cache()
+
+    def _extract_bars(self, data: pd.DataFrame) -> Dict[Tuple[str, float], list]:
+        """
+        Runs every bar builder on the same batch.
+
+        :param data: (pd.DataFrame) Contains 3 columns - date_time, price, and volume.
+        :return: (dict) Extracted bars for each spec
+        """
+        return {spec: builder._extract_bars(data) for spec, builder in self.builders.items()}
+
+
 def get_dollar_bars(file_path_or_df: Union[str, Iterable[str], pd.DataFrame],
                     threshold: Union[int, pd.Series] = 70000000,
                     batch_size: int = 1024, verbose: bool = True,
-                    to_csv: bool = False, output_path: Optional[str] = None, timer: bool = False) -> pd.DataFrame:
+                    to_csv: bool = False, output_path: Optional[str] = None, timer: bool = False,
+                    engine: str = 'auto', processes: Optional[int] = None) -> pd.DataFrame:
     """
     Creates the dollar bars: date_time, open, high, low, close, volume, cum_buy_volume, cum_ticks, cum_dollar_value.
 
     :param file_path_or_df: (str, iterable of str, or pd.DataFrame) Path to the csv file(s) or Pandas Data Frame containing raw tick data
                             in the format[date_time, price, volume]
     :param threshold: (float, or pd.Series) A cumulative value above this threshold triggers a sample to be taken.
+                      A pd.Series indexed by timestamps gives the threshold in effect from each timestamp on.
     :param batch_size: (int) The number of rows per batch. Less RAM = smaller batch size.
     :param verbose: (bool) Print out batch numbers (True or False)
     :param to_csv: (bool) Save bars to csv after every batch run (True or False)
     :param output_path: (str) Path to csv file, if to_csv is True
+    :param timer: (bool) Print the time taken to generate the bars
+    :param engine: (str) 'auto' (default) for the compiled kernel when numba is installed and the vectorized numpy
+                   engine otherwise, 'numba', 'numpy', or 'python' for the per-tick loop
+    :param processes: (int) Number of worker processes reading several files in parallel, None reads them one by one
     :return: (pd.DataFrame) Dataframe of dollar bars
     """
     # Initialize the bar creation object
-    dollar_bars_generator = StandardBars(metric='dollar', threshold=threshold, batch_size=batch_size)
+    dollar_bars_generator = StandardBars(metric='dollar', threshold=threshold, batch_size=batch_size,
+                                         engine=engine)
     start_time = time.time()
     # Generate the bars
-    bars_df = dollar_bars_generator.batch_run(file_path_or_df, verbose=verbose, to_csv=to_csv, output_path=output_path)
+    bars_df = dollar_bars_generator.batch_run(file_path_or_df, verbose=verbose, to_csv=to_csv, output_path=output_path,
+                                              processes=processes)
     end_time = time.time()
     elapsed_time = (end_time - start_time)  # converting seconds to milliseconds
     if timer:
@@ -110,12 +323,15 @@ def get_dollar_bars(file_path_or_df: Union[str, Iterable[str], pd.DataFrame],
 def get_volume_bars(file_path_or_df: Union[str, Iterable[str], pd.DataFrame],
                     threshold: Union[int, pd.Series] = 70000000,
                     batch_size: int = 1024, verbose: bool = True,
-                    to_csv: bool = False, output_path: Optional[str] = None, timer: bool = False) -> pd.DataFrame:
+                    to_csv: bool = False, output_path: Optional[str] = None, timer: bool = False,
+                    engine: str = 'auto', processes: Optional[int] = None) -> pd.DataFrame:
     # Initialize the bar creation object
-    volume_bars_generator = StandardBars(metric='volume', threshold=threshold, batch_size=batch_size)
+    volume_bars_generator = StandardBars(metric='volume', threshold=threshold, batch_size=batch_size,
+                                         engine=engine)
     start_time = time.time()
     # Generate the bars
-    bars_df = volume_bars_generator.batch_run(file_path_or_df, verbose=verbose, to_csv=to_csv, output_path=output_path)
+    bars_df = volume_bars_generator.batch_run(file_path_or_df, verbose=verbose, to_csv=to_csv, output_path=output_path,
+                                              processes=processes)
     end_time = time.time()
     elapsed_time = (end_time - start_time)  # converting seconds to milliseconds
     if timer:
@@ -126,15 +342,51 @@ def get_volume_bars(file_path_or_df: Union[str, Iterable[str], pd.DataFrame],
 def get_tick_bars(file_path_or_df: Union[str, Iterable[str], pd.DataFrame],
                   threshold: Union[int, pd.Series] = 70000000,
                   batch_size: int = 1024, verbose: bool = True,
-                  to_csv: bool = False, output_path: Optional[str] = None, timer: bool = False) -> pd.DataFrame:
+                  to_csv: bool = False, output_path: Optional[str] = None, timer: bool = False,
+                  engine: str = 'auto', processes: Optional[int] = None) -> pd.DataFrame:
 
     # Initialize the bar creation object
-    tick_bars_generator = StandardBars(metric='tick', threshold=threshold, batch_size=batch_size)
+    tick_bars_generator = StandardBars(metric='tick', threshold=threshold, batch_size=batch_size,
+                                       engine=engine)
     start_time = time.time()
     # Generate the bars
-    bars_df = tick_bars_generator.batch_run(file_path_or_df, verbose=verbose, to_csv=to_csv, output_path=output_path)
+    bars_df = tick_bars_generator.batch_run(file_path_or_df, verbose=verbose, to_csv=to_csv, output_path=output_path,
+                                            processes=processes)
     end_time = time.time()
     elapsed_time = (end_time - start_time)  # converting seconds to milliseconds
     if timer:
         print(f"Time taken to generate bars: {elapsed_time:.2f} seconds")
     return bars_df
+
+
+def get_multi_bars(file_path_or_df: Union[str, Iterable[str], pd.DataFrame],
+                   specs: Union[Iterable[Tuple[str, Union[float, pd.Series]]], Dict[str, Tuple]],
+                   batch_size: int = 1024, verbose: bool = True,
+                   to_csv: bool = False, output_path: Union[str, Dict[Tuple[str, float], str], None] = None,
+                   timer: bool = False, engine: str = 'auto',
+                   processes: Optional[int] = None) -> Union[Dict[Tuple[str, float], pd.DataFrame], None]:
+    """
+    Creates several standard bars in one pass over the data.
+
+    :param file_path_or_df: (str, iterable of str, or pd.DataFrame) Path to the csv file(s) or Pandas Data Frame containing raw tick data
+                            in the format[date_time, price, volume]
+    :param specs: (iterable of tuples, or dict) (metric, threshold) pairs, e.g. [('dollar', 7e7), ('tick', 1000)], or a
+                  dict mapping a name to each pair, see MultiBars
+    :param batch_size: (int) The number of rows per batch. Less RAM = smaller batch size.
+    :param verbose: (bool) Print out batch numbers (True or False)
+    :param to_csv: (bool) Save bars to csv after every batch run (True or False)
+    :param output_path: (str or dict) Dict of paths per spec, or template such as 'bars_{metric}_{threshold}.csv' or
+                        'bars_{name}.csv'
+    :param timer: (bool) Print the time taken to generate the bars
+    :param engine: (str) Sampling engine, see get_dollar_bars
+    :param processes: (int) Number of worker processes reading several files in parallel, see get_dollar_bars
+    :return: (dict) Dataframe of bars for each spec, keyed as in MultiBars
+    """
+    multi_bars_generator = MultiBars(specs=specs, batch_size=batch_size, engine=engine)
+    start_time = time.time()
+    bars = multi_bars_generator.batch_run(file_path_or_df, verbose=verbose, to_csv=to_csv, output_path=output_path,
+                                          processes=processes)
+    elapsed_time = time.time() - start_time
+    if timer:
+        print(f"Time taken to generate bars: {elapsed_time:.2f} seconds")
+    return bars
@@ -1,7 +1,27 @@
+import asyncio
+import csv
+import functools
+import hashlib
+import http.server
+import json
+import os
+import tempfile
+import threading
 import unittest
+import zipfile
 import pandas as pd
 import numpy as np
-from DataStructures import DataStructures  # Replace with actual module name
+from DataStructures import DataStructures, RealTimeBars  # Replace with actual module name
+from standard_data_structures import StandardBars
+from data_preprocess import ExtractData
+from downloads import DownloadManager
+from live_stats import LatencyHistogram, LiveStats
+from websocket import TradeStream, parse_trade
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
 
 class TestDataStructures(unittest.TestCase):
 
@@ -36,10 +56,377 @@ class TestDataStructures(unittest.TestCase):
         self.assertTrue('cum_dollar_value' in dollar_bars.columns)
         self.assertTrue(dollar_bars['cum_dollar_value'].iloc[-1] >= self.threshold)
 
+    def test_handle_trades_matches_handle_trade(self):
+        trades = self.df.assign(Date=self.df['Date'].astype(str), Time=self.df['Time'].astype(str),
+                                IsBuyerMaker=self.df['Price'] > 50)
+        for bar_type, threshold in (('dollar', 10000), ('volume', self.threshold), ('tick', 7)):
+            per_trade_bars, batched_bars = [], []
+            per_trade = RealTimeBars(threshold=threshold, bar_type=bar_type, on_bar=per_trade_bars.append, max_bars=20)
+            for trade in trades.to_dict('records'):
+                per_trade.handle_trade(trade)
+            batched = RealTimeBars(threshold=threshold, bar_type=bar_type, on_bar=batched_bars.append, max_bars=20)
+            for start in range(0, len(trades), 64):
+                batched.handle_trades(trades.iloc[start:start + 64])
+            self.assertEqual(batched_bars, per_trade_bars)
+            self.assertTrue(len(per_trade_bars) > 20)
+
+            # Only the last bars are kept
+            expected = pd.DataFrame(per_trade_bars[-20:], columns=per_trade.get_bars().columns)
+            for bars in (per_trade, batched):
+                pd.testing.assert_frame_equal(bars.get_bars(), expected, check_dtype=False)
+                pd.testing.assert_frame_equal(bars.get_bars(last=5), expected.iloc[-5:].reset_index(drop=True),
+                                              check_dtype=False)
+
+    def test_live_replay_matches_backtest(self):
+        trades = pd.read_csv('test_data.csv')
+        for bar_type, threshold, get_bars in (('dollar', 10000, DataStructures.get_dollar_bars),
+                                              ('volume', self.threshold, DataStructures.get_volume_bars),
+                                              ('tick', 7, DataStructures.get_tick_bars)):
+            live = RealTimeBars(threshold=threshold, bar_type=bar_type)
+            for trade in trades.to_dict('records'):
+                live.handle_trade(trade)
+            live_bars = live.get_bars()
+            backtest_bars = get_bars('test_data.csv', threshold, batch_size=300)
+            metric = 'cum_ticks' if bar_type == 'tick' else f'cum_{bar_type}_value'
+            for column in ('date', 'time', 'open', 'high', 'low', 'close', 'cum_buy_volume'):
+                self.assertEqual(live_bars[column].tolist(), backtest_bars[column].tolist())
+            self.assertEqual(live_bars[f'cum_{bar_type}_value'].tolist(),
+                             backtest_bars['cum_volume' if bar_type == 'volume' else metric].tolist())
+
+            standard_bars = StandardBars(metric=bar_type, threshold=threshold, batch_size=300).batch_run(
+                trades[['Date', 'Price', 'Volume']], verbose=False)
+            for column in ('open', 'high', 'low', 'close'):
+                self.assertEqual(live_bars[column].tolist(), standard_bars[column].tolist())
+
+    def test_checkpoint_resumes_live_bars(self):
+        import os
+        import tempfile
+        trades = pd.read_csv('test_data.csv').to_dict('records')
+        uninterrupted = RealTimeBars(threshold=10000, bar_type='dollar')
+        for trade in trades:
+            uninterrupted.handle_trade(trade)
+
+        live = RealTimeBars(threshold=10000, bar_type='dollar')
+        for trade in trades[:437]:
+            live.handle_trade(trade)
+        resumed_bars = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_path = os.path.join(tmp_dir, 'live.ckpt')
+            # The checkpoint does not grow with the number of bars emitted
+            uninterrupted.save_checkpoint(checkpoint_path)
+            late_size = os.path.getsize(checkpoint_path)
+            live.save_checkpoint(checkpoint_path, offset=436)
+            self.assertTrue(len(uninterrupted.bars) > 2 * len(live.bars))
+            self.assertLess(abs(late_size - os.path.getsize(checkpoint_path)), 64)
+            resumed, offset = RealTimeBars.from_checkpoint(checkpoint_path, on_bar=resumed_bars.append)
+            self.assertEqual(len(resumed.bars), 0)
+            self.assertEqual(resumed.bars.capacity, live.bars.capacity)
+        for trade in trades[offset + 1:]:
+            resumed.handle_trade(trade)
+        self.assertEqual(live.get_bars().values.tolist() + resumed_bars, uninterrupted.get_bars().values.tolist())
+
     def tearDown(self):
         # Clean up the test data file
         import os
         os.remove('test_data.csv')
 
+
+@unittest.skipIf(websockets is None, 'websockets is not installed')
+class TestTradeStream(unittest.TestCase):
+
+    def setUp(self):
+        # Recorded combined stream messages for two symbols
+        np.random.seed(42)
+        self.messages = [json.dumps({'stream': f'{symbol}@trade', 'data': {
+            'e': 'trade', 'E': 1672531200000 + i * 250, 's': symbol.upper(), 'p': f'{price:.2f}',
+            'q': f'{quantity:.4f}', 'm': bool(maker)}})
+            for i, (symbol, price, quantity, maker) in enumerate(zip(
+                np.random.choice(['ethusdt', 'btcusdt'], 500), 1000 + np.random.rand(500) * 10,
+                np.random.rand(500) * 5, np.random.randint(0, 2, 500)))]
+
+    async def _replay(self, stream):
+        async def handler(connection):
+            for message in self.messages:
+                await connection.send(message)
+
+        async with websockets.serve(handler, 'localhost', 0) as server:
+            stream.base_url = f"ws://localhost:{server.sockets[0].getsockname()[1]}"
+            await stream.run()
+
+    def test_replay_matches_direct_feed(self):
+        stream = TradeStream(stats=LiveStats())
+        streamed = {symbol: [RealTimeBars(threshold=5000, bar_type='dollar'),
+                             RealTimeBars(threshold=3, bar_type='tick')] for symbol in ('ethusdt', 'btcusdt')}
+        for symbol, builders in streamed.items():
+            for builder in builders:
+                stream.register(symbol, builder)
+        asyncio.run(self._replay(stream))
+
+        direct = {symbol: [RealTimeBars(threshold=5000, bar_type='dollar'), RealTimeBars(threshold=3, bar_type='tick')]
+                  for symbol in ('ethusdt', 'btcusdt')}
+        for message in self.messages:
+            payload = json.loads(message)['data']
+            for builder in direct[payload['s'].lower()]:
+                builder.handle_trade(parse_trade(payload))
+
+        self.assertEqual(stream.num_messages, len(self.messages))
+        for symbol in streamed:
+            for streamed_builder, direct_builder in zip(streamed[symbol], direct[symbol]):
+                self.assertTrue(len(direct_builder.bars) > 0)
+                pd.testing.assert_frame_equal(streamed_builder.get_bars(), direct_builder.get_bars())
+
+        snapshot = stream.stats.snapshot()
+        self.assertEqual(snapshot['messages'], len(self.messages))
+        self.assertEqual(snapshot['bars'], sum(len(builder.bars) for builders in streamed.values()
+                                               for builder in builders))
+        emit_latency = snapshot['emit_latency']
+        self.assertTrue(0 <= emit_latency['p50_ms'] <= emit_latency['p99_ms'] <= emit_latency['max_ms'])
+
+    def test_reconnects_after_rejected_handshake(self):
+        stream = TradeStream()
+        builder = RealTimeBars(threshold=3, bar_type='tick')
+        stream.register('ethusdt', builder)
+        stream.register('btcusdt', RealTimeBars(threshold=3, bar_type='tick'))
+        handshakes = []
+
+        def process_request(connection, request):
+            # Refuse the first handshake, as the exchange does when rate limiting
+            handshakes.append(request.path)
+            if len(handshakes) == 1:
+                return connection.respond(503, 'Service Unavailable\n')
+
+        async def handler(connection):
+            for message in self.messages:
+                await connection.send(message)
+            await connection.wait_closed()
+
+        async def run():
+            async with websockets.serve(handler, 'localhost', 0, process_request=process_request) as server:
+                stream.base_url = f"ws://localhost:{server.sockets[0].getsockname()[1]}"
+                task = asyncio.ensure_future(stream.run_forever(retry_delay=0.01))
+                while stream.num_messages < len(self.messages) and not task.done():
+                    await asyncio.sleep(0.01)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+
+        asyncio.run(asyncio.wait_for(run(), 10))
+        self.assertEqual(len(handshakes), 2)
+        self.assertEqual(stream.num_messages, len(self.messages))
+
+    def test_ignores_messages_other_than_trades(self):
+        stream = TradeStream(stats=LiveStats())
+        builder = RealTimeBars(threshold=3, bar_type='tick')
+        stream.register('ethusdt', builder)
+        stream.on_message(json.dumps({'result': None, 'id': 1}))
+        stream.on_message(json.dumps({'error': {'code': 2, 'msg': 'Invalid request'}, 'id': 2}))
+        stream.on_message(json.dumps({'stream': 'ethusdt@kline_1m', 'data': {'e': 'kline', 'E': 1672531200000,
+                                                                             's': 'ETHUSDT'}}))
+        stream.on_message(json.dumps({'data': {'e': 'trade', 'p': '1000.00', 'q': '1.0'}}))
+        self.assertEqual(stream.num_messages, 0)
+        self.assertEqual(stream.stats.snapshot()['messages'], 0)
+        for message in self.messages[:20]:
+            stream.on_message(message)
+        self.assertEqual(stream.num_messages, 20)
+        ignored = sum(json.loads(message)['data']['s'] != 'ETHUSDT' for message in self.messages[:20])
+        self.assertEqual(stream.stats.snapshot()['ignored_messages'], ignored)
+        self.assertEqual(len(builder.bars), (20 - ignored) // 3)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentiles_within_bucket_precision(self):
+        np.random.seed(42)
+        latencies = np.random.lognormal(11, 2, 10000).astype(np.int64)
+        histogram = LatencyHistogram()
+        for latency in latencies.tolist():
+            histogram.record(latency)
+        for percent in (50, 90, 99, 100):
+            expected = np.percentile(latencies, percent, method='inverted_cdf')
+            self.assertLessEqual(abs(histogram.percentile(percent) - expected), expected / 32)
+        self.assertEqual(histogram.max, latencies.max())
+        self.assertEqual(histogram.count, len(latencies))
+
+
+class TestExtractData(unittest.TestCase):
+
+    @staticmethod
+    def convert_row_by_row(input_file, output_file):
+        # The converter of the original repository, one csv row at a time
+        with open(input_file, 'r') as infile, open(output_file, 'w', newline='') as outfile:
+            reader = csv.reader(infile)
+            writer = csv.writer(outfile)
+            writer.writerow(['Datetime', 'Price', 'Volume'])
+            for row in reader:
+                writer.writerow([int(row[4]), row[1], row[2]])
+
+    def test_extract_matches_row_by_row_converter(self):
+        rng = np.random.default_rng(7)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            raw_path = os.path.join(tmp_dir, 'ETHUSDT-trades-2023-09-01.csv')
+            with open(raw_path, 'w') as file:
+                for i in range(25):
+                    price, qty = f'{1600 + rng.random() * 10:.8f}', f'{rng.random():.8f}'
+                    file.write(f'{i},{price},{qty},{float(price) * float(qty):.8f},{1693526400000 + i * 7},'
+                               f'{rng.random() < 0.5},True\n')
+            expected_path = os.path.join(tmp_dir, 'expected.csv')
+            result_path = os.path.join(tmp_dir, 'result.csv')
+            self.convert_row_by_row(raw_path, expected_path)
+            ExtractData().extract_and_save_tick(raw_path, result_path, chunksize=10)
+            with open(expected_path, 'rb') as expected, open(result_path, 'rb') as result:
+                self.assertEqual(expected.read(), result.read())
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class TruncatingHandler(QuietHandler):
+    # Sends only the start of the first response for each archive, then closes the connection
+    truncated = set()
+
+    def copyfile(self, source, outputfile):
+        if self.path.endswith('.zip') and self.path not in self.truncated:
+            self.truncated.add(self.path)
+            outputfile.write(source.read(10))
+            self.close_connection = True
+            return
+        super().copyfile(source, outputfile)
+
+
+class CorruptingHandler(QuietHandler):
+    # Flips the bytes of the first response for each archive, keeping its length
+    corrupted = set()
+
+    def copyfile(self, source, outputfile):
+        if self.path.endswith('.zip') and self.path not in self.corrupted:
+            self.corrupted.add(self.path)
+            outputfile.write(bytes(255 - byte for byte in source.read()))
+            return
+        super().copyfile(source, outputfile)
+
+
+class TestDownloadManager(unittest.TestCase):
+
+    def setUp(self):
+        # Local stand-in for data.binance.vision: two tickers over three days, one day not published and one archive
+        # whose checksum does not match
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.server_dir = os.path.join(self.tmp_dir.name, 'server')
+        self.manager = DownloadManager(os.path.join(self.tmp_dir.name, 'local'), max_workers=4, retries=0)
+        for ticker in ('ETHUSDT', 'BTCUSDT'):
+            for day in ('2023-09-01', '2023-09-02', '2023-09-03'):
+                if (ticker, day) == ('BTCUSDT', '2023-09-03'):
+                    continue
+                path = os.path.join(self.server_dir, self.manager.archive_path(ticker, pd.Timestamp(day).date()))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with zipfile.ZipFile(path, 'w') as archive:
+                    archive.writestr(os.path.basename(path)[:-4] + '.csv',
+                                     f'1,1600.5,0.1,160.05,{day[-1]}000,True,True\n')
+                with open(path, 'rb') as file:
+                    checksum = hashlib.sha256(file.read()).hexdigest()
+                if (ticker, day) == ('ETHUSDT', '2023-09-02'):
+                    checksum = '0' * 64
+                with open(path + '.CHECKSUM', 'w') as file:
+                    file.write(f'{checksum}  {os.path.basename(path)}\n')
+
+        handler = functools.partial(QuietHandler, directory=self.server_dir)
+        self.server = http.server.ThreadingHTTPServer(('localhost', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.manager.base_url = f'http://localhost:{self.server.server_address[1]}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def test_download_verify_and_skip(self):
+        completed = []
+        self.manager.on_complete = lambda path, ticker, day: completed.append(pd.read_csv(path, header=None))
+        report = self.manager.download(['ETHUSDT', 'BTCUSDT'], '2023-09-01', '2023-09-03')
+        self.assertEqual(len(report['downloaded']), 4)
+        self.assertEqual(len(completed), 4)
+        self.assertEqual(report['missing'], [self.manager.archive_path('BTCUSDT', pd.Timestamp('2023-09-03').date())])
+        failed = self.manager.archive_path('ETHUSDT', pd.Timestamp('2023-09-02').date())
+        self.assertEqual(list(report['failed']), [failed])
+        self.assertFalse(os.path.exists(os.path.join(self.manager.dest_dir, failed)))
+        for path in report['downloaded']:
+            with open(os.path.join(self.server_dir, path), 'rb') as expected, \
+                    open(os.path.join(self.manager.dest_dir, path), 'rb') as result:
+                self.assertEqual(expected.read(), result.read())
+
+        # A new manager reads the manifest and only asks for the archives it does not have
+        again = DownloadManager(self.manager.dest_dir, self.manager.base_url, retries=0)
+        report = again.download(['ETHUSDT', 'BTCUSDT'], '2023-09-01', '2023-09-03')
+        self.assertEqual(len(report['skipped']), 4)
+        self.assertEqual(report['downloaded'], [])
+        self.assertEqual(list(report['failed']), [failed])
+
+    def _serve(self, handler_class):
+        server = http.server.ThreadingHTTPServer(('localhost', 0),
+                                                 functools.partial(handler_class, directory=self.server_dir))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f'http://localhost:{server.server_address[1]}'
+
+    def test_truncated_download_is_retried(self):
+        TruncatingHandler.truncated = set()
+        base_url = self._serve(TruncatingHandler)
+        path = self.manager.archive_path('ETHUSDT', pd.Timestamp('2023-09-01').date())
+        local_path = os.path.join(self.manager.dest_dir, path)
+
+        # Without retries the truncated body fails the archive, and no partial file is left
+        report = DownloadManager(self.manager.dest_dir, base_url, retries=0).download(['ETHUSDT'], '2023-09-01',
+                                                                                      '2023-09-01')
+        self.assertEqual(list(report['failed']), [path])
+        self.assertFalse(os.path.exists(local_path))
+        self.assertFalse(os.path.exists(local_path + '.part'))
+
+        TruncatingHandler.truncated = set()
+        report = DownloadManager(self.manager.dest_dir, base_url, retries=1).download(['ETHUSDT'], '2023-09-01',
+                                                                                      '2023-09-01')
+        self.assertEqual(report['downloaded'], [path])
+        with open(os.path.join(self.server_dir, path), 'rb') as expected, open(local_path, 'rb') as result:
+            self.assertEqual(expected.read(), result.read())
+
+    def test_checksum_mismatch_is_retried(self):
+        CorruptingHandler.corrupted = set()
+        base_url = self._serve(CorruptingHandler)
+        path = self.manager.archive_path('ETHUSDT', pd.Timestamp('2023-09-01').date())
+        local_path = os.path.join(self.manager.dest_dir, path)
+
+        report = DownloadManager(self.manager.dest_dir, base_url, retries=0).download(['ETHUSDT'], '2023-09-01',
+                                                                                      '2023-09-01')
+        self.assertIsInstance(report['failed'][path], ValueError)
+        self.assertFalse(os.path.exists(local_path + '.part'))
+
+        CorruptingHandler.corrupted = set()
+        report = DownloadManager(self.manager.dest_dir, base_url, retries=1).download(['ETHUSDT'], '2023-09-01',
+                                                                                      '2023-09-01')
+        self.assertEqual(report['downloaded'], [path])
+        with open(os.path.join(self.server_dir, path), 'rb') as expected, open(local_path, 'rb') as result:
+            self.assertEqual(expected.read(), result.read())
+
+    def test_failed_hook_is_reported(self):
+        def on_complete(path, ticker, day):
+            if ticker == 'BTCUSDT':
+                raise RuntimeError('conversion failed')
+
+        self.manager.on_complete = on_complete
+        report = self.manager.download(['ETHUSDT', 'BTCUSDT'], '2023-09-01', '2023-09-02')
+        btc_paths = [self.manager.archive_path('BTCUSDT', pd.Timestamp(day).date())
+                     for day in ('2023-09-01', '2023-09-02')]
+        self.assertEqual(len(report['downloaded']), 1)
+        self.assertEqual(len(report['failed']), 3)
+        self.assertTrue(all(isinstance(report['failed'][path], RuntimeError) for path in btc_paths))
+
+        # The archives whose hook failed are processed again by the next run
+        self.manager.on_complete = None
+        report = self.manager.download(['ETHUSDT', 'BTCUSDT'], '2023-09-01', '2023-09-02')
+        self.assertEqual(sorted(report['downloaded']), sorted(btc_paths))
+
+
 if __name__ == '__main__':
     unittest.main()
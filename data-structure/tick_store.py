@@ -0,0 +1,367 @@
+"""
+Columnar binary storage for tick data.
+
+Text parsing dominates the cost of building bars from multi-GB csv dumps. Tick data can instead be converted once
+into one of two binary formats, which BaseBars.batch_run reads in batches without any parsing and with only the tick
+columns (date_time, price, volume and, if present, is_buyer_maker):
+
+- a tick store: a directory with one raw binary file per column and a json header. The files are opened with
+  np.memmap, so every batch is a zero-copy slice of the page cache.
+- a Parquet file (requires pyarrow), read one record batch at a time.
+"""
+
+import io
+import json
+import os
+from typing import Generator, Iterable, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from bar_engine import detect_time_unit, to_epoch_ns
+
+# Columns of the tick data. The aggressor flag is optional; without it ticks are signed with the tick rule.
+TICK_COLUMNS = ['date_time', 'price', 'volume', 'is_buyer_maker']
+TICK_STORE_HEADER = 'meta.json'
+
+
+def _as_tick_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Names the columns of tick data positionally (date_time, price, volume[, is_buyer_maker]) and makes string
+    timestamps datetime64, so every column has a fixed-width dtype.
+
+    :param df: (pd.DataFrame) Tick data with 3 or 4 columns
+    :return: (pd.DataFrame) Tick data with the TICK_COLUMNS names
+    """
+    df = df.set_axis(TICK_COLUMNS[:df.shape[1]], axis=1)
+    if df['date_time'].dtype == object:
+        df['date_time'] = pd.to_datetime(df['date_time'])
+    return df
+
+
+def normalize_timestamps(batch: pd.DataFrame, unit: Optional[str] = None,
+                         copy: bool = False) -> Tuple[pd.DataFrame, Optional[str]]:
+    """
+    Parses the first column of a batch of ticks into datetime64[ns], i.e. int64 nanoseconds since the epoch, once at
+    ingest, so later stages compare and bucket integers instead of parsing strings. Only that column is replaced; the
+    other columns are not copied.
+
+    :param batch: (pd.DataFrame) Ticks, with the timestamps in the first column
+    :param unit: (str) Unit of numeric timestamps ('s', 'ms', 'us' or 'ns'), None to detect it from their magnitude
+    :param copy: (bool) Replace the column in a shallow copy of batch, e.g. a slice of the caller's DataFrame, instead
+                 of in batch itself
+    :return: (tuple) Batch, and the unit of its numeric timestamps to read the next batches of the same file with
+    """
+    values = batch.iloc[:, 0].to_numpy()
+    if values.dtype == 'datetime64[ns]' or not len(values):
+        return batch, unit
+    if values.dtype.kind in 'iuf' and unit is None:
+        unit = detect_time_unit(values)
+    if copy:
+        batch = batch.copy(deep=False)
+    batch.isetitem(0, to_epoch_ns(values, unit).view('datetime64[ns]'))
+    return batch, unit
+
+
+def _read_input(file_path_or_df: Union[str, Iterable[str], pd.DataFrame],
+                batch_size: int) -> Generator[pd.DataFrame, None, None]:
+    """
+    Yields batches of csv file(s) or of a DataFrame, in the layout read by the bar builders.
+    """
+    if isinstance(file_path_or_df, pd.DataFrame):
+        for start in range(0, len(file_path_or_df), batch_size):
+            yield file_path_or_df.iloc[start:start + batch_size]
+        return
+    if isinstance(file_path_or_df, str):
+        file_path_or_df = [file_path_or_df]
+    for file_path in file_path_or_df:
+        for batch in pd.read_csv(file_path, chunksize=batch_size):
+            yield batch
+
+
+class TickStoreWriter:
+    """
+    Appends batches of ticks to a tick store directory. The json header is written on close, so a store is only
+    readable once it has been completely written.
+    """
+
+    def __init__(self, path: str):
+        """
+        Constructor
+
+        :param path: (str) Directory of the tick store, created if needed. Existing column files are overwritten.
+        """
+        self.path = path
+        self.dtypes = None
+        self.num_rows = 0
+        self._files = {}
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, batch: pd.DataFrame) -> None:
+        """
+        Appends a batch of ticks.
+
+        :param batch: (pd.DataFrame) Tick data with 3 or 4 columns: date_time, price, volume[, is_buyer_maker]
+        """
+        batch = _as_tick_frame(batch)
+        if self.dtypes is None:
+            self.dtypes = {column: batch[column].dtype.str for column in batch.columns}
+            self._files = {column: open(os.path.join(self.path, f'{column}.bin'), 'wb') for column in batch.columns}
+        for column, file in self._files.items():
+            np.ascontiguousarray(batch[column].to_numpy(), dtype=self.dtypes[column]).tofile(file)
+        self.num_rows += len(batch)
+
+    def close(self) -> None:
+        """
+        Closes the column files and writes the header.
+        """
+        for file in self._files.values():
+            file.close()
+        with open(os.path.join(self.path, TICK_STORE_HEADER), 'w') as file:
+            json.dump({'num_rows': self.num_rows, 'dtypes': self.dtypes or {}}, file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def is_tick_store(path: str) -> bool:
+    """
+    :param path: (str) Path to test
+    :return: (bool) True if path is a tick store directory
+    """
+    return os.path.isfile(os.path.join(path, TICK_STORE_HEADER))
+
+
+def is_parquet(path: str) -> bool:
+    """
+    :param path: (str) Path to test
+    :return: (bool) True if path is a Parquet file
+    """
+    return path.endswith(('.parquet', '.pq'))
+
+
+def write_tick_store(file_path_or_df: Union[str, Iterable[str], pd.DataFrame], path: str,
+                     batch_size: int = 10000000) -> None:
+    """
+    Converts csv file(s) or a DataFrame of ticks into a tick store.
+
+    :param file_path_or_df: (str, iterable of str, or pd.DataFrame) Path to the csv file(s) or Pandas Data Frame
+                            containing raw tick data in the format[date_time, price, volume]
+    :param path: (str) Directory of the tick store
+    :param batch_size: (int) Number of rows converted at a time
+    """
+    with TickStoreWriter(path) as writer:
+        for batch in _read_input(file_path_or_df, batch_size):
+            writer.write(batch)
+
+
+def read_tick_store(path: str) -> pd.DataFrame:
+    """
+    Opens a tick store as a DataFrame backed by memory-mapped column files.
+
+    :param path: (str) Directory of the tick store
+    :return: (pd.DataFrame) Tick data; the columns are read-only views of the files
+    """
+    with open(os.path.join(path, TICK_STORE_HEADER)) as file:
+        header = json.load(file)
+    num_rows = header['num_rows']
+    columns = {}
+    for column, dtype in header['dtypes'].items():
+        if num_rows:
+            columns[column] = np.memmap(os.path.join(path, f'{column}.bin'), dtype=dtype, mode='r',
+                                        shape=(num_rows,))
+        else:
+            columns[column] = np.empty(0, dtype=dtype)
+    return pd.DataFrame(columns, copy=False)
+
+
+def iter_tick_store(path: str, batch_size: int, start: int = 0) -> Generator[pd.DataFrame, None, None]:
+    """
+    Yields zero-copy batches of a tick store.
+
+    :param path: (str) Directory of the tick store
+    :param batch_size: (int) Number of rows per batch
+    :param start: (int) First row to read
+    """
+    ticks = read_tick_store(path)
+    batch_size = int(batch_size)
+    for batch_start in range(start, len(ticks), batch_size):
+        yield ticks.iloc[batch_start:batch_start + batch_size]
+
+
+def _import_pyarrow():
+    """
+    Imports pyarrow lazily, since it is only needed for Parquet files.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError('pyarrow is required to read and write Parquet tick data.') from error
+    return pyarrow
+
+
+class ParquetTickWriter:
+    """
+    Appends batches of ticks to a Parquet file, one or more row groups per batch.
+    """
+
+    def __init__(self, path: str, row_group_size: Optional[int] = 1000000):
+        """
+        Constructor
+
+        :param path: (str) Path of the Parquet file, overwritten if it exists
+        :param row_group_size: (int) Maximum number of rows per Parquet row group
+        """
+        self.pyarrow = _import_pyarrow()
+        self.path = path
+        self.row_group_size = row_group_size
+        self.num_rows = 0
+        self._writer = None
+
+    def write(self, batch: pd.DataFrame) -> None:
+        """
+        Appends a batch of ticks.
+
+        :param batch: (pd.DataFrame) Tick data with 3 or 4 columns: date_time, price, volume[, is_buyer_maker]
+        """
+        table = self.pyarrow.Table.from_pandas(_as_tick_frame(batch), preserve_index=False)
+        if self._writer is None:
+            self._writer = self.pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        self.num_rows += len(batch)
+
+    def close(self) -> None:
+        """
+        Writes the Parquet footer.
+        """
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_tick_writer(path: str) -> Union[TickStoreWriter, ParquetTickWriter]:
+    """
+    :param path: (str) Parquet file if the path ends with .parquet or .pq, tick store directory otherwise
+    :return: (TickStoreWriter or ParquetTickWriter) Writer for the format given by the path
+    """
+    return ParquetTickWriter(path) if is_parquet(path) else TickStoreWriter(path)
+
+
+def write_parquet(file_path_or_df: Union[str, Iterable[str], pd.DataFrame], path: str,
+                  batch_size: int = 10000000, row_group_size: Optional[int] = 1000000) -> None:
+    """
+    Converts csv file(s) or a DataFrame of ticks into a Parquet file.
+
+    :param file_path_or_df: (str, iterable of str, or pd.DataFrame) Path to the csv file(s) or Pandas Data Frame
+                            containing raw tick data in the format[date_time, price, volume]
+    :param path: (str) Path of the Parquet file
+    :param batch_size: (int) Number of rows converted at a time
+    :param row_group_size: (int) Maximum number of rows per Parquet row group
+    """
+    with ParquetTickWriter(path, row_group_size) as writer:
+        for batch in _read_input(file_path_or_df, batch_size):
+            writer.write(batch)
+
+
+def iter_parquet(path: str, batch_size: int, start: int = 0) -> Generator[pd.DataFrame, None, None]:
+    """
+    Yields batches of a Parquet file, reading only the tick columns.
+
+    :param path: (str) Path of the Parquet file
+    :param batch_size: (int) Number of rows per batch
+    :param start: (int) First row to read. The row groups before it are not read.
+    """
+    pyarrow = _import_pyarrow()
+    parquet_file = pyarrow.parquet.ParquetFile(path)
+    columns = [column for column in TICK_COLUMNS if column in parquet_file.schema_arrow.names]
+    row_groups = []
+    for row_group in range(parquet_file.num_row_groups):
+        num_rows = parquet_file.metadata.row_group(row_group).num_rows
+        if not row_groups and start >= num_rows:
+            start -= num_rows
+        else:
+            row_groups.append(row_group)
+    if not row_groups:
+        return
+    for record_batch in parquet_file.iter_batches(batch_size=int(batch_size), columns=columns,
+                                                  row_groups=row_groups):
+        if start >= record_batch.num_rows:
+            start -= record_batch.num_rows
+            continue
+        record_batch, start = record_batch.slice(start), 0
+        yield pd.DataFrame({column: record_batch.column(column).to_numpy(zero_copy_only=False)
+                            for column in columns}, copy=False)
+
+
+def _line_end(block: bytes, start: int, num_lines: int, line_length: float) -> int:
+    """
+    Finds the end of the num_lines-th line of block after start: jumps to its estimated position, counts the line
+    breaks up to there, then moves back one line at a time, so only a few lines are searched in Python.
+
+    :param block: (bytes) Rows of a csv file
+    :param start: (int) Position of the first line
+    :param num_lines: (int) Number of lines
+    :param line_length: (float) Estimated number of bytes per line
+    :return: (int) Position after the line break of the num_lines-th line, -1 if block has fewer lines
+    """
+    position, count = start, 0
+    while count < num_lines:
+        if position == len(block):
+            return -1
+        end = min(position + int((num_lines - count) * line_length) + 1, len(block))
+        count += block.count(b'\n', position, end)
+        position = end
+    for _ in range(count - num_lines + 1):
+        position = block.rfind(b'\n', start, position)
+    return position + 1
+
+
+def iter_csv(path: str, batch_size: int, start: int = 0) -> Generator[Tuple[pd.DataFrame, int], None, None]:
+    """
+    Yields batches of batch_size rows of a csv file with a header line, each with the byte offset where the next
+    batch starts, so a run can be resumed from an offset without parsing the file up to it. The file is read in
+    blocks of about batch_size rows, estimated from the length of the first rows, and the blocks are cut after the
+    batch_size-th line break: only the last batch can be shorter.
+
+    :param path: (str) Path of the csv file
+    :param batch_size: (int) Number of rows per batch
+    :param start: (int) Byte offset of the first row to read, 0 for the first row after the header
+    """
+    batch_size = int(batch_size)
+    with open(path, 'rb') as file:
+        header = file.readline()
+        names = pd.read_csv(io.BytesIO(header), nrows=0).columns
+        sample = file.read(1 << 16)
+        line_length = len(sample) / max(sample.count(b'\n'), 1)
+        # A little more than batch_size rows, so most blocks hold a whole batch
+        block_size = max(int(batch_size * line_length * 1.05), 1 << 16)
+        offset = max(start, len(header))
+        file.seek(offset)
+        rest = b''
+        while True:
+            block = file.read(block_size)
+            if not block:
+                # Last rows, fewer than batch_size
+                if rest.strip():
+                    yield pd.read_csv(io.BytesIO(rest), header=None, names=names), offset + len(rest)
+                return
+            block = rest + block
+            cut = 0
+            while True:
+                end = _line_end(block, cut, batch_size, line_length)
+                if end < 0:
+                    break
+                batch = pd.read_csv(io.BytesIO(memoryview(block)[cut:end]), header=None, names=names)
+                offset += end - cut
+                cut = end
+                yield batch, offset
+            rest = block[cut:]
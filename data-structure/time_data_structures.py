@@ -0,0 +1,173 @@
+"""
+Advances in Financial Machine Learning, Marcos Lopez de Prado
+Chapter 2: Financial Data Structures
+
+This module contains the functions to help users create structured financial data from raw unstructured data,
+in the form of time bars.
+
+Time bars sample at fixed intervals, from a millisecond to a day. The ticks are bucketed with integer arithmetic on
+their epoch-nanosecond timestamps instead of pd.resample, and the bucket in progress is carried from one batch to the
+next, so only one batch of ticks is held in memory however long the data is.
+"""
+
+# Imports
+from typing import Union, Iterable, Optional
+import time
+
+import numpy as np
+import pandas as pd
+
+from base_bars import BaseBars
+from bar_engine import to_epoch_ns
+from bar_sinks import columns_to_bars
+
+# Length of each resolution in nanoseconds
+RESOLUTIONS = {'D': 86400 * 10 ** 9, 'H': 3600 * 10 ** 9, 'MIN': 60 * 10 ** 9, 'S': 10 ** 9, 'MS': 10 ** 6}
+
+
+class TimeBars(BaseBars):
+    """
+    Contains all of the logic to construct the time bars. A bar is labelled with the end of its interval and is
+    closed by the first tick of a later interval; intervals without ticks produce no bar.
+    """
+
+    checkpoint_settings = BaseBars.checkpoint_settings + ('resolution', 'num_units')
+    checkpoint_state = BaseBars.checkpoint_state + ('bucket', 'close_price')
+
+    def __init__(self, resolution: str, num_units: int, batch_size: int = 20000000):
+        """
+        Constructor
+
+        :param resolution: (str) Type of bar resolution: ['D', 'H', 'MIN', 'S', 'MS']
+        :param num_units: (int) Number of resolution units in one bar, e.g. resolution='MIN' and num_units=5 for
+                          5-minute bars
+        :param batch_size: (int) Number of rows to read in from the csv, per batch
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution: {resolution}. Expected one of {list(RESOLUTIONS)}.")
+        super().__init__(metric=None, batch_size=batch_size)
+        self.resolution = resolution
+        self.num_units = num_units
+        self.interval = RESOLUTIONS[resolution] * int(num_units)
+
+        # Interval of the bar in progress, and its close price
+        self.bucket = None
+        self.close_price = None
+
+    def _reset_cache(self):
+        """
+        Implementation of abstract method _reset_cache for time bars
+        """
+        self.open_price = None
+        self.high_price = None
+        self.low_price = None
+        self.close_price = None
+        self.cum_ticks = 0
+        self.cum_dollar_value = 0
+        self.cum_volume = 0
+        self.cum_buy_volume = 0
+
+    def _extract_bars(self, data: pd.DataFrame) -> list:
+        """
+        Compiles the time bars closed within a batch.
+
+        :param data: (pd.DataFrame) Contains 3 columns - date_time, price, and volume, optionally is_buyer_maker.
+        :return: (list) Extracted bars
+        """
+        return columns_to_bars(self._run_columns(data))
+
+    def _run_columns(self, data: pd.DataFrame) -> dict:
+        """
+        Compiles the time bars closed within a batch, as columns.
+
+        :param data: (pd.DataFrame) Contains 3 columns - date_time, price, and volume, optionally is_buyer_maker.
+        :return: (dict) Array of each field of BAR_COLUMNS
+        """
+        signs = self._signed_ticks(data)
+        prices = data.iloc[:, 1].to_numpy(dtype=np.float64)
+        volumes = data.iloc[:, 2].to_numpy(dtype=np.float64)
+        if len(prices) == 0:
+            return self._bar_columns(np.empty(0, dtype=np.int64), *[np.empty(0)] * 7, np.empty(0, dtype=np.int64))
+
+        # A tick stamped before the current interval (out of order data) stays in the bar in progress
+        buckets = to_epoch_ns(data.iloc[:, 0].to_numpy()) // self.interval
+        if self.bucket is not None:
+            buckets[0] = max(buckets[0], self.bucket)
+        np.maximum.accumulate(buckets, out=buckets)
+
+        starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))
+        ends = np.append(starts[1:] - 1, len(prices) - 1)
+        opens, closes = prices[starts], prices[ends]
+        highs, lows = np.maximum.reduceat(prices, starts), np.minimum.reduceat(prices, starts)
+        volume_sums = np.add.reduceat(volumes, starts)
+        buy_volume_sums = np.add.reduceat(np.where(signs > 0, volumes, 0), starts)
+        dollar_sums = np.add.reduceat(prices * volumes, starts)
+        ticks = ends - starts + 1
+        bar_buckets = buckets[starts]
+
+        if self.bucket is not None:
+            carried = (self.bucket, self.open_price, self.high_price, self.low_price, self.close_price,
+                       self.cum_volume, self.cum_buy_volume, self.cum_dollar_value, self.cum_ticks)
+            if bar_buckets[0] == self.bucket:
+                # The batch continues the bar in progress
+                opens[0] = self.open_price
+                highs[0] = max(highs[0], self.high_price)
+                lows[0] = min(lows[0], self.low_price)
+                volume_sums[0] += self.cum_volume
+                buy_volume_sums[0] += self.cum_buy_volume
+                dollar_sums[0] += self.cum_dollar_value
+                ticks[0] += self.cum_ticks
+            else:
+                (bar_buckets, opens, highs, lows, closes, volume_sums, buy_volume_sums, dollar_sums, ticks) = [
+                    np.insert(column, 0, value) for column, value in zip(
+                        (bar_buckets, opens, highs, lows, closes, volume_sums, buy_volume_sums, dollar_sums, ticks),
+                        carried)]
+
+        # The last interval of the batch may still receive ticks
+        self.bucket = int(bar_buckets[-1])
+        self.open_price, self.high_price, self.low_price, self.close_price = opens[-1], highs[-1], lows[-1], closes[-1]
+        self.cum_volume, self.cum_buy_volume = volume_sums[-1], buy_volume_sums[-1]
+        self.cum_dollar_value, self.cum_ticks = dollar_sums[-1], int(ticks[-1])
+
+        return self._bar_columns(bar_buckets[:-1], opens[:-1], highs[:-1], lows[:-1], closes[:-1], volume_sums[:-1],
+                                 buy_volume_sums[:-1], dollar_sums[:-1], ticks[:-1])
+
+    def _bar_columns(self, bar_buckets, opens, highs, lows, closes, volume_sums, buy_volume_sums, dollar_sums,
+                     ticks) -> dict:
+        """
+        :return: (dict) Bar columns, each bar labelled with the end of its interval
+        """
+        date_times = ((bar_buckets + 1) * self.interval).astype('datetime64[ns]')
+        return {'date_time': date_times, 'open': opens, 'high': highs, 'low': lows, 'close': closes,
+                'volume': volume_sums, 'buy_vol': buy_volume_sums, 'ticks': ticks, 'dollar': dollar_sums}
+
+
+def get_time_bars(file_path_or_df: Union[str, Iterable[str], pd.DataFrame], resolution: str = 'D', num_units: int = 1,
+                  batch_size: int = 20000000, verbose: bool = True, to_csv: bool = False,
+                  output_path: Optional[str] = None, timer: bool = False,
+                  processes: Optional[int] = None) -> pd.DataFrame:
+    """
+    Creates the time bars: date_time, open, high, low, close, volume, cum_buy_volume, cum_ticks, cum_dollar_value.
+    The bar of the last interval is left open, as it may continue in data not read yet.
+
+    :param file_path_or_df: (str, iterable of str, or pd.DataFrame) Path to the csv file(s) or Pandas Data Frame containing raw tick data
+                            in the format[date_time, price, volume]. Numeric date_time values are seconds,
+                            milliseconds, microseconds or nanoseconds since the epoch, detected per file.
+    :param resolution: (str) Resolution type ('D', 'H', 'MIN', 'S', 'MS')
+    :param num_units: (int) Number of resolution units in one bar (3 days for example, 2 seconds for example)
+    :param batch_size: (int) The number of rows per batch. Less RAM = smaller batch size.
+    :param verbose: (bool) Print out batch numbers (True or False)
+    :param to_csv: (bool) Save bars to csv after every batch run (True or False)
+    :param output_path: (str) Path to csv file, if to_csv is True
+    :param timer: (bool) Print the time taken to generate the bars
+    :param processes: (int) Number of worker processes reading several files in parallel, None reads them one by one
+    :return: (pd.DataFrame) Dataframe of time bars
+    """
+    time_bars_generator = TimeBars(resolution=resolution, num_units=num_units, batch_size=batch_size)
+    start_time = time.time()
+    bars_df = time_bars_generator.batch_run(file_path_or_df, verbose=verbose, to_csv=to_csv, output_path=output_path,
+                                            processes=processes)
+    elapsed_time = time.time() - start_time
+    if timer:
+        print(f"Time taken to generate bars: {elapsed_time:.2f} seconds")
+    return bars_df
@@ -1,44 +1,146 @@
-import json
-import websocket
+"""
+Live trade ingestion from the Binance trade streams, for the RealTimeBars builders.
+
+A single asyncio task reads one combined stream connection for any number of symbols. Each message is decoded once
+and the trade is passed in turn to every bar builder registered for its symbol, without a thread per message.
+Requires the websockets package. With a LiveStats, the stream also records the latency of every message and bar, see
+live_stats.
+"""
+
+import asyncio
 import datetime
-from DataStructures import *
-import credentials
-from binance.client import Client
-api_key = credentials.api_key
-api_secret = credentials.api_secret
-client = Client(api_key, api_secret)
-
-def on_message(dollar_bar, volume_bar, tick_bar, wsapp, message):
-    json_message = json.loads(message)
-    trade = {
-        'Date': datetime.datetime.fromtimestamp(json_message['E'] / 1000).strftime('%Y-%m-%d'),
-        'Time': datetime.datetime.fromtimestamp(json_message['E'] / 1000).strftime('%H:%M:%S.%f')[:-3],
-        'Price': float(json_message['p']),
-        'Volume': float(json_message['q'])
+import json
+import time
+from collections import defaultdict
+from typing import Optional
+
+from DataStructures import RealTimeBars
+from live_stats import LiveStats
+from logger import logger
+
+BINANCE_STREAM_URL = 'wss://stream.binance.com:9443'
+
+
+def _import_websockets():
+    """
+    Imports websockets lazily, since it is only needed for live data.
+    """
+    try:
+        import websockets
+    except ImportError as error:
+        raise ImportError('websockets is required to stream live trades.') from error
+    return websockets
+
+
+def parse_trade(payload: dict) -> dict:
+    """
+    Converts the payload of a trade stream event into the trade read by RealTimeBars.handle_trade.
+
+    :param payload: (dict) Trade event: E (event time in ms), s (symbol), p (price), q (quantity), m (buyer is maker)
+    :return: (dict) Trade with Date, Time, Price, Volume and IsBuyerMaker
+    """
+    event_time = datetime.datetime.fromtimestamp(payload['E'] / 1000)
+    return {
+        'Date': event_time.strftime('%Y-%m-%d'),
+        'Time': event_time.strftime('%H:%M:%S.%f')[:-3],
+        'Price': float(payload['p']),
+        'Volume': float(payload['q']),
+        'IsBuyerMaker': payload['m']
     }
 
-    dollar_thread = threading.Thread(target=dollar_bar.handle_trade, args=(trade,))
-    volume_thread = threading.Thread(target=volume_bar.handle_trade, args=(trade,))
-    tick_thread = threading.Thread(target=tick_bar.handle_trade, args=(trade,))
 
-    dollar_thread.start()
-    volume_thread.start()
-    tick_thread.start()
+class TradeStream:
+    """
+    Feeds the trades of one or more symbols, received over a single combined stream connection, to bar builders.
+    """
+
+    def __init__(self, base_url: str = BINANCE_STREAM_URL, stats: Optional[LiveStats] = None):
+        """
+        Constructor
+
+        :param base_url: (str) Address of the stream server, e.g. a local server replaying recorded messages
+        :param stats: (LiveStats) Records the latencies of the messages and of the bars emitted from them
+        """
+        self.base_url = base_url.rstrip('/')
+        self.builders = defaultdict(list)
+        self.num_messages = 0
+        self.stats = stats
+
+    def register(self, symbol: str, builder) -> None:
+        """
+        Adds a bar builder for the trades of a symbol.
 
-    dollar_thread.join()
-    volume_thread.join()
-    tick_thread.join()
+        :param symbol: (str) Trading pair, e.g. 'ethusdt'
+        :param builder: (object) Receives every trade of the symbol through handle_trade(trade), which returns the
+                        bar closed by the trade or None
+        """
+        self.builders[symbol.lower()].append(builder)
 
+    @property
+    def url(self) -> str:
+        """
+        :return: (str) Combined stream address for the trades of all the registered symbols
+        """
+        streams = '/'.join(f'{symbol}@trade' for symbol in self.builders)
+        return f'{self.base_url}/stream?streams={streams}'
 
-def ws_trades(dollar_bar, volume_bar, tick_bar):
-    socket = f'wss://stream.binance.com:9443/ws/ethusdt@trade'
+    def on_message(self, message) -> None:
+        """
+        Decodes a message and passes its trade to the builders of its symbol. Messages other than trade events are
+        ignored and not counted.
 
-    wsapp = websocket.WebSocketApp(
-        socket,
-        on_message=lambda wsapp, message: on_message(dollar_bar, volume_bar, tick_bar, wsapp, message),
-        on_error=lambda wsapp, error: print(error)
-    )
-    wsapp.run_forever()
+        :param message: (str or bytes) Combined stream message {"stream": ..., "data": trade event}, or a raw trade
+                        event
+        """
+        received = time.time_ns()
+        payload = json.loads(message)
+        payload = payload.get('data', payload)
+        # Subscription replies and error frames are not trades
+        if not isinstance(payload, dict) or payload.get('e') != 'trade' or 's' not in payload or 'E' not in payload:
+            return
+        builders = self.builders.get(payload['s'].lower())
+        self.num_messages += 1
+        stats = self.stats
+        if stats is not None:
+            stats.record_message(payload['E'], received, bool(builders))
+        if builders:
+            trade = parse_trade(payload)
+            for builder in builders:
+                if builder.handle_trade(trade) is not None and stats is not None:
+                    stats.record_bar(payload['E'], received, time.time_ns())
+
+    async def run(self) -> None:
+        """
+        Processes the messages of one connection until the server closes it.
+        """
+        websockets = _import_websockets()
+        async with websockets.connect(self.url) as connection:
+            async for message in connection:
+                self.on_message(message)
+
+    async def run_forever(self, retry_delay: float = 1.0, report_interval: Optional[float] = None) -> None:
+        """
+        Processes the messages, reconnecting whenever the connection is closed, lost or cannot be opened.
+
+        :param retry_delay: (float) Seconds to wait before reconnecting
+        :param report_interval: (float) Seconds between reports of the statistics, if the stream has a LiveStats
+        """
+        websockets = _import_websockets()
+        reporter = None
+        if self.stats is not None and report_interval is not None:
+            reporter = asyncio.ensure_future(self.stats.report_every(report_interval))
+        try:
+            while True:
+                try:
+                    await self.run()
+                except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as error:
+                    # Lost connections, and handshakes rejected or timed out while reconnecting, e.g. on HTTP 429
+                    # or 503 during rate limits or maintenance
+                    logger.connection_error(error)
+                await asyncio.sleep(retry_delay)
+        finally:
+            if reporter is not None:
+                reporter.cancel()
 
 
 if __name__ == "__main__":
@@ -46,8 +148,11 @@ if __name__ == "__main__":
     threshold_volume = 1000
     threshold_tick = 100
 
-    dollar_bar = RealTimeBars(threshold=threshold_dollar, bar_type='dollar')
-    volume_bar = RealTimeBars(threshold=threshold_volume, bar_type='volume')
-    tick_bar = RealTimeBars(threshold=threshold_tick, bar_type='tick')
+    stream = TradeStream(stats=LiveStats())
+    for bar_type, threshold in (('dollar', threshold_dollar), ('volume', threshold_volume), ('tick', threshold_tick)):
+        def print_bar(bar, name=bar_type.capitalize()):
+            print(f"{name} Bar created: {bar}")
+
+        stream.register('ethusdt', RealTimeBars(threshold=threshold, bar_type=bar_type, on_bar=print_bar))
 
-    ws_trades(dollar_bar, volume_bar, tick_bar)
\ No newline at end of file
+    asyncio.run(stream.run_forever(report_interval=60))